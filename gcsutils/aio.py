@@ -0,0 +1,975 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+import base64
+import contextlib
+import json
+import mimetypes
+import os
+import time
+import urllib.parse
+import weakref
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Tuple,
+)
+
+import google.auth
+import google.auth.transport.requests
+import google_crc32c
+from google.api_core import exceptions
+from google.auth.credentials import (
+    AnonymousCredentials,
+    Credentials,
+    with_scopes_if_required,
+)
+from google.resumable_media import DataCorruption
+
+from gcsutils import metrics, scheduler
+from gcsutils.credentials import (
+    get_credential_source,
+    get_service_account_credentials,
+)
+from gcsutils.hedge import HedgePolicy
+from gcsutils.manifest import crc32c_of_file
+from gcsutils.retry import DEFAULT_RETRY, RetryPolicy
+from gcsutils.transfer import (
+    DEFAULT_MAX_WORKERS,
+    TransferError,
+    TransferResult,
+    TransferSummary,
+    get_file_paths_from_directory,
+)
+
+try:
+    import aiohttp
+    import yarl
+except ImportError:  # pragma: no cover - aiohttp is an optional dependency
+    aiohttp = None
+
+DEFAULT_ENDPOINT = "https://storage.googleapis.com"
+_SCOPES = ["https://www.googleapis.com/auth/devstorage.full_control"]
+_READ_SIZE = 1024 * 1024
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _load_credentials() -> Credentials:
+    credentials = get_service_account_credentials()
+    if credentials is None:
+        credentials, _ = google.auth.default()
+
+    return with_scopes_if_required(credentials, _SCOPES)
+
+
+def _object_path(gcs_bucket_name: str, gcs_file_path: str) -> str:
+    return "/b/{}/o/{}".format(
+        urllib.parse.quote(gcs_bucket_name, safe=""),
+        urllib.parse.quote(gcs_file_path, safe=""),
+    )
+
+
+async def _error_from_response(response) -> exceptions.GoogleAPICallError:
+    content = await response.read()
+    try:
+        message = json.loads(content)["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        message = content.decode("utf-8", "replace") or response.reason
+
+    return exceptions.from_http_status(
+        response.status, "{} {}: {}".format(response.method, response.url, message)
+    )
+
+
+class AsyncStorageClient:
+    """A Google Cloud Storage client for asyncio applications.
+
+    All requests share one aiohttp session, so connections are pooled and
+    reused, and at most `max_concurrency` requests are in flight at once; other
+    requests wait on a semaphore without blocking the event loop. Blocking
+    work (loading credentials, refreshing access tokens, and local file I/O)
+    runs on the event loop's default executor.
+
+    Use the client as an async context manager, or await `close` when done.
+    The functions of this module use a shared client per event loop; see
+    `get_storage_client`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      max_concurrency (int): the maximum number of concurrent requests
+                             (default 16)
+      endpoint (str): optional; the API endpoint (default STORAGE_EMULATOR_HOST
+                      if it is set, otherwise https://storage.googleapis.com);
+                      requests to a custom endpoint are not authenticated
+      session (aiohttp.ClientSession): optional; a session to share with the
+                                       application, which is left open when the
+                                       client is closed
+    """
+
+    def __init__(
+        self,
+        gcp_project_name: str,
+        max_concurrency: int = DEFAULT_MAX_WORKERS,
+        endpoint: Optional[str] = None,
+        session: Optional["aiohttp.ClientSession"] = None,
+    ):
+        if aiohttp is None:
+            raise ImportError(
+                "gcsutils.aio requires aiohttp; install it with gcsutils[aio]"
+            )
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.project = gcp_project_name
+        self.max_concurrency = max_concurrency
+        endpoint = endpoint or os.environ.get("STORAGE_EMULATOR_HOST")
+        self._credentials = AnonymousCredentials() if endpoint else None
+        endpoint = endpoint or DEFAULT_ENDPOINT
+        if "://" not in endpoint:
+            endpoint = "http://" + endpoint
+        self.endpoint = endpoint.rstrip("/")
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._credentials_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the client's HTTP session, if the client created it."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _grow(self, max_concurrency: int) -> None:
+        # Releasing extra permits raises the limit of an asyncio.Semaphore
+        for _ in range(max_concurrency - self.max_concurrency):
+            self._semaphore.release()
+        self.max_concurrency = max(max_concurrency, self.max_concurrency)
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None:
+            # The semaphore, not the connector, limits concurrency, so that
+            # the limit can be raised on a live client
+            connector = aiohttp.TCPConnector(limit=0)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _authorization(self) -> Dict[str, str]:
+        credentials = self._credentials
+        if credentials is None or not credentials.valid:
+            loop = asyncio.get_running_loop()
+            async with self._credentials_lock:
+                if self._credentials is None:
+                    start = time.monotonic()
+                    self._credentials = await loop.run_in_executor(
+                        None, _load_credentials
+                    )
+                    metrics.record(metrics.CLIENT_CREATION, time.monotonic() - start)
+                credentials = self._credentials
+                if not credentials.valid:
+                    request = google.auth.transport.requests.Request()
+                    await loop.run_in_executor(None, credentials.refresh, request)
+        if isinstance(credentials, AnonymousCredentials):
+            return {}
+
+        return {"Authorization": "Bearer {}".format(credentials.token)}
+
+    @contextlib.asynccontextmanager
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ) -> AsyncIterator["aiohttp.ClientResponse"]:
+        # Object names are quoted into the path by the caller, so the URL is
+        # passed to aiohttp as already encoded
+        headers = {**(headers or {}), **await self._authorization()}
+        url = yarl.URL(self.endpoint + path, encoded=True)
+        if params:
+            url = url.update_query(
+                {key: str(value) for key, value in params.items() if value is not None}
+            )
+        queued = time.monotonic()
+        async with self._semaphore:
+            metrics.record(metrics.QUEUE_WAIT, time.monotonic() - queued)
+            async with self._get_session().request(
+                method, url, headers=headers, **kwargs
+            ) as response:
+                if response.status >= 400:
+                    raise await _error_from_response(response)
+                yield response
+
+
+def get_storage_client(
+    gcp_project_name: str, max_concurrency: Optional[int] = None
+) -> AsyncStorageClient:
+    """Get the shared asynchronous storage client of the running event loop.
+
+    Clients are cached per event loop, project and credential source, like
+    `gcsutils.gcs.get_storage_client`. Call this from a coroutine, and await
+    `close_storage_clients` before the event loop is closed.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      max_concurrency (int): optional; the minimum number of concurrent
+                             requests the client should allow. A new client
+                             allows 16 unless this is given; the limit of an
+                             existing client is only ever raised.
+
+    Returns a gcsutils.aio.AsyncStorageClient
+    """
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    key = (gcp_project_name, get_credential_source())
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = AsyncStorageClient(
+            gcp_project_name, max_concurrency or DEFAULT_MAX_WORKERS
+        )
+    elif max_concurrency is not None and max_concurrency > client.max_concurrency:
+        client._grow(max_concurrency)
+
+    return client
+
+
+async def close_storage_clients() -> None:
+    """Close and discard the shared storage clients of the running event loop."""
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+async def _aiter(iterable: Iterable) -> AsyncIterator:
+    for item in iterable:
+        yield item
+
+
+async def _run_transfers(
+    transfer: Callable[[Any, Any], Awaitable[int]],
+    items: AsyncIterator[Tuple[Any, Any]],
+    max_workers: int,
+) -> TransferSummary:
+    # The asyncio counterpart of gcsutils.transfer.run_transfers
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+
+    async def run(source, destination):
+        result = TransferResult(source, destination)
+        start = time.monotonic()
+        try:
+            with scheduler.priority(scheduler.BULK):
+                result.bytes_transferred = await transfer(source, destination) or 0
+        except Exception as e:
+            result.error = e
+        result.elapsed = time.monotonic() - start
+        return result
+
+    summary = TransferSummary()
+    start = time.monotonic()
+    pending = set()
+    try:
+        async for source, destination in items:
+            if len(pending) >= max_workers * 2:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    summary.add(task.result())
+            pending.add(asyncio.ensure_future(run(source, destination)))
+        for task in asyncio.as_completed(pending):
+            summary.add(await task)
+        pending = set()
+    finally:
+        for task in pending:
+            task.cancel()
+    summary.elapsed = time.monotonic() - start
+
+    return summary
+
+
+async def _list_objects(
+    client: AsyncStorageClient,
+    gcs_bucket_name: str,
+    prefix: str,
+    delimiter: Optional[str] = None,
+    fields: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> AsyncIterator[dict]:
+    path = "/storage/v1/b/{}/o".format(urllib.parse.quote(gcs_bucket_name, safe=""))
+    params = {"prefix": prefix, "delimiter": delimiter, "fields": fields}
+
+    async def get_page():
+        async with client._request("GET", path, params) as response:
+            return json.loads(await response.read())
+
+    while True:
+        with metrics.measure("list"):
+            page = await retry.run_async(get_page)
+        for item in page.get("items", []):
+            yield item
+        params["pageToken"] = page.get("nextPageToken")
+        if not params["pageToken"]:
+            return
+
+
+async def list_bucket_contents(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    recurse: bool = False,
+    fields: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> AsyncIterator[dict]:
+    """List the objects in a Google Cloud Storage bucket.
+
+    Pages of the listing are requested as the iteration reaches them; use
+    `async for` to iterate.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket
+      recurse (bool): when True, include the contents of all subfolders (default False)
+      fields (str): optional; a partial response selector, which must include
+                    nextPageToken (eg/ "items(name,size),nextPageToken")
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns an async iterator of object resources, as dicts
+    """
+    client = get_storage_client(gcp_project_name)
+    if not gcs_bucket_path.endswith("/"):
+        gcs_bucket_path = gcs_bucket_path + "/"
+    delimiter = None if recurse else "/"
+    async for item in _list_objects(
+        client, gcs_bucket_name, gcs_bucket_path, delimiter, fields, retry
+    ):
+        yield item
+
+
+def _expected_crc32c(headers) -> Optional[str]:
+    for value in headers.getall("x-goog-hash", []):
+        for checksum in value.split(","):
+            name, _, digest = checksum.strip().partition("=")
+            if name == "crc32c":
+                return digest
+    return None
+
+
+async def _download(
+    client: AsyncStorageClient,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    write: Callable[[bytes], Awaitable[Any]],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    meter: Optional[Callable[[int], Awaitable[float]]] = None,
+) -> int:
+    # Objects stored with gzip content encoding are decompressed by the
+    # service, and can not be verified against their stored checksum. The
+    # meter of a scheduled transfer paces the chunks as they arrive.
+    headers = {"Accept-Encoding": "identity"}
+    ranged = start is not None or end is not None
+    if ranged:
+        headers["Range"] = "bytes={}-{}".format(start or 0, "" if end is None else end)
+    path = "/storage/v1" + _object_path(gcs_bucket_name, gcs_file_path)
+    checksum = google_crc32c.Checksum()
+    size = 0
+    async with client._request("GET", path, {"alt": "media"}, headers) as response:
+        expected = _expected_crc32c(response.headers)
+        transcoded = response.headers.get("x-goog-stored-content-encoding") == "gzip"
+        async for chunk in response.content.iter_chunked(_READ_SIZE):
+            checksum.update(chunk)
+            size += len(chunk)
+            if meter is not None:
+                await meter(len(chunk))
+            await write(chunk)
+
+    actual = base64.b64encode(checksum.digest()).decode("utf-8")
+    if not ranged and not transcoded and expected not in (None, actual):
+        raise DataCorruption(
+            None,
+            "Checksum mismatch while downloading {}: expected CRC32C {}, "
+            "got {}".format(gcs_file_path, expected, actual),
+        )
+
+    return size
+
+
+async def download_bytes(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    hedge: Optional[HedgePolicy] = None,
+) -> bytes:
+    """Download an object, or a byte range of it, into memory.
+
+    With a `gcsutils.hedge.HedgePolicy`, a download that is slower than usual
+    is raced against a second request, and the slower one is cancelled.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_path (str): the object path in GCS, including the file name
+      start (int): optional; the first byte to download (default 0)
+      end (int): optional; the last byte to download, inclusive (default the
+                 end of the object)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+      hedge (gcsutils.hedge.HedgePolicy): optional; when given, hedge slow
+                                          downloads
+
+    Returns the content of the object as bytes
+    """
+    client = get_storage_client(gcp_project_name)
+    buffer_bytes = _READ_SIZE if end is None else end - (start or 0) + 1
+
+    async def download():
+        chunks = []
+
+        async def write(chunk):
+            chunks.append(chunk)
+
+        async with scheduler.transfer_async(scheduler.DOWNLOAD, buffer_bytes) as meter:
+            await _download(
+                client, gcs_bucket_name, gcs_file_path, write, start, end, meter
+            )
+        return b"".join(chunks)
+
+    async def hedged_download():
+        return await hedge.run_async(download)
+
+    try:
+        with metrics.measure("download") as measurement:
+            data = await retry.run_async(
+                download if hedge is None else hedged_download, transfer=True
+            )
+            measurement.bytes_transferred = len(data)
+    except exceptions.NotFound:
+        raise ValueError("File not found at {}".format(gcs_file_path))
+
+    return data
+
+
+async def _download_to_file(
+    client: AsyncStorageClient,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    local_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    loop = asyncio.get_running_loop()
+
+    async def download():
+        # Each attempt truncates the file and writes it from the start
+        f = await loop.run_in_executor(None, open, local_file_path, "wb")
+
+        async def write(chunk):
+            await loop.run_in_executor(None, f.write, chunk)
+
+        try:
+            async with scheduler.transfer_async(
+                scheduler.DOWNLOAD, _READ_SIZE
+            ) as meter:
+                return await _download(
+                    client, gcs_bucket_name, gcs_file_path, write, meter=meter
+                )
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    try:
+        with metrics.measure("download") as measurement:
+            measurement.bytes_transferred = await retry.run_async(
+                download, transfer=True
+            )
+            return measurement.bytes_transferred
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            await loop.run_in_executor(None, os.remove, local_file_path)
+        raise
+
+
+async def download_file(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    local_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> None:
+    """Download an object from a Google Cloud Storage bucket.
+
+    The object is streamed to the local file, which is removed again if the
+    download fails.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_path (str): the source object path in GCS,
+                           including the file name
+      local_file_path (str): the full path where the object should
+                             be downloaded, including the file name
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+    client = get_storage_client(gcp_project_name)
+    try:
+        await _download_to_file(
+            client, gcs_bucket_name, gcs_file_path, local_file_path, retry
+        )
+    except exceptions.NotFound:
+        raise ValueError("File not found at {}".format(gcs_file_path))
+
+
+async def download_files(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    directory: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> TransferSummary:
+    """Download objects from a Google Cloud Storage bucket.
+
+    The asyncio counterpart of `gcsutils.gcs.download_files`: objects are
+    downloaded concurrently while the listing is still being paged through,
+    and every object is attempted before any error is reported.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket
+      directory (str): the full path to the local directory where the objects
+                       should be downloaded
+      max_workers (int): the number of concurrent downloads (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any download
+                             failed (default True)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a gcsutils.transfer.TransferSummary
+    """
+    client = get_storage_client(gcp_project_name, max_workers)
+    if not gcs_bucket_path.endswith("/"):
+        gcs_bucket_path = gcs_bucket_path + "/"
+
+    async def items():
+        fields = "items(name),nextPageToken"
+        objects = _list_objects(
+            client, gcs_bucket_name, gcs_bucket_path, "/", fields, retry
+        )
+        async for item in objects:
+            basename = item["name"].split("/")[-1]
+            if basename:
+                yield item["name"], os.path.join(directory, basename)
+
+    async def transfer(name, local_file_path):
+        return await _download_to_file(
+            client, gcs_bucket_name, name, local_file_path, retry
+        )
+
+    summary = await _run_transfers(transfer, items(), max_workers)
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
+
+
+async def _upload(
+    client: AsyncStorageClient,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    data: Any,
+    content_type: Optional[str] = None,
+    if_generation_match: Optional[int] = None,
+    size: Optional[int] = None,
+) -> dict:
+    path = "/upload/storage/v1/b/{}/o".format(
+        urllib.parse.quote(gcs_bucket_name, safe="")
+    )
+    params = {
+        "uploadType": "media",
+        "name": gcs_file_path,
+        "ifGenerationMatch": if_generation_match,
+    }
+    headers = {"Content-Type": content_type or "application/octet-stream"}
+    if size is not None:
+        # Sent as a stream of chunks rather than with chunked encoding
+        headers["Content-Length"] = str(size)
+    async with client._request("POST", path, params, headers, data=data) as response:
+        return json.loads(await response.read())
+
+
+async def _get_object(
+    client: AsyncStorageClient, gcs_bucket_name: str, gcs_file_path: str
+) -> Optional[dict]:
+    path = "/storage/v1" + _object_path(gcs_bucket_name, gcs_file_path)
+    try:
+        async with client._request("GET", path) as response:
+            return json.loads(await response.read())
+    except exceptions.NotFound:
+        return None
+
+
+async def _metered_chunks(
+    data: Any, meter: Callable[[int], Awaitable[float]]
+) -> AsyncIterator[bytes]:
+    # Send bytes or a file in chunks, paced by the meter of a scheduled
+    # transfer as each chunk is sent
+    if isinstance(data, bytes):
+        for start in range(0, len(data), _READ_SIZE):
+            end = start + _READ_SIZE
+            chunk = data[start:end]
+            await meter(len(chunk))
+            yield chunk
+        return
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, data.read, _READ_SIZE)
+        if not chunk:
+            return
+        await meter(len(chunk))
+        yield chunk
+
+
+async def _upload_with_retry(
+    client: AsyncStorageClient,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    open_data: Callable[[], AsyncContextManager[Any]],
+    size: int,
+    crc32c: Callable[[], Awaitable[str]],
+    content_type: Optional[str],
+    retry: RetryPolicy,
+) -> dict:
+    # As in gcsutils.gcs._upload_with_retry: an upload that was stored despite
+    # failing is not repeated, and retries only replace the generation found
+    # at the first lookup.
+    precondition = None
+    attempts = 0
+
+    async def upload():
+        nonlocal attempts, precondition
+        attempts += 1
+        if attempts > 1:
+            current = await _get_object(client, gcs_bucket_name, gcs_file_path)
+            if current is not None and current.get("crc32c") == await crc32c():
+                return current
+            if precondition is None:
+                precondition = int(current["generation"]) if current else 0
+        buffer_bytes = min(size, _READ_SIZE)
+        async with scheduler.transfer_async(scheduler.UPLOAD, buffer_bytes) as meter:
+            async with open_data() as data:
+                if meter is not None:
+                    data = _metered_chunks(data, meter)
+                return await _upload(
+                    client,
+                    gcs_bucket_name,
+                    gcs_file_path,
+                    data,
+                    content_type,
+                    precondition,
+                    size,
+                )
+
+    with metrics.measure("upload") as measurement:
+        resource = await retry.run_async(upload, transfer=True)
+        measurement.bytes_transferred = int(resource.get("size", 0))
+
+    return resource
+
+
+async def upload_bytes(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    data: bytes,
+    content_type: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> dict:
+    """Upload bytes from memory to an object in a Google Cloud Storage bucket.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_path (str): the object path in GCS, including the file name
+      data (bytes): the content of the object
+      content_type (str): optional; the content type of the object
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns the resource of the created object, as a dict
+    """
+    client = get_storage_client(gcp_project_name)
+
+    @contextlib.asynccontextmanager
+    async def open_data():
+        yield data
+
+    async def crc32c():
+        return base64.b64encode(google_crc32c.Checksum(data).digest()).decode("utf-8")
+
+    return await _upload_with_retry(
+        client,
+        gcs_bucket_name,
+        gcs_file_path,
+        open_data,
+        len(data),
+        crc32c,
+        content_type,
+        retry,
+    )
+
+
+async def _upload_from_file(
+    client: AsyncStorageClient,
+    gcs_bucket_name: str,
+    file_path: str,
+    blob_name: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    # aiohttp reads a file payload on the default executor
+    loop = asyncio.get_running_loop()
+
+    @contextlib.asynccontextmanager
+    async def open_data():
+        f = await loop.run_in_executor(None, open, file_path, "rb")
+        try:
+            yield f
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    async def crc32c():
+        return await loop.run_in_executor(None, crc32c_of_file, file_path)
+
+    content_type = mimetypes.guess_type(file_path)[0]
+    size = await loop.run_in_executor(None, os.path.getsize, file_path)
+    resource = await _upload_with_retry(
+        client,
+        gcs_bucket_name,
+        blob_name,
+        open_data,
+        size,
+        crc32c,
+        content_type,
+        retry,
+    )
+
+    return int(resource.get("size", 0))
+
+
+async def upload_file(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> None:
+    """Upload a single file to a Google Cloud Storage Bucket.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket
+      file_path (str): the full path to the local file to upload
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+    client = get_storage_client(gcp_project_name)
+    blob_name = os.path.join(gcs_bucket_path, os.path.basename(file_path))
+    await _upload_from_file(client, gcs_bucket_name, file_path, blob_name, retry)
+
+
+async def upload_files(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    directory: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> TransferSummary:
+    """Upload the files in a directory to a Google Cloud Storage bucket.
+
+    The asyncio counterpart of `gcsutils.gcs.upload_files`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket
+      directory (str): the full path to the local directory containing the
+                       files to upload
+      max_workers (int): the number of concurrent uploads (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any upload
+                             failed (default True)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a gcsutils.transfer.TransferSummary
+    """
+    client = get_storage_client(gcp_project_name, max_workers)
+    loop = asyncio.get_running_loop()
+    file_paths = await loop.run_in_executor(
+        None, get_file_paths_from_directory, directory
+    )
+    items = (
+        (fp, os.path.join(gcs_bucket_path, os.path.basename(fp))) for fp in file_paths
+    )
+
+    async def transfer(file_path, blob_name):
+        return await _upload_from_file(
+            client, gcs_bucket_name, file_path, blob_name, retry
+        )
+
+    summary = await _run_transfers(transfer, _aiter(items), max_workers)
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
+
+
+async def copy_file(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    original_gcs_file_path: str,
+    new_gcs_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> None:
+    """Copy an object in a Google Cloud Storage bucket.
+
+    The copy is made with rewrite requests, so objects of any size can be
+    copied; large objects may take several requests.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      original_gcs_file_path (str): the current full Google Cloud Storage path to
+                                    the object, including the file name
+      new_gcs_file_path (str): the new full Google Cloud Storage path to the object,
+                               including the file name
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+    client = get_storage_client(gcp_project_name)
+    path = "/storage/v1{}/rewriteTo{}".format(
+        _object_path(gcs_bucket_name, original_gcs_file_path),
+        _object_path(gcs_bucket_name, new_gcs_file_path),
+    )
+    params = {}
+
+    async def rewrite():
+        async with client._request("POST", path, params) as response:
+            return json.loads(await response.read())
+
+    with metrics.measure("rewrite") as measurement:
+        while True:
+            result = await retry.run_async(rewrite)
+            if result.get("done"):
+                measurement.bytes_transferred = int(result["objectSize"])
+                return
+            params["rewriteToken"] = result["rewriteToken"]
+
+
+async def _delete(
+    client: AsyncStorageClient,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> None:
+    path = "/storage/v1" + _object_path(gcs_bucket_name, gcs_file_path)
+
+    async def delete():
+        async with client._request("DELETE", path):
+            pass
+
+    try:
+        with metrics.measure("delete"):
+            await retry.run_async(delete)
+    except exceptions.NotFound:
+        pass
+
+
+async def delete_file(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> None:
+    """Delete an object from a Google Cloud Storage bucket.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_path (str): the path in GCS, including the file name,
+                           of the object to be deleted
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+    client = get_storage_client(gcp_project_name)
+    await _delete(client, gcs_bucket_name, gcs_file_path, retry)
+
+
+async def delete_files(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_paths: Iterable[str],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Dict[str, Exception]:
+    """Delete many objects from a Google Cloud Storage bucket.
+
+    Objects are deleted with concurrent requests. Objects that do not exist are
+    ignored, as in `delete_file`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_paths (iterable): the paths in GCS, including the file names,
+                                 of the objects to be deleted
+      max_workers (int): the number of concurrent requests (default 16)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a dict mapping the path of each object that could not be deleted to
+    the exception describing the failure
+    """
+    client = get_storage_client(gcp_project_name, max_workers)
+
+    async def transfer(name, _):
+        await _delete(client, gcs_bucket_name, name, retry)
+
+    items = ((name, None) for name in gcs_file_paths)
+    summary = await _run_transfers(transfer, _aiter(items), max_workers)
+
+    return {result.source: result.error for result in summary.failures}
@@ -0,0 +1,305 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import argparse
+import contextlib
+import importlib.metadata
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from gcsutils import gcs
+from gcsutils.testing import FakeGCSServer
+
+_PROJECT = "benchmark"
+_BUCKET = "benchmark"
+# Objects listed by list_bucket_folders are spread over this many folders
+_FOLDERS = 10
+
+DEFAULT_FILE_COUNTS = (100,)
+DEFAULT_FILE_SIZES = (1024, 1024 * 1024)
+DEFAULT_CONCURRENCY = (1, 16)
+
+
+@dataclass
+class BenchmarkResult:
+    """The measurement of one operation over a batch of objects.
+
+    Attributes:
+      operation (str): the gcsutils function that was measured
+      file_count (int): the number of objects in the batch
+      file_size (int): the size of each object, in bytes
+      concurrency (int): the max_workers the function was called with
+      latency (float): the latency injected into every response, in seconds
+      bandwidth (float): the injected bandwidth limit per connection, in bytes
+                         per second, or None
+      seconds (float): the wall-clock duration of the call
+      bytes_transferred (int): the bytes uploaded, downloaded or copied
+    """
+
+    operation: str
+    file_count: int
+    file_size: int
+    concurrency: int
+    latency: float
+    bandwidth: Optional[float]
+    seconds: float
+    bytes_transferred: int
+
+    @property
+    def objects_per_second(self) -> float:
+        """The number of objects handled per second."""
+        return self.file_count / self.seconds if self.seconds else 0.0
+
+    @property
+    def throughput(self) -> float:
+        """The transfer rate, in bytes per second."""
+        return self.bytes_transferred / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        """Return the result, with its derived rates, as a JSON-ready dict."""
+        return {
+            **asdict(self),
+            "objects_per_second": self.objects_per_second,
+            "throughput": self.throughput,
+        }
+
+
+@contextlib.contextmanager
+def _emulated(server: FakeGCSServer) -> Iterator[None]:
+    # Point the shared clients at the server for the duration of a run
+    previous = os.environ.get("STORAGE_EMULATOR_HOST")
+    os.environ["STORAGE_EMULATOR_HOST"] = server.url
+    gcs.clear_client_cache()
+    try:
+        yield
+    finally:
+        gcs.clear_client_cache()
+        if previous is None:
+            del os.environ["STORAGE_EMULATOR_HOST"]
+        else:
+            os.environ["STORAGE_EMULATOR_HOST"] = previous
+
+
+def _write_files(directory: str, file_count: int, file_size: int) -> None:
+    data = os.urandom(file_size)
+    for i in range(file_count):
+        with open(os.path.join(directory, "{:06d}.bin".format(i)), "wb") as f:
+            f.write(data)
+
+
+def _uploaded(server: FakeGCSServer) -> List[str]:
+    # The file_count objects written by upload_files, and nothing else, so
+    # that delete_files is measured over the same number of objects
+    return [n for n in server.list_objects(_BUCKET) if n.startswith("data/")]
+
+
+def _run_case(
+    file_count: int,
+    file_size: int,
+    concurrency: int,
+    latency: float,
+    bandwidth: Optional[float],
+) -> List[BenchmarkResult]:
+    total = file_count * file_size
+    results = []
+    with FakeGCSServer() as server, _emulated(server):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "source")
+            destination = os.path.join(directory, "destination")
+            os.makedirs(source)
+            os.makedirs(destination)
+            _write_files(source, file_count, file_size)
+            for i in range(file_count):
+                name = "tree/{:02d}/{:06d}".format(i % _FOLDERS, i)
+                server.put_object(_BUCKET, name, b"")
+            # Latency and bandwidth apply to the measured calls only
+            server.latency, server.bandwidth = latency, bandwidth
+
+            # (operation, bytes transferred, call), run in this order
+            operations: List[Tuple[str, int, Callable[[], object]]] = [
+                (
+                    "upload_files",
+                    total,
+                    lambda: gcs.upload_files(
+                        _PROJECT, _BUCKET, "data", source, concurrency
+                    ),
+                ),
+                (
+                    "list_bucket_contents",
+                    0,
+                    lambda: list(
+                        gcs.list_bucket_contents(
+                            _PROJECT, _BUCKET, "data", recurse=True
+                        )
+                    ),
+                ),
+                (
+                    "list_bucket_folders",
+                    0,
+                    lambda: gcs.list_bucket_folders(_PROJECT, _BUCKET, "tree", 2),
+                ),
+                (
+                    "download_files",
+                    total,
+                    lambda: gcs.download_files(
+                        _PROJECT, _BUCKET, "data", destination, concurrency
+                    ),
+                ),
+                (
+                    "copy_prefix",
+                    total,
+                    lambda: gcs.copy_prefix(
+                        _PROJECT, _BUCKET, "data", "copy", max_workers=concurrency
+                    ),
+                ),
+                (
+                    "delete_files",
+                    0,
+                    lambda: gcs.delete_files(
+                        _PROJECT, _BUCKET, _uploaded(server), concurrency
+                    ),
+                ),
+            ]
+            for operation, bytes_transferred, call in operations:
+                start = time.perf_counter()
+                call()
+                seconds = time.perf_counter() - start
+                results.append(
+                    BenchmarkResult(
+                        operation,
+                        file_count,
+                        file_size,
+                        concurrency,
+                        latency,
+                        bandwidth,
+                        seconds,
+                        bytes_transferred,
+                    )
+                )
+
+    return results
+
+
+def _version() -> Optional[str]:
+    try:
+        return importlib.metadata.version("gcsutils")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def run_benchmarks(
+    file_counts: Sequence[int] = DEFAULT_FILE_COUNTS,
+    file_sizes: Sequence[int] = DEFAULT_FILE_SIZES,
+    concurrency: Sequence[int] = DEFAULT_CONCURRENCY,
+    latency: float = 0.01,
+    bandwidth: Optional[float] = None,
+) -> dict:
+    """Measure the gcsutils bulk operations against a local fake GCS server.
+
+    For every combination of file count, file size and concurrency, a fresh
+    `gcsutils.testing.FakeGCSServer` is started, and upload_files,
+    list_bucket_contents, list_bucket_folders, download_files, copy_prefix
+    and delete_files are timed in turn against it, with the given latency
+    and bandwidth injected.
+
+    Args:
+      file_counts (sequence): the numbers of objects per batch (default 100)
+      file_sizes (sequence): the object sizes, in bytes (default 1KiB, 1MiB)
+      concurrency (sequence): the max_workers values (default 1, 16)
+      latency (float): the delay of every response, in seconds (default 0.01)
+      bandwidth (float): optional; the bandwidth of each connection, in bytes
+                         per second (default None, unlimited)
+
+    Returns a JSON-ready dict describing the environment, with a "results"
+    list of BenchmarkResult dicts
+    """
+    results = []
+    for file_count in file_counts:
+        for file_size in file_sizes:
+            for workers in concurrency:
+                results.extend(
+                    _run_case(file_count, file_size, workers, latency, bandwidth)
+                )
+
+    return {
+        "gcsutils_version": _version(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": [result.to_dict() for result in results],
+    }
+
+
+def _integers(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Run the benchmarks from the command line; see `--help`."""
+    parser = argparse.ArgumentParser(
+        prog="python -m gcsutils.benchmark",
+        description="Benchmark gcsutils against a local fake GCS server.",
+    )
+    parser.add_argument(
+        "--file-counts",
+        type=_integers,
+        default=list(DEFAULT_FILE_COUNTS),
+        help="comma-separated object counts",
+    )
+    parser.add_argument(
+        "--file-sizes",
+        type=_integers,
+        default=list(DEFAULT_FILE_SIZES),
+        help="comma-separated object sizes, in bytes",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=_integers,
+        default=list(DEFAULT_CONCURRENCY),
+        help="comma-separated max_workers values",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="response latency, in seconds"
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, help="bandwidth per connection, in bytes/second"
+    )
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        args.file_counts,
+        args.file_sizes,
+        args.concurrency,
+        args.latency,
+        args.bandwidth,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
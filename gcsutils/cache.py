@@ -0,0 +1,288 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import errno
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, Optional, Set
+
+from google.cloud import storage
+
+from gcsutils.retry import DEFAULT_RETRY, RetryPolicy
+
+# From linux/fs.h: clone a whole file as a copy-on-write reflink
+_FICLONE = 0x40049409
+_FETCH_ATTEMPTS = 3
+
+
+def _reflink(source_path: str, destination_path: str) -> bool:
+    with open(source_path, "rb") as source, open(destination_path, "wb") as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), _FICLONE, source.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(destination_path)
+
+    return False
+
+
+def _link_or_copy(source_path: str, destination_path: str, hardlink: bool) -> None:
+    if _reflink(source_path, destination_path):
+        return
+    if hardlink:
+        try:
+            os.link(source_path, destination_path)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source_path, destination_path)
+
+
+class BlobCache:
+    """A size-bounded, on-disk, read-through cache of downloaded objects.
+
+    Entries are keyed by bucket, object name and generation, so a cached file
+    is never served for a newer generation of its object. Files are filled
+    atomically (download to a temporary file, then rename) and evicted in
+    least-recently-used order once the cache holds more than `max_bytes`.
+    Several processes on the same host can share one cache directory.
+
+    Cached files are handed out as copy-on-write reflinks where the file
+    system supports them, and copied otherwise. With `hardlink` set, files that
+    cannot be reflinked are handed out as hard links to the cached file
+    instead. Cached files are read-only, but a hard-linked file still must not
+    be modified in place (by a privileged user, for example), since that would
+    change the cached copy too.
+
+    Args:
+      directory (str): the directory that holds the cache
+      max_bytes (int): the total size of cached files to evict down to
+      ttl (float): the number of seconds for which an object's generation, once
+                   looked up, is trusted without another metadata request
+                   (default 0, always look it up)
+      hardlink (bool): when True, hand out hard links if reflinks are not
+                       supported (default False)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        ttl: float = 0,
+        hardlink: bool = False,
+        retry: RetryPolicy = DEFAULT_RETRY,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hardlink = hardlink
+        self.retry = retry
+        self._objects_dir = os.path.join(directory, "objects")
+        self._index_dir = os.path.join(directory, "index")
+        self._locks_dir = os.path.join(directory, "locks")
+        for d in (self._objects_dir, self._index_dir, self._locks_dir):
+            os.makedirs(d, exist_ok=True)
+
+    def _lock(self, name: str):
+        path = os.path.join(self._locks_dir, name)
+        while True:
+            lock_file = open(path, "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            # The lock file was removed with its entry while this waited for
+            # it, so lock the file that replaces it
+            lock_file.close()
+
+    def _remove_lock(self, name: str) -> None:
+        # Remove a lock file that nobody holds; a held one is left for a later
+        # eviction
+        try:
+            lock_file = open(os.path.join(self._locks_dir, name))
+        except FileNotFoundError:
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            os.remove(lock_file.name)
+
+    def _generation(self, blob: storage.blob.Blob, key: str) -> int:
+        # A generation from a listing is authoritative; otherwise trust a
+        # recent lookup for up to `ttl` seconds before asking GCS again.
+        if blob.generation is not None:
+            return blob.generation
+        index_path = os.path.join(self._index_dir, key)
+        if self.ttl:
+            try:
+                with open(index_path) as f:
+                    entry = json.load(f)
+                if time.time() - entry["checked"] < self.ttl:
+                    return entry["generation"]
+            except (OSError, ValueError, KeyError):
+                pass
+        self.retry.run(functools.partial(blob.reload, retry=None))
+        if self.ttl:
+            temp_path = "{}.{}".format(index_path, uuid.uuid4().hex)
+            with open(temp_path, "w") as f:
+                json.dump({"generation": blob.generation, "checked": time.time()}, f)
+            os.replace(temp_path, index_path)
+
+        return blob.generation
+
+    def _fill(
+        self,
+        blob: storage.blob.Blob,
+        generation: int,
+        cached_path: str,
+        download: Callable[[storage.blob.Blob, str], None],
+    ) -> None:
+        with self._lock(os.path.basename(cached_path)):
+            if os.path.exists(cached_path):
+                return
+            pinned = blob.bucket.blob(blob.name, generation=generation)
+            temp_path = "{}.tmp-{}".format(cached_path, uuid.uuid4().hex)
+            try:
+                download(pinned, temp_path)
+                os.chmod(temp_path, 0o444)
+                os.replace(temp_path, cached_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        self.evict()
+
+    def _hand_out(self, cached_path: str, local_file_path: str) -> None:
+        temp_path = "{}.gcsutils-{}".format(local_file_path, uuid.uuid4().hex)
+        try:
+            _link_or_copy(cached_path, temp_path, self.hardlink)
+            os.replace(temp_path, local_file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def fetch(
+        self,
+        blob: storage.blob.Blob,
+        local_file_path: str,
+        download: Optional[Callable[[storage.blob.Blob, str], None]] = None,
+    ) -> int:
+        """Put a copy of an object at a local path, downloading it on a miss.
+
+        Args:
+          blob (google.cloud.storage.blob.Blob): the object; if its generation
+                                                 is not set, it is looked up
+          local_file_path (str): the full path where the object should be put
+          download (callable): optional; called as download(blob, path) to fill
+                               the cache (default Blob.download_to_filename,
+                               retried with the cache's policy)
+
+        Returns the size of the object in bytes
+        """
+        download = download or self._download
+        key = hashlib.sha256(
+            "{}/{}".format(blob.bucket.name, blob.name).encode("utf-8")
+        ).hexdigest()
+        generation = self._generation(blob, key)
+        cached_path = os.path.join(self._objects_dir, "{}-{}".format(key, generation))
+        for attempt in range(_FETCH_ATTEMPTS):
+            if not os.path.exists(cached_path):
+                self._fill(blob, generation, cached_path, download)
+            try:
+                # Touch the entry so that eviction sees it as recently used
+                os.utime(cached_path)
+                self._hand_out(cached_path, local_file_path)
+                break
+            except FileNotFoundError:
+                # Evicted by another process between the fill and the hand out
+                if attempt == _FETCH_ATTEMPTS - 1:
+                    raise
+
+        return os.path.getsize(local_file_path)
+
+    def _download(self, blob: storage.blob.Blob, path: str) -> None:
+        self.retry.run(
+            functools.partial(blob.download_to_filename, path, retry=None),
+            transfer=True,
+        )
+
+    def _evict_entries(self) -> Set[str]:
+        # Remove entries in least-recently-used order, and return the names of
+        # the entries that are kept
+        entries = []
+        total = 0
+        with os.scandir(self._objects_dir) as it:
+            for entry in it:
+                if ".tmp-" in entry.name:
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        # The most recently used entry is kept even if it alone is too big
+        entries.sort()
+        kept = {os.path.basename(path) for _, _, path in entries}
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            kept.discard(os.path.basename(path))
+            total -= size
+
+        return kept
+
+    def evict(self) -> None:
+        """Remove least-recently-used entries until the cache fits max_bytes.
+
+        The lock files of removed entries, and of fills that failed, are
+        removed too, unless they are in use, as are the generation lookups of
+        objects that no longer have any entry.
+        """
+        with self._lock("evict"):
+            kept = self._evict_entries()
+            with os.scandir(self._locks_dir) as it:
+                names = [entry.name for entry in it]
+            for name in names:
+                if name != "evict" and name not in kept:
+                    self._remove_lock(name)
+            self._prune_index({name.rsplit("-", 1)[0] for name in kept})
+
+    def _prune_index(self, keys: Set[str]) -> None:
+        with os.scandir(self._index_dir) as it:
+            names = [entry.name for entry in it]
+        for name in names:
+            # Skip lookups that are still being written
+            if "." in name or name in keys:
+                continue
+            try:
+                os.remove(os.path.join(self._index_dir, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,57 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import hashlib
+import json
+import os
+from typing import Optional
+
+from google.oauth2 import service_account
+
+
+def get_credential_source() -> Optional[str]:
+    """Identify where credentials, and the API endpoint, come from.
+
+    The service account key itself is not kept, so the result can be used in
+    the keys of client caches.
+
+    Returns a hash of the SERVICE_ACCOUNT_KEY and STORAGE_EMULATOR_HOST
+    environment variables, or None if neither is set
+    """
+    source = "|".join(
+        os.environ.get(name, "")
+        for name in ("SERVICE_ACCOUNT_KEY", "STORAGE_EMULATOR_HOST")
+    )
+    if source == "|":
+        return None
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def get_service_account_credentials() -> Optional[service_account.Credentials]:
+    """Load the service account key in the SERVICE_ACCOUNT_KEY variable.
+
+    Returns the credentials, or None to use the default credentials if the
+    variable is not set
+    """
+    if "SERVICE_ACCOUNT_KEY" not in os.environ:
+        return None
+    key = os.environ["SERVICE_ACCOUNT_KEY"]
+    try:
+        key = json.loads(key)
+    except json.decoder.JSONDecodeError as e:
+        raise ValueError("SERVICE_ACCOUNT_KEY is empty or contains invalid JSON") from e
+
+    return service_account.Credentials.from_service_account_info(key)
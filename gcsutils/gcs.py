@@ -14,40 +14,183 @@ permissions and limitations under the License.
 """
 
 
-import asyncio
-import json
+import concurrent.futures
+import contextlib
+import fnmatch
+import functools
+import gzip
+import io
+import itertools
 import logging
+import math
+import mimetypes
 import os
 import re
+import shutil
+import threading
 import time
+import uuid
 import warnings
-from typing import List
+import zlib
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 import google
+import requests
 from google.api_core.page_iterator import HTTPIterator
 from google.cloud import storage
-from google.oauth2 import service_account
+from google.cloud.storage.batch import Batch
+from google.resumable_media import DataCorruption
 
+from gcsutils import metrics, scheduler
+from gcsutils.credentials import get_credential_source, get_service_account_credentials
+from gcsutils.glob import GlobPattern
+from gcsutils.hedge import HedgePolicy
+from gcsutils.journal import TransferJournal
+from gcsutils.listing import OBJECT_FIELDS, ObjectInfo, as_folder, list_sharded
+from gcsutils.manifest import HashManifest, crc32c_of_file
+from gcsutils.retry import DEFAULT_RETRY, RetryPolicy
+from gcsutils.stream import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_READ_AHEAD,
+    open_reader,
+    open_writer,
+    stream_to_blob,
+)
+from gcsutils.transfer import (
+    DEFAULT_MAX_WORKERS,
+    TransferError,
+    TransferResult,
+    TransferSummary,
+    run_transfers,
+)
 
-def _get_storage_client(gcp_project_name: str) -> storage.client.Client:
-    if "SERVICE_ACCOUNT_KEY" in os.environ:
-        key = os.environ["SERVICE_ACCOUNT_KEY"]
-        try:
-            key = json.loads(key)
-        except json.decoder.JSONDecodeError as e:
-            raise ValueError(
-                "SERVICE_ACCOUNT_KEY is empty or contains invalid JSON"
-            ) from e
-        credentials = service_account.Credentials.from_service_account_info(key)
+if TYPE_CHECKING:
+    from gcsutils.cache import BlobCache
+
+# The JSON API accepts at most 100 calls in a single batch request
+_DELETE_BATCH_SIZE = 100
+# A compose request accepts at most 32 source objects
+_MAX_COMPOSE_SOURCES = 32
+DEFAULT_COMPOSITE_PARTS = 8
+DEFAULT_SLICED_PARTS = 8
+MANIFEST_FILE_NAME = ".gcsutils-manifest.json"
+# Only the object metadata that sync and copies compare is requested from
+# the listing
+_OBJECT_FIELDS = "items(name,size,crc32c,generation),nextPageToken"
+# With compress=True, files with these extensions are always gzipped; other
+# files are gzipped if a sample of their start compresses well
+COMPRESSIBLE_EXTENSIONS = frozenset(
+    [
+        ".csv",
+        ".geojson",
+        ".gml",
+        ".html",
+        ".json",
+        ".jsonl",
+        ".kml",
+        ".log",
+        ".ndjson",
+        ".svg",
+        ".tsv",
+        ".txt",
+        ".xml",
+        ".yaml",
+        ".yml",
+    ]
+)
+_COMPRESSION_SAMPLE_SIZE = 64 * 1024
+# A sample must shrink to this fraction of its size for its file to be gzipped
+_COMPRESSION_RATIO = 0.8
+_COMPRESSION_LEVEL = 6
+
+_client_cache: Dict[Tuple[str, Optional[str]], storage.client.Client] = {}
+_client_pool_sizes: Dict[Tuple[str, Optional[str]], int] = {}
+_bucket_cache: Dict[Tuple[str, Optional[str], str], storage.bucket.Bucket] = {}
+_client_cache_lock = threading.Lock()
+
+
+def _configure_connection_pool(client: storage.client.Client, pool_size: int) -> None:
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    client._http.mount("https://", adapter)
+    client._http.mount("http://", adapter)
+
+
+def _get_storage_client(
+    gcp_project_name: str, pool_size: Optional[int] = None
+) -> storage.client.Client:
+    credentials = get_service_account_credentials()
+    if credentials is not None:
         client = storage.Client(project=gcp_project_name, credentials=credentials)
     else:
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             client = storage.Client(project=gcp_project_name)
+    if pool_size is not None:
+        _configure_connection_pool(client, pool_size)
 
     return client
 
 
+def get_storage_client(
+    gcp_project_name: str, pool_size: int = DEFAULT_MAX_WORKERS
+) -> storage.client.Client:
+    """Get a shared Google Cloud Storage client.
+
+    Clients are cached per project and credential source, so credentials, access
+    tokens and pooled HTTP connections are reused across calls. The cache is
+    safe to use from multiple threads.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      pool_size (int): the minimum number of pooled HTTP connections the client
+                       should keep per host; match this to the number of
+                       concurrent transfers (default 16)
+
+    Returns:
+      google.cloud.storage.client.Client instance
+    """
+    key = (gcp_project_name, get_credential_source())
+    with _client_cache_lock:
+        client = _client_cache.get(key)
+        if client is None:
+            start = time.monotonic()
+            client = _get_storage_client(gcp_project_name, pool_size)
+            metrics.record(metrics.CLIENT_CREATION, time.monotonic() - start)
+            _client_cache[key] = client
+            _client_pool_sizes[key] = pool_size
+        elif pool_size > _client_pool_sizes[key]:
+            _configure_connection_pool(client, pool_size)
+            _client_pool_sizes[key] = pool_size
+
+    return client
+
+
+def clear_client_cache() -> None:
+    """Discard all cached storage clients and buckets.
+
+    Call this after rotating credentials, or after forking a process, so that
+    subsequent calls build fresh clients and connections.
+    """
+    with _client_cache_lock:
+        _client_cache.clear()
+        _client_pool_sizes.clear()
+        _bucket_cache.clear()
+
+
 def gcs_join(path_segments, include_protocol=False):
     """Build a path using GCS path separators.
 
@@ -66,66 +209,704 @@ def gcs_join(path_segments, include_protocol=False):
 
 
 def get_storage_bucket(
-    gcp_project_name: str, gcs_bucket_name: str
+    gcp_project_name: str, gcs_bucket_name: str, pool_size: int = DEFAULT_MAX_WORKERS
 ) -> storage.bucket.Bucket:
     """Get a Google Cloud Storage bucket.
 
+    The bucket and its client are cached; see `get_storage_client`.
+
     Args:
       gcp_project_name (str): the Google Cloud Project name
       gcs_bucket_name (str): the Google Cloud Storage bucket name
+      pool_size (int): the minimum number of pooled HTTP connections (default 16)
 
     Returns:
       google.cloud.storage.bucket.Bucket instance
     """
-    storage_client = _get_storage_client(gcp_project_name)
-    bucket = storage_client.bucket(gcs_bucket_name)
+    storage_client = get_storage_client(gcp_project_name, pool_size)
+    key = (gcp_project_name, get_credential_source(), gcs_bucket_name)
+    with _client_cache_lock:
+        bucket = _bucket_cache.get(key)
+        if bucket is None:
+            bucket = storage_client.bucket(gcs_bucket_name)
+            _bucket_cache[key] = bucket
 
     return bucket
 
 
-async def _upload_file_to_bucket(
-    gcs_bucket: storage.bucket.Bucket, gcs_bucket_path: str, file_path: str
-) -> None:
-    blob_name = os.path.join(gcs_bucket_path, os.path.basename(file_path))
+@metrics.measured("upload")
+def _upload_with_retry(
+    blob: storage.blob.Blob,
+    file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    if_generation_match: Optional[int] = None,
+) -> int:
+    # A failed upload may in fact have been stored, so before each retry the
+    # object is looked up: if it already holds the file, the upload is done.
+    # Otherwise retries only replace the generation found at the first lookup,
+    # so an object written by someone else in the meantime is kept.
+    precondition = if_generation_match
+    attempts = 0
+
+    def upload():
+        nonlocal attempts, precondition
+        attempts += 1
+        if attempts > 1:
+            current = blob.bucket.get_blob(blob.name, retry=None)
+            if current is not None and current.crc32c == crc32c_of_file(file_path):
+                blob._set_properties(current._properties)
+                return
+            if precondition is None:
+                precondition = current.generation if current is not None else 0
+        if meter is None:
+            blob.upload_from_filename(
+                file_path, if_generation_match=precondition, retry=None
+            )
+            return
+        with open(file_path, "rb") as f:
+            blob.upload_from_file(
+                _MeteredReader(f, meter),
+                size=size,
+                content_type=mimetypes.guess_type(file_path)[0],
+                if_generation_match=precondition,
+                retry=None,
+            )
+
+    size = os.path.getsize(file_path)
+    with scheduler.transfer(scheduler.UPLOAD, _buffer_size(size)) as meter:
+        retry.run(upload, transfer=True)
+
+    return size
+
+
+def _buffer_size(size: Optional[int]) -> int:
+    # An estimate of the memory a transfer of `size` bytes holds at once
+    if size is None:
+        return DEFAULT_CHUNK_SIZE
+    return min(size, DEFAULT_CHUNK_SIZE)
+
+
+class _MeteredReader(io.RawIOBase):
+    """A file object that reports the size of each read to a scheduler meter.
+
+    The meter sleeps as needed to keep uploads within the bandwidth cap.
+    """
+
+    def __init__(self, fileobj, meter: Callable[[int], float]):
+        self._fileobj = fileobj
+        self._meter = meter
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._fileobj.seekable()
+
+    def tell(self) -> int:
+        return self._fileobj.tell()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._fileobj.seek(offset, whence)
+
+    def readinto(self, buffer) -> int:
+        n = self._fileobj.readinto(memoryview(buffer).cast("B"))
+        if n:
+            self._meter(n)
+        return n
+
+
+class _MeteredWriter(io.RawIOBase):
+    """A file object that reports the size of each write to a scheduler meter.
+
+    The meter sleeps as needed to keep downloads within the bandwidth cap.
+    """
+
+    def __init__(self, fileobj, meter: Callable[[int], float]):
+        self._fileobj = fileobj
+        self._meter = meter
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        written = self._fileobj.write(data)
+        self._meter(written)
+        return written
+
+
+def _metered(fileobj, meter: Optional[Callable[[int], float]]):
+    # Wrap a file object in the meter of a scheduled transfer, if it has one
+    if meter is None:
+        return fileobj
+    if fileobj.writable():
+        return _MeteredWriter(fileobj, meter)
+    return _MeteredReader(fileobj, meter)
+
+
+def _is_compressible(file_path: str) -> bool:
+    if os.path.splitext(file_path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        return True
+    with open(file_path, "rb") as f:
+        sample = f.read(_COMPRESSION_SAMPLE_SIZE)
+    compressed = zlib.compress(sample, 1)
+
+    return bool(sample) and len(compressed) <= len(sample) * _COMPRESSION_RATIO
+
+
+@metrics.measured("upload")
+def _upload_compressed(
+    blob: storage.blob.Blob,
+    file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    # The file is gzipped as it is read and streamed up through a resumable
+    # upload, so no compressed copy is ever written. GCS serves the object
+    # decompressed to clients that do not accept gzip.
+    blob.content_encoding = "gzip"
+    blob.content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    with open(file_path, "rb") as source:
+        with open_writer(blob, content_type=blob.content_type, retry=retry) as writer:
+            with gzip.GzipFile(
+                fileobj=writer, mode="wb", compresslevel=_COMPRESSION_LEVEL, mtime=0
+            ) as compressed:
+                shutil.copyfileobj(source, compressed, DEFAULT_CHUNK_SIZE)
+
+    return os.path.getsize(file_path)
+
+
+def _upload_file_to_bucket(
+    gcs_bucket: storage.bucket.Bucket,
+    file_path: str,
+    blob_name: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
     blob = gcs_bucket.blob(blob_name)
-    blob.upload_from_filename(file_path)
 
+    return _upload_with_retry(blob, file_path, retry)
+
+
+class _FileSlice(io.RawIOBase):
+    """A read-only window onto a byte range of an open file.
+
+    Reads use positional I/O straight into the caller's buffer, so several
+    slices of one file descriptor can be read concurrently without copies.
+    """
+
+    def __init__(self, fd: int, offset: int, length: int):
+        self._fd = fd
+        self._offset = offset
+        self._length = length
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        remaining = self._length - self._position
+        if remaining <= 0:
+            return 0
+        view = memoryview(buffer).cast("B")[:remaining]
+        position = self._offset + self._position
+        if hasattr(os, "preadv"):
+            count = os.preadv(self._fd, [view], position)
+        else:
+            data = os.pread(self._fd, len(view), position)
+            count = len(data)
+            view[:count] = data
+        self._position += count
+        return count
+
+
+def _compose_parts(
+    bucket: storage.bucket.Bucket,
+    part_names: List[str],
+    blob_name: str,
+    temp_prefix: str,
+    temp_names: List[str],
+    content_type: Optional[str],
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> None:
+    # Compose accepts at most 32 sources, so larger sets of parts are composed
+    # into intermediate objects first, one level at a time. Repeating a
+    # compose of the same parts produces the same object, so it is retried.
+    def compose(name, sources):
+        destination = bucket.blob(name)
+        destination.content_type = content_type if name == blob_name else None
+        with metrics.measure("compose"):
+            retry.run(
+                functools.partial(
+                    destination.compose, [bucket.blob(n) for n in sources], retry=None
+                )
+            )
+
+    level = 0
+    while len(part_names) > _MAX_COMPOSE_SOURCES:
+        composed_names = []
+        for i in range(0, len(part_names), _MAX_COMPOSE_SOURCES):
+            name = "{}.compose{}-{:05d}".format(
+                temp_prefix, level, i // _MAX_COMPOSE_SOURCES
+            )
+            temp_names.append(name)
+            end = i + _MAX_COMPOSE_SOURCES
+            compose(name, part_names[i:end])
+            composed_names.append(name)
+        part_names = composed_names
+        level += 1
+
+    compose(blob_name, part_names)
+
+
+@metrics.measured("upload")
+def _upload_composite(
+    gcs_bucket: storage.bucket.Bucket,
+    file_path: str,
+    blob_name: str,
+    parts: int,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    size = os.path.getsize(file_path)
+    part_size = max(math.ceil(size / parts), 1)
+    prefix = "{}.gcsutils-part-{}".format(blob_name, uuid.uuid4().hex)
+    part_names = [
+        "{}-{:05d}".format(prefix, i) for i in range(math.ceil(size / part_size))
+    ]
+
+    def upload_part(index):
+        offset = index * part_size
+        length = min(part_size, size - offset)
+        blob = gcs_bucket.blob(part_names[index])
+        # Part names are unique to this upload, so parts are safe to retry
+        with scheduler.transfer(scheduler.UPLOAD, _buffer_size(length)) as meter:
+            retry.run(
+                lambda: blob.upload_from_file(
+                    _metered(_FileSlice(fd, offset, length), meter),
+                    size=length,
+                    retry=None,
+                ),
+                transfer=True,
+            )
+
+    temp_names = list(part_names)
+    try:
+        with open(file_path, "rb") as f:
+            fd = f.fileno()
+            with concurrent.futures.ThreadPoolExecutor(len(part_names)) as executor:
+                list(
+                    executor.map(scheduler.inherit(upload_part), range(len(part_names)))
+                )
+        _compose_parts(
+            gcs_bucket,
+            part_names,
+            blob_name,
+            prefix,
+            temp_names,
+            mimetypes.guess_type(file_path)[0],
+            retry,
+        )
+    finally:
+        failures = _delete_blobs(gcs_bucket, temp_names, retry=retry)
+        for name, error in failures.items():
+            logging.warning("Failed to delete temporary part %s: %s", name, error)
+
+    return size
+
+
+def _matches(relative_path: str, patterns: Optional[Sequence[str]]) -> bool:
+    return any(fnmatch.fnmatchcase(relative_path, p) for p in patterns or ())
+
+
+def _select_files(
+    directory: str,
+    recursive: bool = False,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+) -> Iterator[Tuple[str, str]]:
+    # Lazily yield (relative path, full path) for the files to upload
+    if recursive:
+        files = _walk_directory(directory, exclude)
+    else:
+        files = _list_directory(directory)
+    for relative_path, file_path in files:
+        if include is not None and not _matches(relative_path, include):
+            continue
+        if not _matches(relative_path, exclude):
+            yield relative_path, file_path
+
+
+def _list_directory(directory: str) -> Iterator[Tuple[str, str]]:
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry.name, entry.path
 
-def _get_file_paths_from_directory(directory: str) -> List[str]:
-    file_paths = []
-    for f in os.listdir(directory):
-        file_path = os.path.join(directory, f)
-        if os.path.isfile(file_path):
-            file_paths.append(file_path)
 
-    return file_paths
+def _open_journal(journal_path: Optional[str]):
+    if journal_path is None:
+        return contextlib.nullcontext()
+    return TransferJournal(journal_path)
+
+
+def _run_journaled(
+    transfer: Callable[[Any, Any], int],
+    pairs: Iterable[Tuple[str, storage.blob.Blob]],
+    upload: bool,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    journal: Optional[TransferJournal] = None,
+) -> TransferSummary:
+    # Run the transfers between (local path, blob) pairs; uploads are called as
+    # transfer(local path, blob) and downloads as transfer(blob, local path).
+    # Pairs that the journal records as complete are skipped, and completed
+    # transfers are added to it. An upload records the modification time its
+    # file had before it was read, so that a change made during the upload
+    # is not mistaken for the uploaded content.
+    skipped = 0
+
+    def items():
+        nonlocal skipped
+        for local_path, blob in pairs:
+            if journal is not None and journal.is_complete(local_path, blob.name):
+                skipped += 1
+            else:
+                yield (local_path, blob) if upload else (blob, local_path)
+
+    def run(source, destination):
+        if journal is None:
+            return transfer(source, destination)
+        local_path, blob = (source, destination) if upload else (destination, source)
+        mtime_ns = os.stat(local_path).st_mtime_ns if upload else None
+        size = transfer(source, destination)
+        journal.record(local_path, blob.name, size, blob.crc32c, mtime_ns)
+        return size
+
+    summary = run_transfers(run, items(), max_workers)
+    summary.skipped = skipped
+
+    return summary
 
 
 def _upload_files_to_bucket(
     gcp_project_name: str,
     gcs_bucket_name: str,
     gcs_bucket_path: str,
-    file_paths: List[str],
+    files: Iterable[Tuple[str, str]],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    journal: Optional[TransferJournal] = None,
+    compress: bool = False,
+) -> TransferSummary:
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    pairs = (
+        (file_path, bucket.blob(os.path.join(gcs_bucket_path, relative_path)))
+        for relative_path, file_path in files
+    )
+
+    def upload(file_path, blob):
+        # Files are compressed on the worker threads; zlib releases the GIL,
+        # so compressions run in parallel with each other and with transfers
+        if compress and _is_compressible(file_path):
+            return _upload_compressed(blob, file_path, retry)
+        return _upload_with_retry(blob, file_path, retry)
+
+    return _run_journaled(upload, pairs, True, max_workers, journal)
+
+
+@metrics.measured("download")
+def _download_blob(
+    blob: storage.blob.Blob,
+    local_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    if scheduler.get_scheduler() is None:
+        retry.run(
+            functools.partial(blob.download_to_filename, local_file_path, retry=None),
+            transfer=True,
+        )
+    else:
+        with scheduler.transfer(scheduler.DOWNLOAD, _buffer_size(blob.size)) as meter:
+            retry.run(
+                functools.partial(_download_metered, blob, local_file_path, meter),
+                transfer=True,
+            )
+
+    return os.path.getsize(local_file_path)
+
+
+def _download_metered(
+    blob: storage.blob.Blob,
+    local_file_path: str,
+    meter: Optional[Callable[[int], float]],
 ) -> None:
-    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
+    # As blob.download_to_filename, but through the bandwidth meter
+    try:
+        with open(local_file_path, "wb") as f:
+            blob.download_to_file(_metered(f, meter), retry=None)
+    except BaseException:
+        if os.path.exists(local_file_path):
+            os.remove(local_file_path)
+        raise
+    if blob.updated is not None:
+        updated = blob.updated.timestamp()
+        os.utime(local_file_path, (updated, updated))
+
+
+class _OffsetWriter(io.RawIOBase):
+    """A write-only file object that writes into a file from a fixed offset.
+
+    Writes use positional I/O, so several writers can fill different ranges of
+    one file descriptor concurrently.
+    """
+
+    def __init__(self, fd: int, offset: int):
+        self._fd = fd
+        self._position = offset
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        view = memoryview(data).cast("B")
+        written = 0
+        while written < len(view):
+            written += os.pwrite(self._fd, view[written:], self._position + written)
+        self._position += written
+        return written
+
+
+class _Cancelled(Exception):
+    pass
 
-    ioloop = asyncio.get_event_loop()
-    tasks = asyncio.gather(
-        *[_upload_file_to_bucket(bucket, gcs_bucket_path, fp) for fp in file_paths]
+
+class _CancellableBuffer(io.BytesIO):
+    """An in-memory file object whose writes fail once `cancel` is set.
+
+    This stops a download whose result is no longer needed at its next chunk.
+    """
+
+    def __init__(self, cancel: threading.Event):
+        super().__init__()
+        self._cancel = cancel
+
+    def write(self, data) -> int:
+        if self._cancel.is_set():
+            raise _Cancelled()
+        return super().write(data)
+
+
+@metrics.measured("download")
+def _download_hedged(
+    blob: storage.blob.Blob,
+    local_file_path: str,
+    hedge: HedgePolicy,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    # The blob must already have been reloaded, and is small enough for every
+    # attempt to be read into memory
+    def fetch(cancel):
+        # Each attempt uses its own blob, as downloads update its properties,
+        # and is admitted by the scheduler on its own
+        buffer = _CancellableBuffer(cancel)
+        pinned = blob.bucket.blob(blob.name, generation=blob.generation)
+        with scheduler.transfer(scheduler.DOWNLOAD, blob.size) as meter:
+            pinned.download_to_file(_metered(buffer, meter), retry=None)
+        return buffer.getvalue()
+
+    data = retry.run(
+        functools.partial(hedge.run, scheduler.inherit(fetch)), transfer=True
     )
-    ioloop.run_until_complete(tasks)
+    with _temporary_path(local_file_path) as temp_path:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+
+    return len(data)
 
 
-async def _download_blob(blob: storage.blob.Blob, directory: str):
-    blob_base_name = blob.name.split("/")[-1]
-    if blob_base_name:
-        blob.download_to_filename(os.path.join(directory, blob_base_name))
+def _preallocate(fd: int, size: int) -> None:
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+@metrics.measured("download")
+def _download_sliced(
+    blob: storage.blob.Blob,
+    local_file_path: str,
+    parts: int,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    # The blob must already have been reloaded, so that its size, generation
+    # and checksum are known. Every range is pinned to that generation.
+    size = blob.size
+    slice_size = max(math.ceil(size / parts), 1)
+
+    def download_slice(start):
+        end = min(start + slice_size, size) - 1
+        pinned = blob.bucket.blob(blob.name, generation=blob.generation)
+        length = end - start + 1
+        with scheduler.transfer(scheduler.DOWNLOAD, _buffer_size(length)) as meter:
+            retry.run(
+                lambda: pinned.download_to_file(
+                    _metered(_OffsetWriter(fd, start), meter),
+                    start=start,
+                    end=end,
+                    raw_download=True,
+                    checksum=None,
+                    retry=None,
+                ),
+                transfer=True,
+            )
+
+    try:
+        with open(local_file_path, "wb") as f:
+            fd = f.fileno()
+            _preallocate(fd, size)
+            starts = range(0, size, slice_size)
+            with concurrent.futures.ThreadPoolExecutor(len(starts)) as executor:
+                list(executor.map(scheduler.inherit(download_slice), starts))
+        actual_crc32c = crc32c_of_file(local_file_path)
+        if blob.crc32c is not None and actual_crc32c != blob.crc32c:
+            raise DataCorruption(
+                None,
+                "Checksum mismatch while downloading {}: expected CRC32C {}, "
+                "got {}".format(blob.name, blob.crc32c, actual_crc32c),
+            )
+    except BaseException:
+        if os.path.exists(local_file_path):
+            os.remove(local_file_path)
+        raise
+
+    return size
+
+
+def _download_object(
+    blob: storage.blob.Blob,
+    local_file_path: str,
+    sliced_threshold: Optional[int] = None,
+    sliced_parts: int = DEFAULT_SLICED_PARTS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    hedge: Optional[HedgePolicy] = None,
+) -> None:
+    if sliced_threshold is None and hedge is None:
+        _download_blob(blob, local_file_path, retry)
+        return
+    if blob.size is None:
+        retry.run(functools.partial(blob.reload, retry=None))
+    if hedge is not None and blob.size <= hedge.max_size:
+        _download_hedged(blob, local_file_path, hedge, retry)
+    elif sliced_threshold is None:
+        _download_blob(blob, local_file_path, retry)
+    elif blob.size >= max(sliced_threshold, 1) and blob.content_encoding != "gzip":
+        _download_sliced(blob, local_file_path, sliced_parts, retry)
+    else:
+        _download_blob(blob, local_file_path, retry)
+
+
+@contextlib.contextmanager
+def _temporary_path(local_file_path: str) -> Iterator[str]:
+    # Yields a path to write in place of `local_file_path`, which replaces it
+    # once the block completes. Readers of the path never see a partly
+    # written file, and a failed download leaves any earlier copy in place.
+    temp_path = "{}.gcsutils-{}".format(local_file_path, uuid.uuid4().hex)
+    try:
+        yield temp_path
+        os.replace(temp_path, local_file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _download_atomically(
+    blob: storage.blob.Blob,
+    local_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    with _temporary_path(local_file_path) as temp_path:
+        return _download_blob(blob, temp_path, retry)
 
 
-def _download_blobs_from_bucket(blobs: HTTPIterator, directory: str):
-    ioloop = asyncio.get_event_loop()
-    tasks = asyncio.gather(*[_download_blob(blob, directory) for blob in blobs])
-    ioloop.run_until_complete(tasks)
+def _local_paths(
+    blobs: Iterable[storage.blob.Blob],
+    prefix: str,
+    directory: str,
+) -> Iterator[Tuple[storage.blob.Blob, str]]:
+    # Map objects to paths below the directory by their name relative to the
+    # prefix. Each directory is created once, before its first download is
+    # queued, rather than by every download. Names with empty or ".."
+    # segments, which could land outside the directory, are skipped.
+    start = len(prefix)
+    created = {directory}
+    for blob in blobs:
+        segments = blob.name[start:].split("/")
+        if "" in segments or ".." in segments:
+            continue
+        local_file_path = os.path.join(directory, *segments)
+        parent = os.path.dirname(local_file_path)
+        if parent not in created:
+            os.makedirs(parent, exist_ok=True)
+            created.add(parent)
+        yield blob, local_file_path
+
+
+def _download_blobs_from_bucket(
+    blobs: Iterable[storage.blob.Blob],
+    directory: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    cache: Optional["BlobCache"] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    prefix: Optional[str] = None,
+    journal: Optional[TransferJournal] = None,
+) -> TransferSummary:
+    # Blobs are handed to the pool as the listing pages arrive, so downloads
+    # start with the first page and the listing is never held in memory.
+    # Objects are put below the directory by their name relative to `prefix`,
+    # or by their last path segment without one.
+    if prefix is None:
+        items = (
+            (blob, os.path.join(directory, blob.name.split("/")[-1]))
+            for blob in blobs
+            if blob.name.split("/")[-1]
+        )
+    else:
+        items = _local_paths(blobs, prefix, directory)
+    download = functools.partial(_download_atomically, retry=retry)
+    if cache is None:
+        transfer = download
+    else:
+        transfer = functools.partial(cache.fetch, download=download)
+    pairs = ((local_file_path, blob) for blob, local_file_path in items)
+
+    return _run_journaled(transfer, pairs, False, max_workers, journal)
+
+
+def _list_blobs(
+    bucket: storage.bucket.Bucket,
+    gcs_bucket_path: str,
+    recurse: bool = False,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> HTTPIterator:
+    # The policy is applied by the client to each page request
+    if not gcs_bucket_path.endswith("/"):
+        gcs_bucket_path = gcs_bucket_path + "/"
+    if recurse:
+        blobs = bucket.list_blobs(prefix=gcs_bucket_path, retry=retry)
+    else:
+        blobs = bucket.list_blobs(prefix=gcs_bucket_path, delimiter="/", retry=retry)
+
+    return blobs
 
 
 def list_bucket_contents(
@@ -133,6 +914,7 @@ def list_bucket_contents(
     gcs_bucket_name: str,
     gcs_bucket_path: str,
     recurse: bool = False,
+    retry: RetryPolicy = DEFAULT_RETRY,
 ) -> HTTPIterator:
     """List the blobs in a Google Cloud Storage bucket.
 
@@ -141,48 +923,267 @@ def list_bucket_contents(
       gcs_bucket_name (str): the Google Cloud Storage bucket name
       gcs_bucket_path (str): the storage path in the bucket
       recurse (bool): when True, include the contents of all subfolders (default False)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
 
     Returns a google.api_core.page_iterator.HTTPIterator
     """
     bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
-    if not gcs_bucket_path.endswith("/"):
-        gcs_bucket_path = gcs_bucket_path + "/"
-    if recurse:
-        blobs = bucket.list_blobs(prefix=gcs_bucket_path)
-    else:
-        blobs = bucket.list_blobs(prefix=gcs_bucket_path, delimiter="/")
 
-    return blobs
+    return _list_blobs(bucket, gcs_bucket_path, recurse, retry)
+
+
+@metrics.measured("list")
+def _list_prefixes(
+    bucket: storage.bucket.Bucket, prefix: str, retry: RetryPolicy = DEFAULT_RETRY
+) -> List[str]:
+    # Only the "prefixes" of each page are requested, so the listing costs one
+    # request per 1,000 entries at this level, not per object below it.
+    blobs = bucket.list_blobs(
+        prefix=prefix, delimiter="/", fields="prefixes,nextPageToken", retry=retry
+    )
+    for _ in blobs.pages:
+        pass
+
+    return sorted(blobs.prefixes)
 
 
 def list_bucket_folders(
-    gcp_project_name: str, gcs_bucket_name: str, gcs_bucket_path: str
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    max_depth: int = 1,
+    retry: RetryPolicy = DEFAULT_RETRY,
 ) -> list:
     """List the 'folders' in a Google Cloud Storage bucket path.
 
+    Folders are discovered from the delimiter prefixes of the bucket listing,
+    so the cost is proportional to the number of folders, not objects.
+
     Args:
       gcp_project_name (str): the Google Cloud Project name
       gcs_bucket_name (str): the Google Cloud Storage bucket name
       gcs_bucket_path (str): the storage path in the bucket
+      max_depth (int): the number of folder levels to descend (default 1). With
+                       a depth greater than 1 the folders of every level are
+                       included, as paths relative to gcs_bucket_path
+                       (eg/ "a", "a/b", "a/b/c")
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
 
     Returns a list of strings
     """
-    folders = set()
-    prefix_length = len(gcs_bucket_path.split("/"))
-    for blob in list_bucket_contents(
-        gcp_project_name, gcs_bucket_name, gcs_bucket_path, recurse=True
-    ):
-        blob_path_segments = blob.name.split("/")
-        if len(blob_path_segments) > prefix_length + 1:
-            folders.add(blob.name.split("/")[prefix_length])
+    if max_depth < 1:
+        raise ValueError("max_depth must be at least 1")
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
+    if not gcs_bucket_path.endswith("/"):
+        gcs_bucket_path = gcs_bucket_path + "/"
 
-    return list(folders)
+    start = len(gcs_bucket_path)
+    folders = []
+    level = [gcs_bucket_path]
+    with concurrent.futures.ThreadPoolExecutor(DEFAULT_MAX_WORKERS) as executor:
+        for _ in range(max_depth):
+            level = [
+                prefix
+                for prefixes in executor.map(
+                    functools.partial(_list_prefixes, bucket, retry=retry), level
+                )
+                for prefix in prefixes
+            ]
+            if not level:
+                break
+            folders.extend(p[start:-1] for p in level)
+
+    return folders
+
+
+def list_objects(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    fields: Iterable[str] = OBJECT_FIELDS,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Iterator[ObjectInfo]:
+    """List every object below a bucket path, quickly.
+
+    A high-throughput alternative to `list_bucket_contents(recurse=True)` for
+    very large paths. The path is split into shards along its folders, which
+    are listed concurrently; only the requested fields are fetched, and each
+    object is yielded as a compact gcsutils.listing.ObjectInfo record rather
+    than a Blob. Objects are yielded in no particular order.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket
+      fields (list): the object fields to fetch, out of "name", "size",
+                     "crc32c", "generation" and "updated" (default all)
+      max_workers (int): the number of concurrent listing requests (default 16)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns an iterator of gcsutils.listing.ObjectInfo
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+
+    return list_sharded(bucket, as_folder(gcs_bucket_path), fields, max_workers, retry)
+
+
+def _list_matching(
+    bucket: storage.bucket.Bucket,
+    pattern: GlobPattern,
+    fields: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Iterator[storage.blob.Blob]:
+    # Walk only the folders that the pattern can match. Literal segments are
+    # descended into without a request; other segments are listed with the
+    # delimiter and their literal prefix, and only the subfolders that match
+    # are walked. A "**" segment is listed in full below its folder.
+    last = len(pattern.segments) - 1
+    stack = [("", 0)]
+    while stack:
+        folder, index = stack.pop()
+        segment = pattern.segments[index]
+        if index < last and pattern.is_literal(index):
+            stack.append((folder + segment + "/", index + 1))
+        elif segment == "**":
+            blobs = bucket.list_blobs(prefix=folder, fields=fields, retry=retry)
+            yield from (blob for blob in blobs if pattern.match(blob.name))
+        elif index == last:
+            blobs = bucket.list_blobs(
+                prefix=folder + pattern.segment_prefix(index),
+                delimiter="/",
+                fields=fields,
+                retry=retry,
+            )
+            yield from (blob for blob in blobs if pattern.match(blob.name))
+        else:
+            start = len(folder)
+            subfolders = _list_prefixes(
+                bucket, folder + pattern.segment_prefix(index), retry
+            )
+            stack.extend(
+                (subfolder, index + 1)
+                for subfolder in reversed(subfolders)
+                if pattern.match_segment(index, subfolder[start:-1])
+            )
+
+
+def list_matching(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    pattern: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Iterator[storage.blob.Blob]:
+    """List the blobs whose names match a glob pattern.
+
+    Only the folders that the pattern can match are listed: the part of the
+    pattern before its first wildcard is sent as the listing prefix, and each
+    wildcard segment is listed with a delimiter so that folders that do not
+    match it are skipped. See gcsutils.glob.GlobPattern for the syntax.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      pattern (str): the pattern to match object names against, from the root
+                     of the bucket (eg/ "surveys/2020-*/**/*.tif")
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns an iterator of google.cloud.storage.blob.Blob
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
+
+    return _list_matching(bucket, GlobPattern(pattern), retry=retry)
+
+
+def download_matching(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    pattern: str,
+    directory: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    cache: Optional["BlobCache"] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> TransferSummary:
+    """Download the objects whose names match a glob pattern.
+
+    Objects are selected as by `list_matching`, and downloaded as by
+    `download_files`, while the listing is still in progress. Each object is
+    put at its path relative to the last folder before the first wildcard,
+    so "surveys/2020-*/*.tif" downloads "surveys/2020-01/a.tif" to
+    "2020-01/a.tif" below the directory.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      pattern (str): the pattern to match object names against
+      directory (str): the full path to the local directory where the objects
+                       should be downloaded
+      max_workers (int): the number of concurrent downloads (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any download
+                             failed (default True)
+      cache (gcsutils.cache.BlobCache): optional; a local cache to read the
+                                        objects through
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a gcsutils.transfer.TransferSummary with the per-file failures and
+    the aggregate byte count and throughput
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    glob_pattern = GlobPattern(pattern)
+    literal_prefix = glob_pattern.literal_prefix
+    base = literal_prefix[: literal_prefix.rfind("/") + 1]
+    blobs = _list_matching(bucket, glob_pattern, _OBJECT_FIELDS, retry)
+    summary = _download_blobs_from_bucket(
+        blobs, directory, max_workers, cache, retry, base
+    )
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
+
+
+def delete_matching(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    pattern: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Dict[str, Exception]:
+    """Delete the objects whose names match a glob pattern.
+
+    Objects are selected as by `list_matching`, and deleted in batches while
+    the listing is still in progress; see `delete_files`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      pattern (str): the pattern to match object names against
+      max_workers (int): the number of concurrent batch requests (default 16)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a dict mapping the path of each object that could not be deleted to
+    the exception describing the failure
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    blobs = _list_matching(
+        bucket, GlobPattern(pattern), "items(name),nextPageToken", retry
+    )
+
+    return _delete_blobs(bucket, (blob.name for blob in blobs), max_workers, retry)
 
 
 def delete_file(
     gcp_project_name: str,
     gcs_bucket_name: str,
     gcs_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
 ) -> None:
     """Delete an object from a Google Cloud Storage bucket.
 
@@ -191,23 +1192,184 @@ def delete_file(
       gcs_bucket_name (str): the Google Cloud Storage bucket name
       gcs_file_path (str): the path in GCS, including the file name,
                            of the object to be deleted
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
     """
     bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
     blob = bucket.blob(gcs_file_path)
     try:
-        blob.delete()
+        # A retried delete finds the object gone, which is the outcome asked for
+        with metrics.measure("delete"):
+            retry.run(functools.partial(blob.delete, retry=None))
     except google.api_core.exceptions.NotFound:
         pass
 
 
+class _DeleteBatch(Batch):
+    # Keep every sub-response instead of raising on the first failed one
+    def _finish_futures(self, responses):
+        self.responses = responses
+
+
+def _batch_failures(names: List[str], responses) -> Dict[str, Exception]:
+    return {
+        name: google.api_core.exceptions.from_http_response(response)
+        for name, response in zip(names, responses)
+        if response.status_code != 404 and not 200 <= response.status_code < 300
+    }
+
+
+@metrics.measured("delete_batch")
+def _delete_blob_batch(
+    bucket: storage.bucket.Bucket,
+    names: List[str],
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Dict[str, Exception]:
+    failures: Dict[str, Exception] = {}
+    pending = names
+
+    def send():
+        # Only the deletes that failed with a retryable error are sent again
+        nonlocal pending
+        batch = _DeleteBatch(bucket.client)
+        try:
+            with batch:
+                for name in pending:
+                    bucket.delete_blob(name, retry=None)
+        except Exception as e:
+            failures.update((name, e) for name in pending)
+            raise
+        for name in pending:
+            failures.pop(name, None)
+        failures.update(_batch_failures(pending, batch.responses))
+        pending = [
+            name
+            for name in pending
+            if name in failures and retry.retryable(failures[name])
+        ]
+        if pending:
+            raise failures[pending[0]]
+
+    try:
+        retry.run(send)
+    except Exception:
+        # Every failure has been recorded against its object name
+        pass
+
+    return failures
+
+
+def _delete_blobs(
+    bucket: storage.bucket.Bucket,
+    names: Iterable[str],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Dict[str, Exception]:
+    names = iter(names)
+    batches = iter(lambda: list(itertools.islice(names, _DELETE_BATCH_SIZE)), [])
+    failures: Dict[str, Exception] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        pending = set()
+        for batch in batches:
+            if len(pending) >= max_workers * 2:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    failures.update(future.result())
+            pending.add(executor.submit(_delete_blob_batch, bucket, batch, retry))
+        for future in concurrent.futures.wait(pending).done:
+            failures.update(future.result())
+
+    return failures
+
+
+def delete_files(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_paths: Iterable[str],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Dict[str, Exception]:
+    """Delete many objects from a Google Cloud Storage bucket.
+
+    Deletes are sent as batch requests of up to 100 objects, several batches at
+    a time. Objects that do not exist are ignored, as in `delete_file`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_paths (iterable): the paths in GCS, including the file names,
+                                 of the objects to be deleted
+      max_workers (int): the number of concurrent batch requests (default 16)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a dict mapping the path of each object that could not be deleted to
+    the exception describing the failure
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+
+    return _delete_blobs(bucket, gcs_file_paths, max_workers, retry)
+
+
+def delete_prefix(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Dict[str, Exception]:
+    """Delete every object under a path in a Google Cloud Storage bucket.
+
+    Objects are deleted in batches while the listing is still being paged
+    through; see `delete_files`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket; all of its
+                             contents, including subfolders, are deleted
+      max_workers (int): the number of concurrent batch requests (default 16)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a dict mapping the path of each object that could not be deleted to
+    the exception describing the failure
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    if not gcs_bucket_path.endswith("/"):
+        gcs_bucket_path = gcs_bucket_path + "/"
+    blobs = bucket.list_blobs(
+        prefix=gcs_bucket_path, fields="items(name),nextPageToken", retry=retry
+    )
+
+    return _delete_blobs(bucket, (blob.name for blob in blobs), max_workers, retry)
+
+
 def download_file(
     gcp_project_name: str,
     gcs_bucket_name: str,
     gcs_file_path: str,
     local_file_path: str,
+    sliced_threshold: Optional[int] = None,
+    sliced_parts: int = DEFAULT_SLICED_PARTS,
+    cache: Optional["BlobCache"] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    hedge: Optional[HedgePolicy] = None,
 ) -> None:
     """Download objects from a Google Cloud Storage bucket.
 
+    Objects of at least `sliced_threshold` bytes are downloaded as concurrent
+    byte ranges of a single object generation, written in place into the local
+    file, and then verified against the object's CRC32C checksum. Objects
+    stored with gzip content encoding are always downloaded in one stream.
+
+    For small objects, pass a `gcsutils.hedge.HedgePolicy` to cut the tail
+    latency: a download slower than usual is raced against a second request.
+    A hedged object is read into memory before it is written to the local
+    file, so objects larger than the policy's `max_size` are not hedged.
+
     Args:
       gcp_project_name (str): the Google Cloud Project name
       gcs_bucket_name (str): the Google Cloud Storage bucket name
@@ -215,29 +1377,239 @@ def download_file(
                            including the file name
       local_file_path (str): the full path where the object should
                              be downloaded, including the file name
+      sliced_threshold (int): optional; the object size, in bytes, from which
+                              to use a sliced download (default None, never)
+      sliced_parts (int): the number of ranges to split a sliced download into
+                          (default 8)
+      cache (gcsutils.cache.BlobCache): optional; a local cache to read the
+                                        object through
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+      hedge (gcsutils.hedge.HedgePolicy): optional; when given, hedge the
+                                          download of a small object
+    """
+    pool_size = max(sliced_parts, DEFAULT_MAX_WORKERS)
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, pool_size)
+    blob = bucket.blob(gcs_file_path)
+    download = functools.partial(
+        _download_object,
+        sliced_threshold=sliced_threshold,
+        sliced_parts=sliced_parts,
+        retry=retry,
+        hedge=hedge,
+    )
+    try:
+        if cache is None:
+            download(blob, local_file_path)
+        else:
+            cache.fetch(blob, local_file_path, download)
+    except google.api_core.exceptions.NotFound:
+        raise ValueError("File not found at {}".format(gcs_file_path))
+
+
+def open_blob(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    mode: str = "rb",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+    encoding: Optional[str] = None,
+    session_url: Optional[str] = None,
+    content_type: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+):
+    """Open an object in a Google Cloud Storage bucket as a file object.
+
+    In read mode the object is streamed in chunks of `chunk_size` bytes, with
+    the next `read_ahead` chunks fetched in the background, and nothing is
+    written to disk. The file object is seekable, and reads a single generation
+    of the object even if it is overwritten while open. Objects stored with
+    gzip content encoding are decompressed as they are read.
+
+    In write mode the data is uploaded in chunks of `chunk_size` bytes through
+    a resumable upload session, and the object is created when the file object
+    is closed. The session URL is available as the `session_url` attribute of
+    the binary file object (`.buffer.raw.session_url` in text mode), so an
+    interrupted upload can be continued; see `upload_stream`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_path (str): the object path in GCS, including the file name
+      mode (str): "rb" or "r" to read the object as a binary or text file
+                  object, "wb" or "w" to write it (default "rb")
+      chunk_size (int): the size of each ranged request or upload request, in
+                        bytes; a multiple of 256KiB for writes (default 8MiB)
+      read_ahead (int): the number of chunks to fetch ahead of the reader
+                        (default 2)
+      encoding (str): optional; the text encoding in text mode (default UTF-8)
+      session_url (str): optional; in write mode, an upload session to
+                         continue
+      content_type (str): optional; in write mode, the content type of the
+                          object
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a file object; use it as a context manager, or close it when done
     """
+    if mode not in ("r", "rb", "w", "wb"):
+        raise ValueError("Unsupported mode {!r}".format(mode))
     bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
     blob = bucket.blob(gcs_file_path)
+    if mode == "wb":
+        return open_writer(blob, chunk_size, session_url, content_type, retry=retry)
+    if mode == "w":
+        return open_writer(
+            blob, chunk_size, session_url, content_type, encoding or "utf-8", retry
+        )
+
     try:
-        blob.download_to_filename(local_file_path)
+        retry.run(functools.partial(blob.reload, retry=None))
     except google.api_core.exceptions.NotFound:
         raise ValueError("File not found at {}".format(gcs_file_path))
 
+    file_obj = open_reader(blob, chunk_size, read_ahead, retry)
+    if mode == "r":
+        return io.TextIOWrapper(file_obj, encoding=encoding or "utf-8")
+
+    return file_obj
+
+
+def create_upload_session(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    content_type: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> str:
+    """Start a resumable upload session for an object.
+
+    Keep the returned URL to resume an interrupted `upload_stream`.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_path (str): the object path in GCS, including the file name
+      content_type (str): optional; the content type of the object
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns the URL of the upload session
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
+    blob = bucket.blob(gcs_file_path)
+
+    return retry.run(
+        functools.partial(
+            blob.create_resumable_upload_session, content_type=content_type, retry=None
+        )
+    )
+
+
+def upload_stream(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_file_path: str,
+    source,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    session_url: Optional[str] = None,
+    content_type: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> storage.blob.Blob:
+    """Upload data from a file object or an iterator to a Google Cloud Storage bucket.
+
+    The data is uploaded in chunks through a resumable upload session, with
+    about one chunk held in memory, and never written to local disk. To make an
+    upload resumable, start the session with `create_upload_session` and pass
+    its URL. If the upload is interrupted, call this again with the same URL
+    and a source that produces the same data: the part already committed to GCS
+    is skipped, and the upload continues from there. Failed requests within
+    one call are retried the same way, from the committed offset.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_file_path (str): the object path in GCS, including the file name
+      source (file or iterable): a binary file object, or an iterable of bytes
+      chunk_size (int): the size of each upload request, in bytes; a multiple
+                        of 256KiB (default 8MiB)
+      session_url (str): optional; the URL of the upload session to use
+      content_type (str): optional; the content type of the object
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns the google.cloud.storage.blob.Blob that was created
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
+    blob = bucket.blob(gcs_file_path)
+
+    return stream_to_blob(blob, source, chunk_size, session_url, content_type, retry)
+
 
 def download_files(
-    gcp_project_name: str, gcs_bucket_name: str, gcs_bucket_path: str, directory: str
-) -> None:
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    directory: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    cache: Optional["BlobCache"] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    recursive: bool = False,
+    journal_path: Optional[str] = None,
+) -> TransferSummary:
     """Download objects from a Google Cloud Storage bucket.
 
+    Objects are downloaded concurrently while the bucket listing is still being
+    paged through. A failed download does not stop the others; every object is
+    attempted before any error is reported. Each object is downloaded to a
+    temporary file that is renamed into place once complete.
+
+    With `recursive`, every object below the bucket path is downloaded, to
+    the path below the directory that matches its name relative to the bucket
+    path, so "<gcs_bucket_path>/a/b.txt" is downloaded to "a/b.txt".
+    Otherwise only the objects directly in the bucket path are downloaded.
+    Folder placeholders, and names containing a ".." segment, are skipped.
+
+    With a `journal_path`, every completed download is appended to a journal.
+    If the job is interrupted and run again with the same journal, objects
+    that were downloaded, and whose files have not changed since, are
+    skipped, and counted as such in the summary.
+
     Args:
       gcp_project_name (str): the Google Cloud Project name
       gcs_bucket_name (str): the Google Cloud Storage bucket name
       gcs_bucket_path (str): the storage path in the bucket
       directory (str): the full path to the local directory where the objects
                        should be downloaded
+      max_workers (int): the number of concurrent downloads (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any download
+                             failed (default True)
+      cache (gcsutils.cache.BlobCache): optional; a local cache to read the
+                                        objects through
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+      recursive (bool): when True, also download the objects in subfolders
+                        (default False)
+      journal_path (str): optional; the path of a gcsutils.journal.TransferJournal
+                          that records completed downloads, so that a rerun skips
+                          them (default None)
+
+    Returns a gcsutils.transfer.TransferSummary with the per-file failures and
+    the aggregate byte count and throughput
     """
-    blobs = list_bucket_contents(gcp_project_name, gcs_bucket_name, gcs_bucket_path)
-    _download_blobs_from_bucket(blobs, directory)
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    blobs = _list_blobs(bucket, gcs_bucket_path, recursive, retry)
+    prefix = as_folder(gcs_bucket_path) if recursive else None
+    with _open_journal(journal_path) as journal:
+        summary = _download_blobs_from_bucket(
+            blobs, directory, max_workers, cache, retry, prefix, journal
+        )
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
 
 
 def rename_file(
@@ -245,9 +1617,13 @@ def rename_file(
     gcs_bucket_name: str,
     original_gcs_file_path: str,
     new_gcs_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
 ) -> None:
     """Rename (move) an object in a Google Cloud Storage bucket.
 
+    The object is copied, and the original deleted once the copy is verified;
+    see `move_prefix`.
+
     Args:
       gcp_project_name (str): the Google Cloud Project name
       gcs_bucket_name (str): the Google Cloud Storage bucket name
@@ -255,21 +1631,18 @@ def rename_file(
                                     the object, including the file name
       new_gcs_file_path (str): the new full Google Cloud Storage path to the object,
                                including the file name
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
     """
     bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
     blob = bucket.blob(original_gcs_file_path)
-    bucket.rename_blob(blob, new_gcs_file_path)
+    retry.run(functools.partial(blob.reload, retry=None))
+    _rewrite_blob(blob, bucket.blob(new_gcs_file_path), True, retry)
 
 
-def _copy_blob(blob, bucket, new_path, retries=0):
-    try:
-        bucket.copy_blob(blob, bucket, new_path)
-    except google.api_core.exceptions.ServiceUnavailable as e:
-        logging.warning(e)
-        if retries > 5:
-            raise e
-        time.sleep(2**retries)
-        _copy_blob(blob, bucket, new_path, retries=retries + 1)
+@metrics.measured("copy")
+def _copy_blob(blob, bucket, new_path, retry: RetryPolicy = DEFAULT_RETRY):
+    retry.run(functools.partial(bucket.copy_blob, blob, bucket, new_path, retry=None))
 
 
 def copy_file(
@@ -277,6 +1650,7 @@ def copy_file(
     gcs_bucket_name: str,
     original_gcs_file_path: str,
     new_gcs_file_path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
 ) -> None:
     """Copy an object in a Google Cloud Storage bucket.
 
@@ -287,42 +1661,557 @@ def copy_file(
                                     the object, including the file name
       new_gcs_file_path (str): the new full Google Cloud Storage path to the object,
                                including the file name
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
     """
     bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name)
     blob = bucket.blob(original_gcs_file_path)
-    _copy_blob(blob, bucket, new_gcs_file_path)
+    _copy_blob(blob, bucket, new_gcs_file_path, retry)
+
+
+@metrics.measured("rewrite")
+def _rewrite_blob(
+    source_blob: storage.blob.Blob,
+    destination_blob: storage.blob.Blob,
+    delete_source: bool = False,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> int:
+    # Large objects, and copies between locations or storage classes, may take
+    # several rewrite calls, each returning a token to continue from. Every
+    # call copies the same source generation, so each is safe to retry.
+    token = None
+    while True:
+        token, _, size = retry.run(
+            functools.partial(
+                destination_blob.rewrite, source_blob, token=token, retry=None
+            )
+        )
+        if token is None:
+            break
+    if source_blob.crc32c is not None and destination_blob.crc32c != (
+        source_blob.crc32c
+    ):
+        raise DataCorruption(
+            None,
+            "Checksum mismatch while copying {} to {}: expected CRC32C {}, "
+            "got {}".format(
+                source_blob.name,
+                destination_blob.name,
+                source_blob.crc32c,
+                destination_blob.crc32c,
+            ),
+        )
+    if delete_source:
+        # The live object is deleted only if it is still the generation that
+        # was copied; a source overwritten during the copy is left in place,
+        # and the precondition failure is reported
+        try:
+            retry.run(
+                functools.partial(
+                    source_blob.bucket.delete_blob,
+                    source_blob.name,
+                    if_generation_match=source_blob.generation,
+                    retry=None,
+                )
+            )
+        except google.api_core.exceptions.NotFound:
+            pass
+
+    return size
+
+
+def _copy_prefix(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    source_prefix: str,
+    destination_prefix: str,
+    destination_bucket_name: Optional[str],
+    max_workers: int,
+    on_result: Optional[Callable[[TransferResult], None]],
+    delete_source: bool,
+    retry: RetryPolicy,
+) -> TransferSummary:
+    source_prefix = as_folder(source_prefix)
+    destination_prefix = as_folder(destination_prefix)
+    destination_bucket_name = destination_bucket_name or gcs_bucket_name
+    if destination_bucket_name == gcs_bucket_name and destination_prefix.startswith(
+        source_prefix
+    ):
+        # The copies would show up in the listing that is still being read
+        raise ValueError(
+            "The destination {!r} is inside the source {!r}".format(
+                destination_prefix, source_prefix
+            )
+        )
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    destination_bucket = get_storage_bucket(
+        gcp_project_name, destination_bucket_name, max_workers
+    )
+    start = len(source_prefix)
+    items = (
+        (blob, destination_bucket.blob(destination_prefix + blob.name[start:]))
+        for blob in bucket.list_blobs(
+            prefix=source_prefix, fields=_OBJECT_FIELDS, retry=retry
+        )
+    )
+    transfer = functools.partial(
+        _rewrite_blob, delete_source=delete_source, retry=retry
+    )
+
+    return run_transfers(transfer, items, max_workers, on_result)
+
+
+def copy_prefix(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    source_prefix: str,
+    destination_prefix: str,
+    destination_bucket_name: Optional[str] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    on_result: Optional[Callable[[TransferResult], None]] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> TransferSummary:
+    """Copy every object under a path, within or between buckets.
+
+    Objects are copied server-side with concurrent rewrite requests while the
+    source listing is still being paged through, so no data passes through
+    this process. Each copy is of the object generation that was listed, and
+    is verified against the source's CRC32C checksum. Subfolders are copied
+    too, keeping their relative paths.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name to copy from
+      source_prefix (str): the storage path in the bucket to copy from
+      destination_prefix (str): the storage path to copy to
+      destination_bucket_name (str): optional; the bucket to copy to (default
+                                     the source bucket)
+      max_workers (int): the number of concurrent copies (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any copy
+                             failed (default True)
+      on_result (callable): optional; called with the
+                            gcsutils.transfer.TransferResult of each object as
+                            it completes, eg/ to report progress
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a gcsutils.transfer.TransferSummary
+    """
+    summary = _copy_prefix(
+        gcp_project_name,
+        gcs_bucket_name,
+        source_prefix,
+        destination_prefix,
+        destination_bucket_name,
+        max_workers,
+        on_result,
+        delete_source=False,
+        retry=retry,
+    )
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
+
+
+def move_prefix(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    source_prefix: str,
+    destination_prefix: str,
+    destination_bucket_name: Optional[str] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    on_result: Optional[Callable[[TransferResult], None]] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> TransferSummary:
+    """Move every object under a path, within or between buckets.
+
+    Objects are copied as in `copy_prefix`, and each source object is deleted
+    only once its copy is complete and verified. A source object that is
+    overwritten during the move is not deleted, and is reported as a failure.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name to move from
+      source_prefix (str): the storage path in the bucket to move from
+      destination_prefix (str): the storage path to move to
+      destination_bucket_name (str): optional; the bucket to move to (default
+                                     the source bucket)
+      max_workers (int): the number of concurrent moves (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any move
+                             failed (default True)
+      on_result (callable): optional; called with the
+                            gcsutils.transfer.TransferResult of each object as
+                            it completes, eg/ to report progress
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a gcsutils.transfer.TransferSummary
+    """
+    summary = _copy_prefix(
+        gcp_project_name,
+        gcs_bucket_name,
+        source_prefix,
+        destination_prefix,
+        destination_bucket_name,
+        max_workers,
+        on_result,
+        delete_source=True,
+        retry=retry,
+    )
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
 
 
 def upload_file(
-    gcp_project_name: str, gcs_bucket_name: str, gcs_bucket_path: str, file_path: str
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    file_path: str,
+    composite_threshold: Optional[int] = None,
+    composite_parts: int = DEFAULT_COMPOSITE_PARTS,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    compress: bool = False,
 ) -> None:
     """Upload a single file to a Google Cloud Storage Bucket.
 
+    Files of at least `composite_threshold` bytes are uploaded as a parallel
+    composite upload: the file is split into parts that are uploaded
+    concurrently as temporary objects and then composed into the final object.
+    The temporary objects are deleted whether or not the upload succeeds.
+    Composite objects have a CRC32C checksum but no MD5 hash.
+
+    With `compress`, a compressible file is gzipped as it is uploaded and
+    stored with gzip content encoding; see `upload_files`. Compressed files
+    are never uploaded as composite uploads.
+
     Args:
       gcp_project_name (str): the Google Cloud Project name
       gcs_bucket_name (str): the Google Cloud Storage bucket name
       gcs_bucket_path (str): the storage path in the bucket
       file_path (str): the full path to the local directory containing the
                        file to upload
+      composite_threshold (int): optional; the file size, in bytes, from which
+                                 to use a parallel composite upload (default
+                                 None, never)
+      composite_parts (int): the number of parts to split a composite upload
+                             into (default 8)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+      compress (bool): when True, gzip the file if it is compressible
+                       (default False)
     """
-    _upload_files_to_bucket(
-        gcp_project_name, gcs_bucket_name, gcs_bucket_path, [file_path]
-    )
+    pool_size = max(composite_parts, DEFAULT_MAX_WORKERS)
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, pool_size)
+    blob_name = os.path.join(gcs_bucket_path, os.path.basename(file_path))
+    if compress and _is_compressible(file_path):
+        _upload_compressed(bucket.blob(blob_name), file_path, retry)
+    elif composite_threshold is not None and os.path.getsize(file_path) >= max(
+        composite_threshold, 1
+    ):
+        _upload_composite(bucket, file_path, blob_name, composite_parts, retry)
+    else:
+        _upload_file_to_bucket(bucket, file_path, blob_name, retry)
 
 
 def upload_files(
-    gcp_project_name: str, gcs_bucket_name: str, gcs_bucket_path: str, directory: str
-) -> None:
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    directory: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    recursive: bool = False,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    journal_path: Optional[str] = None,
+    compress: bool = False,
+) -> TransferSummary:
     """Upload files to a Google Cloud Storage Bucket.
 
+    Files are uploaded concurrently. A failed upload does not stop the others;
+    every file is attempted before any error is reported.
+
+    With `recursive`, the files in every subdirectory are uploaded too, named
+    by their path relative to the directory, so "a/b.txt" is uploaded to
+    "<gcs_bucket_path>/a/b.txt". The tree is walked while the uploads run, so
+    a large tree is never listed in full up front.
+
+    `include` and `exclude` are shell-style patterns, as in fnmatch, matched
+    against the relative path of each file with "/" separators; "*" also
+    matches "/". A file is uploaded if it matches any include pattern and no
+    exclude pattern. A subdirectory whose relative path matches an exclude
+    pattern is not walked at all.
+
+    With a `journal_path`, every completed upload is appended to a journal. If
+    the job is interrupted and run again with the same journal, files that were
+    uploaded and have not changed since are skipped, and counted as such in
+    the summary.
+
+    With `compress`, compressible files are gzipped as they are uploaded, on
+    the upload threads, and stored with gzip content encoding; no compressed
+    copy is written to disk. Files with an extension in COMPRESSIBLE_EXTENSIONS
+    are compressible, and so is any other file whose first 64KiB compress to at
+    most 80% of their size. GCS decompresses such objects for clients that do
+    not accept gzip, and the download functions of gcsutils decompress them
+    locally, so they read back as the original files.
+
     Args:
       gcp_project_name (str): the Google Cloud Project name
       gcs_bucket_name (str): the Google Cloud Storage bucket name
       gcs_bucket_path (str): the storage path in the bucket
       directory (str): the full path to the local directory containing the
                        files to upload
+      max_workers (int): the number of concurrent uploads (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any upload
+                             failed (default True)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+      recursive (bool): when True, also upload the files in subdirectories
+                        (default False)
+      include (list): optional; patterns of the files to upload (default all)
+      exclude (list): optional; patterns of the files and subdirectories to
+                      skip (default none)
+      journal_path (str): optional; the path of a gcsutils.journal.TransferJournal
+                          that records completed uploads, so that a rerun skips
+                          them (default None)
+      compress (bool): when True, gzip the files that are compressible
+                       (default False)
+
+    Returns a gcsutils.transfer.TransferSummary with the per-file failures and
+    the aggregate byte count and throughput
     """
-    file_paths = _get_file_paths_from_directory(directory)
-    _upload_files_to_bucket(
-        gcp_project_name, gcs_bucket_name, gcs_bucket_path, file_paths
-    )
+    files = _select_files(directory, recursive, include, exclude)
+    with _open_journal(journal_path) as journal:
+        summary = _upload_files_to_bucket(
+            gcp_project_name,
+            gcs_bucket_name,
+            gcs_bucket_path,
+            files,
+            max_workers,
+            retry,
+            journal,
+            compress,
+        )
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
+
+
+def _walk_directory(
+    directory: str, exclude: Optional[Sequence[str]] = None
+) -> Iterator[Tuple[str, str]]:
+    # Lazily yield (relative path with "/" separators, full path) for every
+    # file below the directory. Symbolic links to directories are not followed,
+    # and directories matching an exclude pattern are not entered.
+    stack = [("", directory)]
+    while stack:
+        relative_dir, path = stack.pop()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                relative_path = relative_dir + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if not _matches(relative_path, exclude):
+                        stack.append((relative_path + "/", entry.path))
+                elif entry.is_file():
+                    yield relative_path, entry.path
+
+
+def _is_unchanged(
+    manifest: HashManifest, key: str, file_path: str, blob: storage.blob.Blob
+) -> bool:
+    if os.path.getsize(file_path) != blob.size:
+        return False
+    if manifest.generation(key, file_path) == blob.generation:
+        return True
+    if manifest.crc32c(key, file_path) != blob.crc32c:
+        return False
+    manifest.record(key, file_path, blob.crc32c, blob.generation)
+
+    return True
+
+
+def _delete_extraneous_files(
+    directory: str, keys: Set[str], manifest: HashManifest
+) -> None:
+    manifest_path = os.path.abspath(manifest.path)
+    for key, file_path in list(_walk_directory(directory)):
+        if key not in keys and os.path.abspath(file_path) != manifest_path:
+            os.remove(file_path)
+            manifest.discard(key)
+
+
+def _add_delete_failures(
+    summary: TransferSummary, failures: Dict[str, Exception]
+) -> None:
+    for name, error in failures.items():
+        summary.add(TransferResult(name, "", error=error))
+
+
+def sync_to_bucket(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    directory: str,
+    delete_extraneous: bool = False,
+    manifest_path: Optional[str] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> TransferSummary:
+    """Upload the files in a directory tree that differ from a bucket path.
+
+    A file is skipped when an object of the same relative name has the same
+    size and CRC32C checksum. Computed checksums are kept in a manifest file,
+    along with the object generation each file matched, so unchanged files are
+    not re-hashed on every run. Each upload only replaces the object generation
+    that was listed, so an object changed by someone else during the sync is
+    reported as a failed upload rather than overwritten.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket
+      directory (str): the full path to the local directory to upload
+      delete_extraneous (bool): when True, delete objects under the bucket path
+                                that have no matching local file (default False)
+      manifest_path (str): optional; the path of the manifest file (default
+                           ".gcsutils-manifest.json" in the directory)
+      max_workers (int): the number of concurrent uploads (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any upload
+                             or delete failed (default True)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a gcsutils.transfer.TransferSummary; unchanged files are counted
+    as skipped
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    if not gcs_bucket_path.endswith("/"):
+        gcs_bucket_path = gcs_bucket_path + "/"
+    start = len(gcs_bucket_path)
+    manifest_path = manifest_path or os.path.join(directory, MANIFEST_FILE_NAME)
+    remote = {
+        blob.name[start:]: blob
+        for blob in bucket.list_blobs(
+            prefix=gcs_bucket_path, fields=_OBJECT_FIELDS, retry=retry
+        )
+    }
+    generations = {}
+    skipped = 0
+
+    with HashManifest(manifest_path) as manifest:
+
+        def changed_files():
+            nonlocal skipped
+            for key, file_path in _walk_directory(directory):
+                if os.path.abspath(file_path) == os.path.abspath(manifest_path):
+                    continue
+                blob = remote.pop(key, None)
+                if blob is not None and _is_unchanged(manifest, key, file_path, blob):
+                    skipped += 1
+                    continue
+                generations[key] = blob.generation if blob is not None else 0
+                yield file_path, gcs_bucket_path + key
+
+        def upload(file_path, blob_name):
+            blob = bucket.blob(blob_name)
+            generation = generations.pop(blob_name[start:])
+            _upload_with_retry(blob, file_path, retry, if_generation_match=generation)
+            manifest.record(blob_name[start:], file_path, blob.crc32c, blob.generation)
+            return os.path.getsize(file_path)
+
+        summary = run_transfers(upload, changed_files(), max_workers)
+        summary.skipped = skipped
+        if delete_extraneous:
+            names = (gcs_bucket_path + key for key in remote)
+            failures = _delete_blobs(bucket, names, max_workers, retry)
+            _add_delete_failures(summary, failures)
+
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
+
+
+def sync_from_bucket(
+    gcp_project_name: str,
+    gcs_bucket_name: str,
+    gcs_bucket_path: str,
+    directory: str,
+    delete_extraneous: bool = False,
+    manifest_path: Optional[str] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    raise_on_error: bool = True,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> TransferSummary:
+    """Download the objects under a bucket path that differ from a directory tree.
+
+    An object is skipped when the local file of the same relative name is
+    unchanged since it was last synced with the same object generation, or has
+    the same size and CRC32C checksum. Computed checksums are kept in a
+    manifest file, so unchanged files are not re-hashed on every run.
+
+    Args:
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      gcs_bucket_path (str): the storage path in the bucket
+      directory (str): the full path to the local directory to download into
+      delete_extraneous (bool): when True, delete local files that have no
+                                matching object (default False)
+      manifest_path (str): optional; the path of the manifest file (default
+                           ".gcsutils-manifest.json" in the directory)
+      max_workers (int): the number of concurrent downloads (default 16)
+      raise_on_error (bool): when True, raise a TransferError if any download
+                             failed (default True)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a gcsutils.transfer.TransferSummary; unchanged objects are counted
+    as skipped
+    """
+    bucket = get_storage_bucket(gcp_project_name, gcs_bucket_name, max_workers)
+    if not gcs_bucket_path.endswith("/"):
+        gcs_bucket_path = gcs_bucket_path + "/"
+    start = len(gcs_bucket_path)
+    manifest_path = manifest_path or os.path.join(directory, MANIFEST_FILE_NAME)
+    remote_keys = set()
+    skipped = 0
+
+    with HashManifest(manifest_path) as manifest:
+
+        def changed_blobs():
+            nonlocal skipped
+            blobs = bucket.list_blobs(
+                prefix=gcs_bucket_path, fields=_OBJECT_FIELDS, retry=retry
+            )
+            for blob, file_path in _local_paths(blobs, gcs_bucket_path, directory):
+                key = blob.name[start:]
+                remote_keys.add(key)
+                if os.path.isfile(file_path) and _is_unchanged(
+                    manifest, key, file_path, blob
+                ):
+                    skipped += 1
+                    continue
+                yield blob, file_path
+
+        def download(blob, file_path):
+            _download_atomically(blob, file_path, retry)
+            manifest.record(blob.name[start:], file_path, blob.crc32c, blob.generation)
+            return blob.size
+
+        summary = run_transfers(download, changed_blobs(), max_workers)
+        summary.skipped = skipped
+        if delete_extraneous:
+            _delete_extraneous_files(directory, remote_keys, manifest)
+
+    if raise_on_error and summary.failures:
+        raise TransferError(summary)
+
+    return summary
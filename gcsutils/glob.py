@@ -0,0 +1,132 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import re
+from typing import List, Optional, Tuple
+
+_WILDCARDS = "*?["
+
+
+def _literal_prefix(text: str) -> str:
+    # The part of a pattern before its first wildcard
+    match = re.search(r"[*?[]", text)
+    return text[: match.start()] if match else text
+
+
+def _translate_class(segment: str, start: int) -> Optional[Tuple[str, int]]:
+    # Translate the character set that opens at segment[start]; returns the
+    # regular expression and the index after the set, or None if it is not
+    # closed
+    end = start + 1
+    if end < len(segment) and segment[end] == "!":
+        end += 1
+    if end < len(segment) and segment[end] == "]":
+        end += 1
+    end = segment.find("]", end)
+    if end < 0:
+        return None
+    first = start + 1
+    members = segment[first:end].replace("\\", "\\\\")
+    # A set never matches "/", so it can't cross a folder boundary
+    if members.startswith("!"):
+        members = members[1:]
+        if members.startswith("]"):
+            members = "\\" + members
+        return "[^/" + members + "]", end + 1
+    if members.startswith("^"):
+        members = "\\" + members
+    return "(?!/)[" + members + "]", end + 1
+
+
+def _translate_segment(segment: str) -> str:
+    parts = []
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        translated = _translate_class(segment, i) if c == "[" else None
+        if translated is not None:
+            part, i = translated
+            parts.append(part)
+            continue
+        parts.append({"*": "[^/]*", "?": "[^/]"}.get(c, re.escape(c)))
+        i += 1
+
+    return "".join(parts)
+
+
+def _translate(segments: List[str]) -> str:
+    parts = []
+    last = len(segments) - 1
+    for i, segment in enumerate(segments):
+        if segment == "**":
+            # Any number of folders, or everything below the folder if last
+            parts.append(".*" if i == last else "(?:[^/]*/)*")
+        else:
+            parts.append(_translate_segment(segment) + ("" if i == last else "/"))
+
+    return "".join(parts)
+
+
+class GlobPattern:
+    """A compiled glob pattern over object names.
+
+    The pattern is matched against whole names, one "/"-separated segment at a
+    time: "*" matches any characters within a segment, "?" matches one
+    character, "[...]" matches one character of a set ("[!...]" of its
+    complement), and a "**" segment matches any number of folders, including
+    none. So "surveys/2020-*/**/*.tif" matches "surveys/2020-01/a.tif" and
+    "surveys/2020-01/x/y/b.tif", but not "surveys/2021-01/a.tif".
+
+    Args:
+      pattern (str): the pattern, eg/ "surveys/2020-*/**/*.tif"
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.segments = pattern.split("/")
+        self._regex = re.compile(_translate(self.segments))
+        self._segment_regexes = [
+            re.compile(_translate_segment(s)) for s in self.segments
+        ]
+
+    @property
+    def literal_prefix(self) -> str:
+        """The longest prefix that every matching name starts with."""
+        return _literal_prefix(self.pattern)
+
+    def segment_prefix(self, index: int) -> str:
+        """Return the part of a segment of the pattern before its first wildcard."""
+        return _literal_prefix(self.segments[index])
+
+    def match(self, name: str) -> bool:
+        """Return True if an object name matches the whole pattern."""
+        return self._regex.fullmatch(name) is not None
+
+    def match_segment(self, index: int, segment: str) -> bool:
+        """Return True if one segment of a name matches the pattern's segment.
+
+        Args:
+          index (int): the index of the segment in the pattern
+          segment (str): the segment of the name, without any "/"
+        """
+        return self._segment_regexes[index].fullmatch(segment) is not None
+
+    def is_literal(self, index: int) -> bool:
+        """Return True if a segment of the pattern has no wildcards."""
+        return not any(c in self.segments[index] for c in _WILDCARDS)
+
+    def __repr__(self):
+        return "GlobPattern({!r})".format(self.pattern)
@@ -0,0 +1,186 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+import collections
+import concurrent.futures
+import math
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from gcsutils.retry import RetryBudget
+
+T = TypeVar("T")
+
+DEFAULT_MAX_SIZE = 8 * 1024 * 1024
+
+
+class HedgePolicy:
+    """Sends a second request when the first is slower than usual.
+
+    A hedged operation is started once; if it has not completed after the
+    `percentile` latency of recently completed operations, the same operation
+    is started again, the first result is used, and the other is cancelled.
+    This trades a few extra requests for a much shorter tail of slow
+    responses, and suits small reads, where the latency of a request is
+    dominated by the service rather than the transfer.
+
+    The latency of an operation is measured from the start of its first
+    attempt until a result is returned, so a hedged operation is recorded
+    with the time it actually took.
+
+    No operation is hedged until `min_samples` latencies have been recorded.
+    Hedges are taken from a budget that every operation adds `max_hedge_rate`
+    to, so at most that fraction of operations (after a first burst of
+    `max_burst`) sends a second request. A policy is safe to share between
+    threads; share one per kind of request so that it learns their latency.
+
+    Args:
+      percentile (float): the latency percentile after which to hedge
+                          (default 95)
+      max_hedge_rate (float): the largest fraction of operations that may be
+                              hedged (default 0.05)
+      min_samples (int): the latencies to record before hedging (default 20)
+      window (int): the number of recent latencies to keep (default 1000)
+      max_burst (float): the largest number of hedges that may be sent
+                         back to back (default 10)
+      max_workers (int): the number of threads running hedged operations
+                         (default 32)
+      max_size (int): the largest object, in bytes, whose download is hedged;
+                      larger objects are downloaded normally (default 8 MiB)
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        max_hedge_rate: float = 0.05,
+        min_samples: int = 20,
+        window: int = 1000,
+        max_burst: float = 10.0,
+        max_workers: int = 32,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        if not 0 < percentile < 100:
+            raise ValueError("percentile must be between 0 and 100")
+        self.percentile = percentile
+        self.min_samples = max(min_samples, 1)
+        self.max_size = max_size
+        self.requests = 0
+        self.hedges = 0
+        self._latencies: "collections.deque[float]" = collections.deque(maxlen=window)
+        self._budget = RetryBudget(max_hedge_rate, 0.0, max_burst)
+        self._max_workers = max_workers
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        """Record the latency of a completed operation, in seconds."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        """Return the time after which to hedge, or None to not hedge yet."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = math.ceil(len(latencies) * self.percentile / 100) - 1
+        return latencies[index]
+
+    def _should_hedge(self) -> bool:
+        if not self._budget.withdraw():
+            return False
+        with self._lock:
+            self.hedges += 1
+        return True
+
+    def _start(self) -> Optional[float]:
+        self._budget.deposit()
+        with self._lock:
+            self.requests += 1
+        return self.delay()
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self._max_workers, thread_name_prefix="gcsutils-hedge"
+                )
+            return self._executor
+
+    def run(self, operation: Callable[[threading.Event], T]) -> T:
+        """Call `operation`, hedging it if it is slow.
+
+        The operation is called on a worker thread with a threading.Event,
+        which is set when its result is no longer needed; a long operation
+        should check it and stop early.
+
+        Returns the first result; if every attempt fails, the first error is
+        raised
+        """
+        delay = self._start()
+        executor = self._get_executor()
+        start = time.monotonic()
+        cancels = {}
+        cancel = threading.Event()
+        cancels[executor.submit(operation, cancel)] = cancel
+        done, _ = concurrent.futures.wait(cancels, timeout=delay)
+        if not done and self._should_hedge():
+            cancel = threading.Event()
+            cancels[executor.submit(operation, cancel)] = cancel
+
+        errors = []
+        for future in concurrent.futures.as_completed(cancels):
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            for other, cancel in cancels.items():
+                if other is not future:
+                    other.cancel()
+                    cancel.set()
+            self.record(time.monotonic() - start)
+            return result
+        raise errors[0]
+
+    async def run_async(self, operation: Callable[[], Awaitable[T]]) -> T:
+        """Await `operation()`, hedging it if it is slow.
+
+        The asyncio counterpart of `run`; the slower attempt is cancelled.
+        """
+        delay = self._start()
+        start = time.monotonic()
+        pending = {asyncio.ensure_future(operation())}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and self._should_hedge():
+                pending.add(asyncio.ensure_future(operation()))
+            errors = []
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.record(time.monotonic() - start)
+                        return task.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,320 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Set, Tuple
+
+from gcsutils import gcs
+from gcsutils.glob import GlobPattern
+from gcsutils.listing import ObjectInfo, as_folder, list_pages, list_sharded
+from gcsutils.retry import DEFAULT_RETRY, RetryPolicy
+from gcsutils.transfer import DEFAULT_MAX_WORKERS
+
+# Rows are staged in batches of this many objects
+_INSERT_BATCH_SIZE = 1000
+_FIELDS = "items(name,size,crc32c,generation,updated),prefixes,nextPageToken"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    crc32c TEXT,
+    generation INTEGER,
+    updated TEXT,
+    PRIMARY KEY (bucket, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS prefixes (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    refreshed REAL NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+) WITHOUT ROWID;
+"""
+
+# A listing is collected here, private to the connection, before it is
+# copied into the shared tables in one short transaction
+_STAGING_SCHEMA = """
+CREATE TEMP TABLE IF NOT EXISTS staging (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    crc32c TEXT,
+    generation INTEGER,
+    updated TEXT
+) WITHOUT ROWID;
+"""
+
+
+def _prefix_range(prefix: str) -> Tuple[str, str]:
+    # The names that start with `prefix` sort in [prefix, upper) in SQLite's
+    # binary collation, which orders UTF-8 text by code point
+    if not prefix:
+        return "", chr(0x10FFFF)
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ListingIndex:
+    """A persistent local snapshot of the listing of a bucket, in SQLite.
+
+    The index keeps the name, size, CRC32C checksum, generation and updated
+    time of every object below the paths it has refreshed, so that repeated
+    prefix, folder and glob queries are answered locally, without paging
+    through the bucket again.
+
+    `refresh` lists the folders directly below a path, and relists only those
+    that appeared since the last refresh, or that were last refreshed more
+    than `ttl` seconds ago; folders that disappeared are dropped. The objects
+    directly in the path are relisted on every refresh. Several processes can
+    share one index file: a listing is staged in a table private to the
+    connection while it is paged through, and only then swapped into the
+    index in a single short transaction, so other processes are not locked
+    out for the duration of the listing.
+
+    Queries only return what the last refresh saw, so call `refresh` first
+    when the listing must be current.
+
+    Args:
+      path (str): the path of the SQLite database file
+      gcp_project_name (str): the Google Cloud Project name
+      gcs_bucket_name (str): the Google Cloud Storage bucket name
+      ttl (float): the number of seconds after which a refreshed folder is
+                   relisted (default 3600)
+      max_workers (int): the number of concurrent listing requests (default 16)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        gcp_project_name: str,
+        gcs_bucket_name: str,
+        ttl: float = 3600.0,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        retry: RetryPolicy = DEFAULT_RETRY,
+    ):
+        self.path = path
+        self.gcp_project_name = gcp_project_name
+        self.gcs_bucket_name = gcs_bucket_name
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.retry = retry
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # Readers in other processes are not blocked by a refresh
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.executescript(_SCHEMA + _STAGING_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+    def _stage(self, objects: Iterable[ObjectInfo]) -> int:
+        # Only the temporary database is written, so this takes no lock on
+        # the index file
+        rows = [tuple(o) for o in objects]
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO staging VALUES (?, ?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+    def _unstage(self) -> None:
+        # Copy the staged listing into the index; call in a transaction
+        self._db.execute(
+            "INSERT OR REPLACE INTO objects SELECT ?, * FROM staging",
+            (self.gcs_bucket_name,),
+        )
+        self._db.execute("DELETE FROM staging")
+
+    def _delete_below(self, prefix: str) -> None:
+        low, high = _prefix_range(prefix)
+        for table, column in (("objects", "name"), ("prefixes", "prefix")):
+            self._db.execute(
+                "DELETE FROM {0} WHERE bucket = ? AND {1} >= ? AND {1} < ?".format(
+                    table, column
+                ),
+                (self.gcs_bucket_name, low, high),
+            )
+
+    def _refresh_level(self, bucket, prefix: str) -> Tuple[int, Set[str]]:
+        # Relist the objects directly in `prefix`, and return their count and
+        # the folders below it
+        low, high = _prefix_range(prefix)
+        count, folders = 0, set()
+        with self._db:
+            self._db.execute("DELETE FROM staging")
+        for objects, prefixes in list_pages(bucket, prefix, "/", _FIELDS, self.retry):
+            count += self._stage(objects)
+            folders.update(prefixes)
+        with self._db:
+            self._db.execute(
+                "DELETE FROM objects WHERE bucket = ? AND name >= ? AND name < ?"
+                " AND instr(substr(name, ?), '/') = 0",
+                (self.gcs_bucket_name, low, high, len(prefix) + 1),
+            )
+            self._unstage()
+
+        return count, folders
+
+    def _refresh_folder(self, bucket, folder: str) -> int:
+        # Relist everything below a folder into the staging table, a batch of
+        # objects at a time, then replace the folder in one transaction
+        count = 0
+        objects = list_sharded(
+            bucket, folder, max_workers=self.max_workers, retry=self.retry
+        )
+        with self._db:
+            self._db.execute("DELETE FROM staging")
+        batch = []
+        for info in objects:
+            batch.append(info)
+            if len(batch) == _INSERT_BATCH_SIZE:
+                count += self._stage(batch)
+                batch = []
+        count += self._stage(batch)
+        with self._db:
+            self._delete_below(folder)
+            self._unstage()
+            self._db.execute(
+                "INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?)",
+                (self.gcs_bucket_name, folder, time.time()),
+            )
+
+        return count
+
+    def _expired_folders(self, folders: Set[str]) -> List[str]:
+        expires = time.time() - self.ttl
+        fresh = set()
+        for folder in folders:
+            row = self._db.execute(
+                "SELECT refreshed FROM prefixes WHERE bucket = ? AND prefix = ?",
+                (self.gcs_bucket_name, folder),
+            ).fetchone()
+            if row is not None and row[0] > expires:
+                fresh.add(folder)
+
+        return sorted(folders - fresh)
+
+    def refresh(self, gcs_bucket_path: str, force: bool = False) -> int:
+        """Bring the index of a bucket path up to date.
+
+        Listing pages are written to the index as they arrive, so the listing
+        of a large path is never held in memory.
+
+        Args:
+          gcs_bucket_path (str): the storage path in the bucket
+          force (bool): when True, relist every folder, even those that have
+                        not expired (default False)
+
+        Returns the number of objects that were listed
+        """
+        bucket = gcs.get_storage_bucket(
+            self.gcp_project_name, self.gcs_bucket_name, self.max_workers
+        )
+        prefix = as_folder(gcs_bucket_path)
+        with self._lock:
+            count, folders = self._refresh_level(bucket, prefix)
+            with self._db:
+                for folder in set(self._folders(prefix)) - folders:
+                    self._delete_below(folder)
+            if not force:
+                folders = self._expired_folders(folders)
+            for folder in sorted(folders):
+                count += self._refresh_folder(bucket, folder)
+
+        return count
+
+    def _folders(self, prefix: str) -> List[str]:
+        low, high = _prefix_range(prefix)
+        start = len(prefix) + 1
+        rows = self._db.execute(
+            "SELECT DISTINCT substr(name, ?, instr(substr(name, ?), '/'))"
+            " FROM objects WHERE bucket = ? AND name >= ? AND name < ?"
+            " AND instr(substr(name, ?), '/') > 0 ORDER BY 1",
+            (start, start, self.gcs_bucket_name, low, high, start),
+        )
+        return [prefix + row[0] for row in rows]
+
+    def _select(self, where: str, parameters: tuple) -> List[ObjectInfo]:
+        rows = self._db.execute(
+            "SELECT name, size, crc32c, generation, updated FROM objects"
+            " WHERE bucket = ? AND " + where + " ORDER BY name",
+            (self.gcs_bucket_name,) + parameters,
+        )
+        return [ObjectInfo(*row) for row in rows]
+
+    def contents(self, gcs_bucket_path: str, recurse: bool = False) -> List[ObjectInfo]:
+        """List the indexed objects in a bucket path.
+
+        Args:
+          gcs_bucket_path (str): the storage path in the bucket
+          recurse (bool): when True, include the contents of all subfolders
+                          (default False)
+
+        Returns a list of gcsutils.listing.ObjectInfo, in name order
+        """
+        prefix = as_folder(gcs_bucket_path)
+        where = "name >= ? AND name < ?"
+        parameters: tuple = _prefix_range(prefix)
+        if not recurse:
+            where += " AND instr(substr(name, ?), '/') = 0"
+            parameters += (len(prefix) + 1,)
+        with self._lock:
+            return self._select(where, parameters)
+
+    def folders(self, gcs_bucket_path: str) -> List[str]:
+        """List the indexed 'folders' directly in a bucket path.
+
+        Args:
+          gcs_bucket_path (str): the storage path in the bucket
+
+        Returns a list of folder names relative to gcs_bucket_path, as returned
+        by gcsutils.gcs.list_bucket_folders
+        """
+        prefix = as_folder(gcs_bucket_path)
+        start = len(prefix)
+        with self._lock:
+            return [folder[start:-1] for folder in self._folders(prefix)]
+
+    def glob(self, pattern: str) -> List[ObjectInfo]:
+        """List the indexed objects whose names match a glob pattern.
+
+        Only the names that start with the part of the pattern before its
+        first wildcard are scanned. See gcsutils.glob.GlobPattern for the
+        syntax.
+
+        Args:
+          pattern (str): the pattern, eg/ "surveys/2020-*/**/*.tif"
+
+        Returns a list of gcsutils.listing.ObjectInfo, in name order
+        """
+        glob_pattern = GlobPattern(pattern)
+        parameters = _prefix_range(glob_pattern.literal_prefix)
+        with self._lock:
+            objects = self._select("name >= ? AND name < ?", parameters)
+
+        return [o for o in objects if glob_pattern.match(o.name)]
@@ -0,0 +1,143 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import contextlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from gcsutils.manifest import crc32c_of_file
+
+
+class TransferJournal:
+    """An append-only record of the completed items of a transfer job.
+
+    Each completed transfer appends one line holding the local path, the
+    object name, the size and the CRC32C checksum of the object, and the
+    modification time of the local file. When a job is restarted with the
+    same journal, an item is skipped if it is in the journal and its local
+    file still has the recorded size and modification time; this costs one
+    dictionary lookup and one stat per item, and no hashing. A file of the
+    same size whose modification time changed is hashed, and skipped only if
+    it still has the recorded checksum. Items that failed or were still in
+    flight when the job stopped were never recorded, so they are transferred
+    again.
+
+    Lines are flushed to the operating system as they are written, so a
+    killed process loses nothing; a line torn by a crash of the whole machine
+    is ignored when the journal is read. The journal is safe to update from
+    multiple threads.
+
+    Args:
+      path (str): the path of the journal file; it is created if missing
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # (local path, object name) -> (size, crc32c, mtime_ns)
+        self._completed: Dict[
+            Tuple[str, str], Tuple[int, Optional[str], Optional[int]]
+        ] = {}
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, "a")
+        if self._file.tell() and not self._ends_with_newline():
+            # Start after a line that was torn by a crash
+            self._file.write("\n")
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    local_path, object_name, size, crc32c, mtime_ns = json.loads(line)
+                except ValueError:
+                    continue
+                self._completed[(local_path, object_name)] = (size, crc32c, mtime_ns)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._completed)
+
+    def is_complete(self, local_path: str, object_name: str) -> bool:
+        """Return True if a transfer was recorded and its file is unchanged.
+
+        Args:
+          local_path (str): the path of the local file that was read or written
+          object_name (str): the name of the object that was written or read
+        """
+        entry = self._completed.get((local_path, object_name))
+        if entry is None:
+            return False
+        size, crc32c, mtime_ns = entry
+        try:
+            stat = os.stat(local_path)
+            if stat.st_size != size:
+                return False
+            if stat.st_mtime_ns == mtime_ns:
+                return True
+            return crc32c is not None and crc32c_of_file(local_path) == crc32c
+        except OSError:
+            return False
+
+    def record(
+        self,
+        local_path: str,
+        object_name: str,
+        size: int,
+        crc32c: Optional[str],
+        mtime_ns: Optional[int] = None,
+    ) -> None:
+        """Record a completed transfer.
+
+        Args:
+          local_path (str): the path of the local file that was read or written
+          object_name (str): the name of the object that was written or read
+          size (int): the size of the object, in bytes
+          crc32c (str): the base64-encoded CRC32C checksum of the object
+          mtime_ns (int): optional; the modification time of the local file
+                          when it was transferred, in nanoseconds (default
+                          its modification time now)
+        """
+        if mtime_ns is None:
+            with contextlib.suppress(OSError):
+                mtime_ns = os.stat(local_path).st_mtime_ns
+        line = json.dumps(
+            [local_path, object_name, size, crc32c, mtime_ns], separators=(",", ":")
+        )
+        with self._lock:
+            self._completed[(local_path, object_name)] = (size, crc32c, mtime_ns)
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        """Flush the journal to disk and close it."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
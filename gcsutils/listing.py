@@ -0,0 +1,220 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import concurrent.futures
+import queue
+import threading
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from google.cloud import storage
+
+from gcsutils import metrics
+from gcsutils.retry import DEFAULT_RETRY, RetryPolicy
+
+OBJECT_FIELDS = ("name", "size", "crc32c", "generation", "updated")
+# Folders are split into further shards until there are this many per worker
+_SHARDS_PER_WORKER = 4
+_DONE = object()
+
+
+class ObjectInfo(NamedTuple):
+    """The listed metadata of an object.
+
+    A compact stand-in for google.cloud.storage.blob.Blob. Fields that were not
+    requested from the listing are None.
+    """
+
+    name: str
+    size: Optional[int] = None
+    crc32c: Optional[str] = None
+    generation: Optional[int] = None
+    updated: Optional[str] = None
+
+
+def _item_to_object_info(iterator, item: dict) -> ObjectInfo:
+    size = item.get("size")
+    generation = item.get("generation")
+    return ObjectInfo(
+        item["name"],
+        int(size) if size is not None else None,
+        item.get("crc32c"),
+        int(generation) if generation is not None else None,
+        item.get("updated"),
+    )
+
+
+def _fields_parameter(fields: Iterable[str]) -> str:
+    unknown = set(fields) - set(OBJECT_FIELDS)
+    if unknown:
+        raise ValueError("Unknown object fields: {}".format(sorted(unknown)))
+    # The name is always needed, and the prefixes are needed to split shards
+    fields = [f for f in OBJECT_FIELDS if f == "name" or f in fields]
+    return "items({}),prefixes,nextPageToken".format(",".join(fields))
+
+
+def as_folder(path: str) -> str:
+    """Return a bucket path with a trailing "/", unless it is the bucket root."""
+    if path and not path.endswith("/"):
+        path = path + "/"
+    return path
+
+
+def list_pages(
+    bucket: storage.bucket.Bucket,
+    prefix: str,
+    delimiter: Optional[str],
+    fields: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Iterator[Tuple[List[ObjectInfo], Sequence[str]]]:
+    """List a prefix one page at a time.
+
+    Page items are turned straight into ObjectInfo records, so no Blob is
+    built.
+
+    Args:
+      bucket (google.cloud.storage.bucket.Bucket): the bucket to list
+      prefix (str): the prefix of the names to list
+      delimiter (str): optional; the delimiter that folds names into prefixes
+      fields (str): the fields parameter of the request
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Yields the objects and the delimiter prefixes of each page
+    """
+    blobs = bucket.list_blobs(
+        prefix=prefix, delimiter=delimiter, fields=fields, retry=retry
+    )
+    blobs.item_to_value = _item_to_object_info
+    pages = blobs.pages
+    while True:
+        with metrics.measure("list"):
+            page = next(pages, None)
+        if page is None:
+            return
+        yield list(page), getattr(page, "prefixes", ())
+
+
+class _ShardedListing:
+    """Lists the shards of a prefix concurrently into a bounded queue.
+
+    A shard is first listed with the "/" delimiter, which yields the objects
+    directly in it and its subfolders; each subfolder becomes a new shard.
+    Once there are enough shards to keep the workers busy, new shards are
+    listed without a delimiter, in full.
+    """
+
+    def __init__(
+        self,
+        bucket: storage.bucket.Bucket,
+        fields: str,
+        max_workers: int,
+        retry: RetryPolicy,
+    ):
+        self.bucket = bucket
+        self.fields = fields
+        self.retry = retry
+        self.results: queue.Queue = queue.Queue(maxsize=max_workers * 2)
+        self.cancelled = threading.Event()
+        self._max_shards = max_workers * _SHARDS_PER_WORKER
+        self._shards = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    def submit(self, prefix: str) -> None:
+        """List a shard on a worker thread."""
+        with self._lock:
+            self._pending += 1
+            self._shards += 1
+            split = self._shards <= self._max_shards
+        self._executor.submit(self._run, prefix, split)
+
+    def put(self, item) -> None:
+        """Hand an item to the consumer, unless the listing was cancelled."""
+        while not self.cancelled.is_set():
+            try:
+                self.results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def close(self) -> None:
+        """Stop listing and wait for the workers to finish."""
+        self.cancelled.set()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, prefix: str, split: bool) -> None:
+        try:
+            self._list(prefix, split)
+        except Exception as e:
+            self.put(e)
+        # Subfolders are submitted before their parent shard is finished, so
+        # nothing is pending only once every shard is done
+        with self._lock:
+            self._pending -= 1
+            done = self._pending == 0
+        if done:
+            self.put(_DONE)
+
+    def _list(self, prefix: str, split: bool) -> None:
+        delimiter = "/" if split else None
+        pages = list_pages(self.bucket, prefix, delimiter, self.fields, self.retry)
+        for objects, prefixes in pages:
+            if self.cancelled.is_set():
+                return
+            if objects:
+                self.put(objects)
+            for subfolder in prefixes:
+                self.submit(subfolder)
+
+
+def list_sharded(
+    bucket: storage.bucket.Bucket,
+    prefix: str,
+    fields: Iterable[str] = OBJECT_FIELDS,
+    max_workers: int = 16,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> Iterator[ObjectInfo]:
+    """Yield every object below a prefix, listing its folders concurrently.
+
+    The objects are yielded as the pages of the shards arrive, in no
+    particular order. Stopping the iteration early cancels the listing.
+
+    Args:
+      bucket (google.cloud.storage.bucket.Bucket): the bucket to list
+      prefix (str): the prefix of the object names to list
+      fields (list): the object fields to request, out of OBJECT_FIELDS (default
+                     all); the name is always included
+      max_workers (int): the number of concurrent listing requests (default 16)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns an iterator of ObjectInfo records
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    listing = _ShardedListing(bucket, _fields_parameter(fields), max_workers, retry)
+    try:
+        listing.submit(prefix)
+        while True:
+            item = listing.results.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+    finally:
+        listing.close()
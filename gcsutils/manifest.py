@@ -0,0 +1,135 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import base64
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import google_crc32c
+
+_CHECKSUM_READ_SIZE = 1024 * 1024
+
+
+def crc32c_of_file(file_path: str) -> str:
+    """Compute the CRC32C checksum of a local file.
+
+    Args:
+      file_path (str): the full path to the file
+
+    Returns the base64-encoded checksum, in the form used by GCS object metadata
+    """
+    checksum = google_crc32c.Checksum()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHECKSUM_READ_SIZE), b""):
+            checksum.update(chunk)
+
+    return base64.b64encode(checksum.digest()).decode("utf-8")
+
+
+class HashManifest:
+    """A local record of file checksums and the object generations they match.
+
+    Entries are keyed by a path relative to the synced directory and remember
+    the size and modification time of the file when it was hashed, so a file
+    is only re-hashed after it changes. The manifest is safe to update from
+    multiple threads, and is written atomically by `save`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # key -> [size, mtime_ns, crc32c, generation]
+        self._entries: Dict[str, List] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save()
+
+    def _current_entry(self, key: str, file_path: str) -> Optional[List]:
+        stat = os.stat(file_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry
+        return None
+
+    def crc32c(self, key: str, file_path: str) -> str:
+        """Get the CRC32C checksum of a file, hashing it only if it changed.
+
+        Args:
+          key (str): the manifest key of the file
+          file_path (str): the full path to the file
+
+        Returns the base64-encoded checksum
+        """
+        entry = self._current_entry(key, file_path)
+        if entry:
+            return entry[2]
+        crc32c = crc32c_of_file(file_path)
+        self.record(key, file_path, crc32c)
+
+        return crc32c
+
+    def generation(self, key: str, file_path: str) -> Optional[int]:
+        """Get the object generation a file was last synced with.
+
+        Args:
+          key (str): the manifest key of the file
+          file_path (str): the full path to the file
+
+        Returns the generation, or None if unknown or the file has changed since
+        """
+        entry = self._current_entry(key, file_path)
+        return entry[3] if entry else None
+
+    def record(
+        self,
+        key: str,
+        file_path: str,
+        crc32c: str,
+        generation: Optional[int] = None,
+    ) -> None:
+        """Record the checksum, and optionally the object generation, of a file.
+
+        Args:
+          key (str): the manifest key of the file
+          file_path (str): the full path to the file, in its current state
+          crc32c (str): the base64-encoded CRC32C checksum of the file
+          generation (int): optional; the generation of the matching object
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            self._entries[key] = [stat.st_size, stat.st_mtime_ns, crc32c, generation]
+
+    def discard(self, key: str) -> None:
+        """Forget a file."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def save(self) -> None:
+        """Write the manifest to disk atomically."""
+        temp_path = "{}.tmp-{}".format(self.path, os.getpid())
+        with self._lock:
+            with open(temp_path, "w") as f:
+                json.dump(self._entries, f, separators=(",", ":"))
+        os.replace(temp_path, self.path)
@@ -0,0 +1,236 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, Optional, TypeVar
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover - prometheus_client is optional
+    prometheus_client = None
+
+# The kinds of measurement
+OPERATION = "operation"
+QUEUE_WAIT = "queue_wait"
+CLIENT_CREATION = "client_creation"
+
+Listener = Callable[["Measurement"], None]
+F = TypeVar("F", bound=Callable[..., Any])
+
+_listeners: List[Listener] = []
+_listeners_lock = threading.Lock()
+_current: "contextvars.ContextVar[Optional[Measurement]]" = contextvars.ContextVar(
+    "gcsutils_measurement", default=None
+)
+
+
+@dataclass
+class Measurement:
+    """A measurement reported to metrics listeners.
+
+    Operations are single objects transferred, copied or deleted, single
+    listing pages, and batches of deletes; `operation` names the kind (eg/
+    "upload", "download", "copy", "delete", "list"). `seconds` is the duration
+    of the operation including its retries, the time a transfer waited for a
+    worker (QUEUE_WAIT), or the time taken to create a client
+    (CLIENT_CREATION).
+
+    Attributes:
+      kind (str): OPERATION, QUEUE_WAIT or CLIENT_CREATION
+      seconds (float): the measured duration
+      operation (str): the name of the operation, for OPERATION measurements
+      bytes_transferred (int): the number of bytes uploaded or downloaded
+      retries (int): the number of times the operation was retried
+      error (Exception): the error the operation failed with, or None
+    """
+
+    kind: str
+    seconds: float
+    operation: Optional[str] = None
+    bytes_transferred: int = 0
+    retries: int = 0
+    error: Optional[BaseException] = None
+
+    @property
+    def throughput(self) -> float:
+        """The transfer rate of the operation, in bytes per second."""
+        if not self.seconds:
+            return 0.0
+        return self.bytes_transferred / self.seconds
+
+
+def add_listener(listener: Listener) -> None:
+    """Register a callable to be called with every Measurement.
+
+    Listeners are called on the thread, or in the event loop, that made the
+    measurement, so they should be quick and thread-safe. An exception raised
+    by a listener is logged and otherwise ignored.
+    """
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: Listener) -> None:
+    """Unregister a listener added with `add_listener`."""
+    with _listeners_lock:
+        _listeners.remove(listener)
+
+
+def emit(measurement: Measurement) -> None:
+    """Report a measurement to every registered listener."""
+    for listener in list(_listeners):
+        try:
+            listener(measurement)
+        except Exception:
+            logging.exception("Metrics listener %r failed", listener)
+
+
+def record(kind: str, seconds: float) -> None:
+    """Report a QUEUE_WAIT or CLIENT_CREATION measurement."""
+    if _listeners:
+        emit(Measurement(kind, seconds))
+
+
+@contextlib.contextmanager
+def measure(operation: str) -> Iterator[Measurement]:
+    """Measure the operation run in the body of the `with` statement.
+
+    The body may set `bytes_transferred` on the yielded Measurement. Retries
+    made by a gcsutils.retry.RetryPolicy within the body are counted. The
+    measurement is reported when the body exits, with any error it raised.
+    """
+    measurement = Measurement(OPERATION, 0.0, operation)
+    token = _current.set(measurement)
+    start = time.monotonic()
+    try:
+        yield measurement
+    except BaseException as e:
+        measurement.error = e
+        raise
+    finally:
+        measurement.seconds = time.monotonic() - start
+        _current.reset(token)
+        if _listeners:
+            emit(measurement)
+
+
+def measured(operation: str) -> Callable[[F], F]:
+    """Decorate a function so that each call is measured as `operation`.
+
+    When the function returns an int, it is taken to be the number of bytes
+    transferred.
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(operation) as measurement:
+                result = func(*args, **kwargs)
+                if isinstance(result, int):
+                    measurement.bytes_transferred = result
+                return result
+
+        return wrapper
+
+    return decorate
+
+
+def count_retry() -> None:
+    """Count a retry against the operation being measured, if any."""
+    measurement = _current.get()
+    if measurement is not None:
+        measurement.retries += 1
+
+
+class PrometheusExporter:
+    """A listener that exports measurements as Prometheus metrics.
+
+    The metrics are, with the default namespace:
+      gcsutils_operation_seconds: a histogram of operation durations, by
+                                  operation and outcome ("ok" or "error")
+      gcsutils_transferred_bytes_total: bytes uploaded or downloaded, by
+                                        operation
+      gcsutils_retries_total: retries, by operation
+      gcsutils_queue_wait_seconds: a histogram of the time transfers waited
+                                   for a worker
+      gcsutils_client_creation_seconds: a histogram of client creation times
+
+    Register the exporter with `add_listener`. Requires prometheus_client.
+
+    Args:
+      registry (prometheus_client.CollectorRegistry): optional; the registry
+                                                      to add the metrics to
+                                                      (default the global one)
+      namespace (str): the prefix of the metric names (default "gcsutils")
+      buckets (sequence): optional; the upper bounds of the histogram buckets,
+                          in seconds
+    """
+
+    def __init__(self, registry=None, namespace: str = "gcsutils", buckets=None):
+        if prometheus_client is None:
+            raise ImportError("PrometheusExporter requires prometheus_client")
+        options = {"namespace": namespace}
+        if registry is not None:
+            options["registry"] = registry
+        histogram_options = dict(options)
+        if buckets is not None:
+            histogram_options["buckets"] = buckets
+        self.operation_seconds = prometheus_client.Histogram(
+            "operation_seconds",
+            "The duration of GCS operations, including retries",
+            ["operation", "outcome"],
+            **histogram_options,
+        )
+        self.transferred_bytes = prometheus_client.Counter(
+            "transferred_bytes",
+            "The bytes uploaded to or downloaded from GCS",
+            ["operation"],
+            **options,
+        )
+        self.retries = prometheus_client.Counter(
+            "retries", "The retries of failed GCS requests", ["operation"], **options
+        )
+        self.queue_wait_seconds = prometheus_client.Histogram(
+            "queue_wait_seconds",
+            "The time transfers waited for a worker",
+            **histogram_options,
+        )
+        self.client_creation_seconds = prometheus_client.Histogram(
+            "client_creation_seconds",
+            "The time taken to create a GCS client",
+            **histogram_options,
+        )
+
+    def __call__(self, measurement: Measurement) -> None:
+        """Update the metrics from a measurement."""
+        if measurement.kind == QUEUE_WAIT:
+            self.queue_wait_seconds.observe(measurement.seconds)
+        elif measurement.kind == CLIENT_CREATION:
+            self.client_creation_seconds.observe(measurement.seconds)
+        else:
+            name = measurement.operation
+            outcome = "ok" if measurement.error is None else "error"
+            self.operation_seconds.labels(name, outcome).observe(measurement.seconds)
+            if measurement.bytes_transferred:
+                self.transferred_bytes.labels(name).inc(measurement.bytes_transferred)
+            if measurement.retries:
+                self.retries.labels(name).inc(measurement.retries)
@@ -0,0 +1,299 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+import functools
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import google.auth.exceptions
+import requests
+import urllib3
+from google.api_core import exceptions
+from google.resumable_media import InvalidResponse
+
+from gcsutils import metrics
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - aiohttp is an optional dependency
+    aiohttp = None
+
+T = TypeVar("T")
+
+# Request timeouts, throttling, and server errors
+RETRYABLE_STATUS_CODES = frozenset([408, 429, 500, 502, 503, 504])
+
+_CONNECTION_ERRORS = (
+    ConnectionError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+    urllib3.exceptions.ProtocolError,
+    google.auth.exceptions.TransportError,
+)
+if aiohttp is not None:
+    _CONNECTION_ERRORS += (
+        aiohttp.ClientConnectionError,
+        aiohttp.ClientPayloadError,
+        asyncio.TimeoutError,
+    )
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Return True for errors that a repeated request may not hit again.
+
+    These are HTTP 408, 429 and 5xx responses, and dropped, reset or timed out
+    connections.
+    """
+    if isinstance(error, exceptions.GoogleAPICallError):
+        return error.code in RETRYABLE_STATUS_CODES
+    if isinstance(error, InvalidResponse):
+        return getattr(error.response, "status_code", None) in RETRYABLE_STATUS_CODES
+    return isinstance(error, _CONNECTION_ERRORS)
+
+
+class RetryBudget:
+    """Limits the retries made by a process to a fraction of its requests.
+
+    Every operation deposits `ratio` tokens, and every retry withdraws one, so
+    when most requests fail the retries stop instead of multiplying the load
+    on an overloaded service. So that a process making few requests can still
+    retry, `min_retries_per_second` tokens also accrue over time. At most
+    `max_tokens` tokens are kept. The budget is safe to share between threads.
+
+    Args:
+      ratio (float): the retries allowed per operation (default 0.1)
+      min_retries_per_second (float): the retries always allowed per second
+                                      (default 10)
+      max_tokens (float): the largest burst of retries (default 100)
+    """
+
+    def __init__(
+        self,
+        ratio: float = 0.1,
+        min_retries_per_second: float = 10.0,
+        max_tokens: float = 100.0,
+    ):
+        self.ratio = ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _add(self, tokens: float) -> None:
+        now = time.monotonic()
+        tokens += (now - self._updated) * self.min_retries_per_second
+        self._tokens = min(self.max_tokens, self._tokens + tokens)
+        self._updated = now
+
+    def deposit(self) -> None:
+        """Record an operation, which earns `ratio` retries."""
+        with self._lock:
+            self._add(self.ratio)
+
+    def withdraw(self) -> bool:
+        """Spend one retry; returns False if the budget is exhausted."""
+        with self._lock:
+            self._add(0.0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+# The retries of every policy without a budget of its own come out of this one
+PROCESS_RETRY_BUDGET = RetryBudget()
+
+
+class RetryPolicy:
+    """Retries failed operations with full-jitter exponential backoff.
+
+    Before retry number n, the policy sleeps for a random time between zero
+    and min(max_delay, initial_delay * multiplier ** (n - 1)) seconds, so
+    clients that failed together do not retry together. An operation is
+    retried while `retryable(error)` is true, until `max_attempts` attempts
+    have been made, the `deadline` would be passed, or the retry budget is
+    exhausted.
+
+    Operations that move object data, such as whole-file uploads and
+    downloads, can fail after running for longer than `deadline`, so they
+    are limited by `transfer_deadline` instead, which by default allows
+    retries for as long as attempts remain.
+
+    Only idempotent operations are retried, unless `retry_non_idempotent` is
+    set. gcsutils makes its writes idempotent with generation preconditions,
+    so that a retry can not overwrite a change made since the first attempt.
+
+    A policy can be passed as the `retry` argument of every gcsutils function,
+    and of google-cloud-storage methods that make a single JSON API request.
+
+    Args:
+      max_attempts (int): the maximum number of attempts, including the first
+                          (default 5; 1 disables retries)
+      initial_delay (float): the backoff cap before the first retry, in
+                             seconds (default 1)
+      max_delay (float): the largest backoff cap, in seconds (default 32)
+      multiplier (float): the growth of the backoff cap per retry (default 2)
+      deadline (float): optional; the time after which no retry is started,
+                        in seconds from the first attempt (default 120)
+      budget (RetryBudget): optional; the budget retries are taken from
+                            (default PROCESS_RETRY_BUDGET)
+      retryable (callable): decides whether an error is worth retrying
+                            (default is_retryable)
+      retry_non_idempotent (bool): when True, also retry operations that are
+                                   not idempotent (default False)
+      transfer_deadline (float): optional; the deadline of data transfers, in
+                                 seconds from the first attempt (default
+                                 None, no deadline)
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        initial_delay: float = 1.0,
+        max_delay: float = 32.0,
+        multiplier: float = 2.0,
+        deadline: Optional[float] = 120.0,
+        budget: Optional[RetryBudget] = None,
+        retryable: Callable[[BaseException], bool] = is_retryable,
+        retry_non_idempotent: bool = False,
+        transfer_deadline: Optional[float] = None,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.deadline = deadline
+        self.budget = budget or PROCESS_RETRY_BUDGET
+        self.retryable = retryable
+        self.retry_non_idempotent = retry_non_idempotent
+        self.transfer_deadline = transfer_deadline
+
+    def backoff(self, retry_number: int) -> float:
+        """Return a random delay, in seconds, to wait before a retry."""
+        cap = self.initial_delay * self.multiplier ** (retry_number - 1)
+        return random.uniform(0, min(self.max_delay, cap))
+
+    def _delay(
+        self,
+        error: Exception,
+        attempt: int,
+        started: float,
+        idempotent: bool,
+        deadline: Optional[float],
+    ) -> Optional[float]:
+        # Returns the time to wait before the next attempt, or None to give up
+        if attempt >= self.max_attempts or not self.retryable(error):
+            return None
+        if not (idempotent or self.retry_non_idempotent):
+            return None
+        delay = self.backoff(attempt)
+        if deadline is not None and time.monotonic() + delay - started > deadline:
+            return None
+        if not self.budget.withdraw():
+            logging.warning("Retry budget exhausted; not retrying %r", error)
+            return None
+        metrics.count_retry()
+        logging.warning(
+            "Retrying in %.2fs (attempt %d of %d) after %r",
+            delay,
+            attempt + 1,
+            self.max_attempts,
+            error,
+        )
+        return delay
+
+    def run(
+        self,
+        operation: Callable[[], T],
+        idempotent: bool = True,
+        transfer: bool = False,
+    ) -> T:
+        """Call `operation` until it succeeds or the policy gives up.
+
+        Args:
+          operation (callable): called with no arguments
+          idempotent (bool): whether the operation is safe to repeat
+                             (default True)
+          transfer (bool): whether the operation moves object data, and is
+                           limited by `transfer_deadline` rather than
+                           `deadline` (default False)
+
+        Returns the result of the operation; the last error is raised if the
+        policy gives up
+        """
+        self.budget.deposit()
+        deadline = self.transfer_deadline if transfer else self.deadline
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                return operation()
+            except Exception as e:
+                delay = self._delay(e, attempt, started, idempotent, deadline)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def run_async(
+        self,
+        operation: Callable[[], Awaitable[T]],
+        idempotent: bool = True,
+        transfer: bool = False,
+    ) -> T:
+        """Await `operation()` until it succeeds or the policy gives up.
+
+        The asyncio counterpart of `run`; the event loop is not blocked while
+        waiting to retry.
+        """
+        self.budget.deposit()
+        deadline = self.transfer_deadline if transfer else self.deadline
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                return await operation()
+            except Exception as e:
+                delay = self._delay(e, attempt, started, idempotent, deadline)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def __call__(self, func: Callable[..., T]) -> Callable[..., T]:
+        """Wrap a function so that calls to it are retried by this policy.
+
+        This is the protocol of google.api_core.retry.Retry, which lets the
+        policy be passed to google-cloud-storage methods.
+        """
+
+        @functools.wraps(func)
+        def retried(*args, **kwargs):
+            return self.run(functools.partial(func, *args, **kwargs))
+
+        return retried
+
+
+DEFAULT_RETRY = RetryPolicy()
+NO_RETRY = RetryPolicy(max_attempts=1)
@@ -0,0 +1,402 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from collections import Counter
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+# Priority classes; a lower value is served first
+INTERACTIVE = 0
+BULK = 10
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "gcsutils_priority", default=INTERACTIVE
+)
+_scheduler: Optional["TransferScheduler"] = None
+
+
+class TokenBucket:
+    """Limits a transfer rate to `rate` bytes per second.
+
+    Up to `burst` bytes may be transferred at once after a quiet period. A
+    transfer may borrow tokens: a bulk transfer then waits until the whole
+    debt has been repaid, but a transfer of a higher priority only waits for
+    its own bytes, so it is not queued behind the bulk transfers. The bulk
+    transfers that follow make up for what it borrowed. The bucket is safe to
+    share between threads.
+
+    Args:
+      rate (float): the sustained rate, in bytes per second
+      burst (float): optional; the largest burst, in bytes (default one
+                     second at `rate`)
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int, priority: int = BULK) -> float:
+        """Take tokens for `nbytes` bytes, sleeping until the rate allows them.
+
+        Args:
+          nbytes (int): the number of bytes about to be transferred
+          priority (int): the priority class of the transfer (default BULK)
+
+        Returns the number of seconds slept
+        """
+        delay = self.reserve(nbytes, priority)
+        if delay:
+            time.sleep(delay)
+
+        return delay
+
+    async def consume_async(self, nbytes: int, priority: int = BULK) -> float:
+        """Take tokens for `nbytes` bytes, as `consume`, without blocking the loop."""
+        delay = self.reserve(nbytes, priority)
+        if delay:
+            await asyncio.sleep(delay)
+
+        return delay
+
+    def reserve(self, nbytes: int, priority: int = BULK) -> float:
+        """Take tokens for `nbytes` bytes without waiting.
+
+        Returns the number of seconds to wait before transferring them
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if priority < BULK:
+                shortfall = nbytes - max(self._tokens, 0.0)
+            else:
+                shortfall = nbytes - self._tokens
+            self._tokens -= nbytes
+
+        return max(shortfall, 0.0) / self.rate
+
+
+class MemoryBudget:
+    """Caps the bytes held in transfer buffers at once.
+
+    A transfer reserves the size of its buffers before it starts, and waits
+    while the reservation would exceed `max_bytes`; a transfer that is larger
+    than the whole budget is let through once nothing else is in flight.
+    Waiting transfers of a higher priority are let through first. The budget
+    is safe to share between threads and event loops.
+
+    Args:
+      max_bytes (int): the number of bytes that may be reserved at once
+    """
+
+    def __init__(self, max_bytes: int):
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._waiting: Counter = Counter()
+        self._condition = threading.Condition()
+        self._wakeups: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _admits(self, nbytes: int, priority: int) -> bool:
+        if any(p < priority for p, n in self._waiting.items() if n):
+            return False
+        return self.in_flight == 0 or self.in_flight + nbytes <= self.max_bytes
+
+    def acquire(self, nbytes: int, priority: int = BULK) -> None:
+        """Reserve `nbytes`, waiting until they fit in the budget."""
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                self._condition.wait_for(lambda: self._admits(nbytes, priority))
+            finally:
+                self._waiting[priority] -= 1
+            self.in_flight += nbytes
+            # Lower priority waiters may have been held back by this one
+            self._notify()
+
+    def try_acquire(self, nbytes: int, priority: int = BULK) -> bool:
+        """Reserve `nbytes` if they fit in the budget now; return True if so."""
+        with self._condition:
+            if not self._admits(nbytes, priority):
+                return False
+            self.in_flight += nbytes
+            return True
+
+    async def acquire_async(self, nbytes: int, priority: int = BULK) -> None:
+        """Reserve `nbytes`, as `acquire`, without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            self._waiting[priority] += 1
+        try:
+            while True:
+                with self._condition:
+                    if self._admits(nbytes, priority):
+                        self.in_flight += nbytes
+                        return
+                    wakeup = loop.create_future()
+                    self._wakeups.append((loop, wakeup))
+                await wakeup
+        finally:
+            with self._condition:
+                self._waiting[priority] -= 1
+                self._notify()
+
+    def release(self, nbytes: int) -> None:
+        """Return a reservation made by `acquire` or `acquire_async`."""
+        with self._condition:
+            self.in_flight -= nbytes
+            self._notify()
+
+    def _notify(self) -> None:
+        # Wake every waiting thread and coroutine to check the budget again
+        self._condition.notify_all()
+        for loop, wakeup in self._wakeups:
+            loop.call_soon_threadsafe(_wake, wakeup)
+        self._wakeups.clear()
+
+
+def _wake(wakeup: asyncio.Future) -> None:
+    if not wakeup.done():
+        wakeup.set_result(None)
+
+
+def _release_nothing() -> None:
+    pass
+
+
+class TransferScheduler:
+    """Shares the bandwidth and buffer memory of a process between transfers.
+
+    Install a scheduler with `set_scheduler` to apply it to every upload and
+    download that gcsutils makes in the process, from threads and from
+    gcsutils.aio alike. Transfers run by the batch functions (upload_files,
+    download_files, sync_to_bucket, ...) are of BULK priority; everything
+    else, such as download_file and the stream readers and writers, is
+    INTERACTIVE, so single-file reads are served ahead of batch jobs. Use
+    `priority` to change the class of the transfers made in a block of code.
+
+    Args:
+      upload_rate (float): optional; the total upload rate, in bytes per
+                           second (default None, unlimited)
+      download_rate (float): optional; the total download rate, in bytes per
+                             second (default None, unlimited)
+      max_in_flight_bytes (int): optional; the total size of the buffers of
+                                 the transfers in flight (default None,
+                                 unlimited)
+      burst (float): optional; the largest burst of either direction, in bytes
+                     (default one second at its rate)
+    """
+
+    def __init__(
+        self,
+        upload_rate: Optional[float] = None,
+        download_rate: Optional[float] = None,
+        max_in_flight_bytes: Optional[int] = None,
+        burst: Optional[float] = None,
+    ):
+        self.buckets: Dict[str, Optional[TokenBucket]] = {
+            UPLOAD: TokenBucket(upload_rate, burst) if upload_rate else None,
+            DOWNLOAD: TokenBucket(download_rate, burst) if download_rate else None,
+        }
+        self.memory = MemoryBudget(max_in_flight_bytes) if max_in_flight_bytes else None
+
+    @contextlib.contextmanager
+    def transfer(
+        self, direction: str, buffer_bytes: int = 0
+    ) -> Iterator[Optional[Callable[[int], float]]]:
+        """Admit a transfer, reserving its buffers for the duration of the block.
+
+        Args:
+          direction (str): UPLOAD or DOWNLOAD
+          buffer_bytes (int): the size of the buffers the transfer holds
+
+        Yields a function to call with the size of each block of data before
+        it is sent or after it is received, which sleeps to keep to the
+        bandwidth cap; or None if the direction is not limited
+        """
+        priority = _priority.get()
+        bucket = self.buckets[direction]
+        release = self.reserve(buffer_bytes)
+        try:
+            if bucket is None:
+                yield None
+            else:
+                yield lambda nbytes: bucket.consume(nbytes, priority)
+        finally:
+            release()
+
+    def reserve(
+        self, buffer_bytes: int, wait: bool = True
+    ) -> Optional[Callable[[], None]]:
+        """Reserve buffers that outlive a transfer block, such as read-ahead.
+
+        Args:
+          buffer_bytes (int): the size of the buffers
+          wait (bool): whether to wait for room in the budget (default True)
+
+        Returns a function to call once the buffers are freed, or None if
+        `wait` is False and the buffers do not fit in the budget now
+        """
+        memory = self.memory
+        if memory is None or not buffer_bytes:
+            return _release_nothing
+        priority = _priority.get()
+        if wait:
+            memory.acquire(buffer_bytes, priority)
+        elif not memory.try_acquire(buffer_bytes, priority):
+            return None
+
+        return functools.partial(memory.release, buffer_bytes)
+
+    @contextlib.asynccontextmanager
+    async def transfer_async(
+        self, direction: str, buffer_bytes: int = 0
+    ) -> AsyncIterator[Optional[Callable[[int], Awaitable[float]]]]:
+        """Admit a transfer, as `transfer`, without blocking the event loop.
+
+        Yields a coroutine function to await with the size of each block of
+        data, or None if the direction is not limited
+        """
+        priority = _priority.get()
+        bucket = self.buckets[direction]
+        memory = self.memory if buffer_bytes else None
+        if memory is not None:
+            await memory.acquire_async(buffer_bytes, priority)
+        try:
+            if bucket is None:
+                yield None
+            else:
+                yield functools.partial(bucket.consume_async, priority=priority)
+        finally:
+            if memory is not None:
+                memory.release(buffer_bytes)
+
+
+def set_scheduler(scheduler: Optional[TransferScheduler]) -> None:
+    """Install the scheduler of the process, or remove it with None."""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def get_scheduler() -> Optional[TransferScheduler]:
+    """Return the scheduler of the process, or None if none is installed."""
+    return _scheduler
+
+
+def get_priority() -> int:
+    """Return the priority class of the transfers made by the caller."""
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Run the transfers made in a block at a priority class.
+
+    The class applies to the current thread or asyncio task.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def inherit(func: Callable[..., T]) -> Callable[..., T]:
+    """Wrap a function to run at the priority class of the caller.
+
+    A priority class does not carry over to other threads, so wrap the
+    functions given to a thread pool with this.
+    """
+    level = _priority.get()
+
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        with priority(level):
+            return func(*args, **kwargs)
+
+    return wrapped
+
+
+@contextlib.contextmanager
+def transfer(
+    direction: str, buffer_bytes: int = 0
+) -> Iterator[Optional[Callable[[int], float]]]:
+    """Admit a transfer through the installed scheduler, if any.
+
+    See `TransferScheduler.transfer`; without a scheduler this yields None
+    and costs nothing.
+    """
+    scheduler = _scheduler
+    if scheduler is None:
+        yield None
+    else:
+        with scheduler.transfer(direction, buffer_bytes) as meter:
+            yield meter
+
+
+def reserve(buffer_bytes: int, wait: bool = True) -> Optional[Callable[[], None]]:
+    """Reserve buffers through the installed scheduler, if any.
+
+    See `TransferScheduler.reserve`; without a scheduler nothing is reserved.
+    """
+    scheduler = _scheduler
+    if scheduler is None:
+        return _release_nothing
+    return scheduler.reserve(buffer_bytes, wait)
+
+
+@contextlib.asynccontextmanager
+async def transfer_async(
+    direction: str, buffer_bytes: int = 0
+) -> AsyncIterator[Optional[Callable[[int], Awaitable[float]]]]:
+    """Admit a transfer through the installed scheduler, if any, from asyncio.
+
+    See `TransferScheduler.transfer_async`.
+    """
+    scheduler = _scheduler
+    if scheduler is None:
+        yield None
+    else:
+        async with scheduler.transfer_async(direction, buffer_bytes) as meter:
+            yield meter
@@ -0,0 +1,519 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import concurrent.futures
+import functools
+import gzip
+import io
+import re
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+import google
+from google.cloud import storage
+
+from gcsutils import metrics, scheduler
+from gcsutils.retry import DEFAULT_RETRY, RetryPolicy
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_READ_AHEAD = 2
+# Every chunk of a resumable upload, except the last, must be a multiple of this
+UPLOAD_CHUNK_GRANULARITY = 256 * 1024
+_RESUME_INCOMPLETE = 308
+
+
+class BlobReader(io.RawIOBase):
+    """A seekable, read-only file object over one generation of an object.
+
+    The object is fetched in byte-range chunks. While a chunk is being read,
+    the next `read_ahead` chunks are fetched in the background, so parsing
+    overlaps with the network transfer. Every chunk held counts against the
+    memory budget of the installed scheduler until the reader moves past it,
+    and read-ahead stops while the budget is full. Wrap the reader in an
+    io.BufferedReader (as `gcsutils.gcs.open_blob` does) for efficient small
+    reads and readline.
+
+    Args:
+      blob (google.cloud.storage.blob.Blob): the object; its size and
+                                             generation must be loaded
+      chunk_size (int): the size of each ranged request, in bytes (default 8MiB)
+      read_ahead (int): the number of chunks to fetch ahead of the reader
+                        (default 2; 0 disables read-ahead)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+
+    def __init__(
+        self,
+        blob: storage.blob.Blob,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        read_ahead: int = DEFAULT_READ_AHEAD,
+        retry: RetryPolicy = DEFAULT_RETRY,
+    ):
+        super().__init__()
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.name = blob.name
+        self._blob = blob.bucket.blob(blob.name, generation=blob.generation)
+        self._size = blob.size
+        self._chunk_size = chunk_size
+        self._read_ahead = read_ahead
+        self._retry = retry
+        self._position = 0
+        # index -> (the fetch, the release of its memory reservation)
+        self._chunks: Dict[int, Tuple[concurrent.futures.Future, Callable]] = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max(read_ahead, 1))
+
+    def readable(self) -> bool:
+        """Return True; the reader supports reading."""
+        return True
+
+    def seekable(self) -> bool:
+        """Return True; the reader supports random access."""
+        return True
+
+    def tell(self) -> int:
+        """Return the current position in the object."""
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move to a new position in the object; return the new position."""
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self._position = offset
+        return self._position
+
+    def _length(self, index: int) -> int:
+        start = index * self._chunk_size
+        return min(start + self._chunk_size, self._size) - start
+
+    def _fetch(self, index: int) -> bytes:
+        start = index * self._chunk_size
+        end = start + self._length(index) - 1
+        # The chunk's memory is reserved by _submit, until it is discarded
+        with scheduler.transfer(scheduler.DOWNLOAD) as meter:
+            with metrics.measure("read") as measurement:
+                data = self._retry.run(
+                    functools.partial(
+                        self._blob.download_as_bytes,
+                        start=start,
+                        end=end,
+                        raw_download=True,
+                        checksum=None,
+                        retry=None,
+                    ),
+                    transfer=True,
+                )
+                measurement.bytes_transferred = len(data)
+            if meter is not None:
+                meter(len(data))
+
+        return data
+
+    def _submit(self, index: int, wait: bool) -> bool:
+        # Fetch a chunk, holding its memory in the scheduler's budget until
+        # the chunk is discarded; return False if it does not fit without
+        # waiting
+        release = scheduler.reserve(self._length(index), wait)
+        if release is None:
+            return False
+        future = self._executor.submit(scheduler.inherit(self._fetch), index)
+        self._chunks[index] = (future, release)
+        return True
+
+    def _discard(self, index: int) -> None:
+        future, release = self._chunks.pop(index)
+        future.cancel()
+        # Runs at once if the fetch is cancelled or done, else when it is
+        future.add_done_callback(lambda future: release())
+
+    def _chunk(self, index: int) -> bytes:
+        # Keep the requested chunk and the read-ahead window; cancel anything
+        # else, such as chunks fetched ahead of a backwards seek.
+        last_chunk = (self._size - 1) // self._chunk_size
+        window = range(index, min(index + self._read_ahead, last_chunk) + 1)
+        for i in list(self._chunks):
+            if i not in window:
+                self._discard(i)
+        if index not in self._chunks and not self._submit(index, wait=False):
+            # Free the read-ahead, so that it can't hold up the chunk needed
+            for i in list(self._chunks):
+                self._discard(i)
+            self._submit(index, wait=True)
+        # Read ahead only as far as the memory budget allows for now
+        for i in window:
+            if i not in self._chunks and not self._submit(i, wait=False):
+                break
+
+        return self._chunks[index][0].result()
+
+    def readinto(self, buffer) -> int:
+        """Read up to len(buffer) bytes into buffer; return the number read."""
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self._position >= self._size:
+            return 0
+        index, offset = divmod(self._position, self._chunk_size)
+        chunk = memoryview(self._chunk(index))[offset:]
+        view = memoryview(buffer).cast("B")
+        count = min(len(view), len(chunk))
+        view[:count] = chunk[:count]
+        self._position += count
+        return count
+
+    def close(self) -> None:
+        """Close the reader and cancel any outstanding read-ahead."""
+        if not self.closed:
+            for i in list(self._chunks):
+                self._discard(i)
+            self._executor.shutdown(wait=False)
+        super().close()
+
+
+class BlobWriter(io.RawIOBase):
+    """A write-only file object that streams into an object.
+
+    Data is sent through a resumable upload session, one chunk at a time, so
+    at most about one chunk is held in memory. The object is created when the
+    writer is explicitly closed; closing after an error abandons the upload
+    instead. An
+    interrupted upload can be continued by a new writer given the same
+    `session_url`: it resumes from the last offset committed by GCS, exposed
+    as `committed`, and the caller supplies the data from that offset on.
+    A failed request is retried in the same way: the writer asks GCS how much
+    data it committed, and sends the rest again.
+
+    Args:
+      blob (google.cloud.storage.blob.Blob): the object to create; its
+                                             properties are set from the
+                                             upload response on close
+      chunk_size (int): the size of each upload request, in bytes; a multiple
+                        of 256KiB (default 8MiB)
+      session_url (str): optional; the URL of an existing resumable upload
+                         session to continue (default None, start a new one)
+      content_type (str): optional; the content type of a new object
+      transport (requests.Session): optional; the authorized session used to
+                                    send the data (default: the blob's client's)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+    """
+
+    def __init__(
+        self,
+        blob: storage.blob.Blob,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        session_url: Optional[str] = None,
+        content_type: Optional[str] = None,
+        transport=None,
+        retry: RetryPolicy = DEFAULT_RETRY,
+    ):
+        super().__init__()
+        if chunk_size < 1 or chunk_size % UPLOAD_CHUNK_GRANULARITY:
+            raise ValueError(
+                "chunk_size must be a multiple of {}".format(UPLOAD_CHUNK_GRANULARITY)
+            )
+        self.blob = blob
+        self._chunk_size = chunk_size
+        self._transport = transport or blob.client._http
+        self._retry = retry
+        self._buffer = bytearray()
+        self._failed = False
+        self._finished = False
+        if session_url is None:
+            self.session_url = retry.run(
+                functools.partial(
+                    blob.create_resumable_upload_session,
+                    content_type=content_type,
+                    retry=None,
+                )
+            )
+            self.committed = 0
+        else:
+            self.session_url = session_url
+            self.committed = retry.run(self._query_committed)
+
+    def writable(self) -> bool:
+        """Return True; the writer supports writing."""
+        return True
+
+    def tell(self) -> int:
+        """Return the number of bytes written, including resumed ones."""
+        return self.committed + len(self._buffer)
+
+    def _put(self, data, content_range: str):
+        response = self._transport.put(
+            self.session_url, data=data, headers={"Content-Range": content_range}
+        )
+        if response.status_code == _RESUME_INCOMPLETE:
+            # Range is absent until at least one byte has been committed
+            match = re.match(r"bytes=0-(\d+)", response.headers.get("Range", ""))
+            self.committed = int(match.group(1)) + 1 if match else 0
+        elif 200 <= response.status_code < 300:
+            self.blob._set_properties(response.json())
+            self.committed = self.blob.size
+            self._finished = True
+        else:
+            raise google.api_core.exceptions.from_http_response(response)
+
+        return response
+
+    def _query_committed(self) -> int:
+        self._put(b"", "bytes */*")
+        return self.committed
+
+    def _put_buffered(self, length: int, total: Union[int, str]) -> None:
+        start = self.committed
+        data = bytes(memoryview(self._buffer)[:length])
+        if data:
+            end = start + len(data) - 1
+            content_range = "bytes {}-{}/{}".format(start, end, total)
+        else:
+            content_range = "bytes */{}".format(total)
+        self._put(data, content_range)
+        # GCS may commit only part of the data; the rest is sent again
+        del self._buffer[: self.committed - start]
+
+    def _send(self, length: int, total: Union[int, str] = "*") -> None:
+        # Send the next `length` buffered bytes. A failed request may still
+        # have committed some of them, so a retry first asks where to resume.
+        end = self.committed + length
+        attempts = 0
+
+        def send():
+            nonlocal attempts
+            attempts += 1
+            if attempts > 1:
+                self._put_buffered(0, "*")
+                if self._finished:
+                    return
+            self._put_buffered(end - self.committed, total)
+
+        with scheduler.transfer(scheduler.UPLOAD, length) as meter:
+            with metrics.measure("write") as measurement:
+                committed = self.committed
+                self._retry.run(send, transfer=True)
+                measurement.bytes_transferred = self.committed - committed
+            # Charge what was sent, so that the next chunk waits for it
+            if meter is not None:
+                meter(self.committed - committed)
+
+    def _send_chunk(self) -> None:
+        self._send(self._chunk_size)
+
+    def write(self, data) -> int:
+        """Buffer data, sending each complete chunk; return the bytes written."""
+        if self.closed or self._finished:
+            raise ValueError("I/O operation on closed file.")
+        view = memoryview(data).cast("B")
+        try:
+            written = 0
+            while written < len(view):
+                end = written + self._chunk_size - len(self._buffer)
+                self._buffer += view[written:end]
+                written = min(end, len(view))
+                if len(self._buffer) >= self._chunk_size:
+                    self._send_chunk()
+        except BaseException:
+            self._failed = True
+            raise
+
+        return written
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self._failed = True
+        return super().__exit__(exc_type, exc_val, exc_tb)
+
+    def __del__(self):
+        # A writer that is garbage collected without being closed is
+        # abandoned, rather than committing whatever was written so far
+        self._failed = True
+        super().__del__()
+
+    def close(self) -> None:
+        """Send the remaining data and create the object.
+
+        If writing failed, or the writer is being exited because of an
+        exception, the upload is left incomplete so that it can be resumed.
+        """
+        if self.closed:
+            return
+        try:
+            total = self.tell()
+            while not (self._failed or self._finished):
+                self._send(len(self._buffer), total)
+        finally:
+            super().close()
+
+
+def _write_source(writer: BlobWriter, source, chunk_size: int, skip: int) -> None:
+    if hasattr(source, "read"):
+        if skip and source.seekable():
+            source.seek(skip, io.SEEK_CUR)
+            skip = 0
+        pieces = iter(lambda: source.read(chunk_size), b"")
+    else:
+        pieces = iter(source)
+    for piece in pieces:
+        if skip:
+            # Discard data that an interrupted upload already committed
+            dropped = min(skip, len(piece))
+            piece = piece[dropped:]
+            skip -= dropped
+        if piece:
+            writer.write(piece)
+
+
+class _TextBlobWriter(io.TextIOWrapper):
+    # Abandon, rather than commit, an upload interrupted by an exception
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.buffer.raw._failed = True
+        return super().__exit__(exc_type, exc_val, exc_tb)
+
+
+def open_writer(
+    blob: storage.blob.Blob,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    session_url: Optional[str] = None,
+    content_type: Optional[str] = None,
+    encoding: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+):
+    """Open a file object that uploads into an object; see `BlobWriter`.
+
+    Args:
+      blob (google.cloud.storage.blob.Blob): the object to create
+      chunk_size (int): the size of each upload request, in bytes; a multiple
+                        of 256KiB (default 8MiB)
+      session_url (str): optional; an upload session to continue
+      content_type (str): optional; the content type of a new object
+      encoding (str): optional; when set, return a text file object that
+                      writes with this encoding
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a BlobWriter, or a text file object wrapping one
+    """
+    writer = BlobWriter(blob, chunk_size, session_url, content_type, retry=retry)
+    if encoding is None:
+        return writer
+
+    return _TextBlobWriter(io.BufferedWriter(writer, chunk_size), encoding=encoding)
+
+
+def stream_to_blob(
+    blob: storage.blob.Blob,
+    source,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    session_url: Optional[str] = None,
+    content_type: Optional[str] = None,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> storage.blob.Blob:
+    """Upload the data from a binary file object or an iterator of bytes.
+
+    When `session_url` names an interrupted upload session, the data already
+    committed to it is skipped (by seeking, where the source supports it) and
+    the upload continues from there. `source` must then produce the same data
+    from its start as it did for the interrupted upload.
+
+    Args:
+      blob (google.cloud.storage.blob.Blob): the object to create
+      source (file or iterable): a binary file object, or an iterable of bytes
+      chunk_size (int): the size of each upload request, in bytes; a multiple
+                        of 256KiB (default 8MiB)
+      session_url (str): optional; an upload session to continue
+      content_type (str): optional; the content type of a new object
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns the blob, with its properties set from the upload response
+    """
+    writer = BlobWriter(blob, chunk_size, session_url, content_type, retry=retry)
+    with writer:
+        _write_source(writer, source, chunk_size, writer.committed)
+
+    return blob
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    # GzipFile does not close a file object that it was given
+    def close(self):
+        fileobj = self.fileobj
+        super().close()
+        if fileobj is not None:
+            fileobj.close()
+
+
+def open_reader(
+    blob: storage.blob.Blob,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+    retry: RetryPolicy = DEFAULT_RETRY,
+) -> io.BufferedIOBase:
+    """Open a buffered binary file object over an object.
+
+    Objects stored with gzip content encoding are decompressed as they are
+    read.
+
+    Args:
+      blob (google.cloud.storage.blob.Blob): the object; its metadata must be
+                                             loaded
+      chunk_size (int): the size of each ranged request, in bytes (default 8MiB)
+      read_ahead (int): the number of chunks to fetch ahead of the reader
+                        (default 2)
+      retry (gcsutils.retry.RetryPolicy): how failed requests are retried
+                                          (default DEFAULT_RETRY)
+
+    Returns a file object
+    """
+    file_obj = io.BufferedReader(
+        BlobReader(blob, chunk_size, read_ahead, retry), buffer_size=chunk_size
+    )
+    if blob.content_encoding == "gzip":
+        return _ClosingGzipFile(fileobj=file_obj, mode="rb")
+
+    return file_obj
+
+
+def iter_chunks(
+    file_obj: Union[io.RawIOBase, io.BufferedIOBase], chunk_size: int
+) -> Iterator[bytes]:
+    """Iterate over the contents of a binary file object in chunks.
+
+    Args:
+      file_obj (file): the binary file object to read, eg/ from `open_blob`
+      chunk_size (int): the maximum size of each chunk, in bytes
+
+    Yields chunks of bytes; only the last chunk may be shorter than chunk_size
+    """
+    return iter(lambda: file_obj.read(chunk_size), b"")
+
+
+def iter_lines(file_obj: io.BufferedIOBase, encoding: str = "utf-8") -> Iterator[str]:
+    """Iterate over the lines of a binary file object.
+
+    Args:
+      file_obj (file): the binary file object to read, eg/ from `open_blob`
+      encoding (str): the text encoding of the file (default "utf-8")
+
+    Yields each line as a string, without its line ending
+    """
+    for line in file_obj:
+        yield line.decode(encoding).rstrip("\r\n")
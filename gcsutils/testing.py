@@ -0,0 +1,533 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import base64
+import datetime
+import email.parser
+import gzip
+import hashlib
+import http
+import http.server
+import itertools
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import google_crc32c
+
+_DEFAULT_PAGE_SIZE = 1000
+# How often the serving thread checks for shutdown, in seconds
+_POLL_INTERVAL = 0.05
+# Sorts after every other character, so a token ending in it skips a prefix
+_LAST_CHARACTER = "\U0010ffff"
+# The size of the writes that bandwidth limits are applied to
+_PACING_CHUNK_SIZE = 64 * 1024
+
+_Response = Tuple[int, Dict[str, str], bytes]
+
+
+def _error(status: int, message: str) -> _Response:
+    body = {"error": {"code": status, "message": message, "errors": [{}]}}
+    return _json_response(body, status)
+
+
+def _json_response(body: dict, status: int = 200) -> _Response:
+    return status, {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+
+def _split_url(url: str) -> Tuple[List[str], Dict[str, str]]:
+    parts = urllib.parse.urlsplit(url)
+    path = [urllib.parse.unquote(part) for part in parts.path.split("/") if part]
+    query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+
+    return path, query
+
+
+def _parse_multipart(content_type: str, body: bytes) -> Tuple[dict, bytes]:
+    # A multipart/related upload has a JSON metadata part and a media part
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    parts = body.split(b"--" + boundary)
+    payloads = []
+    for part in parts[1:3]:
+        _, _, payload = part.partition(b"\r\n\r\n")
+        payloads.append(payload[:-2] if payload.endswith(b"\r\n") else payload)
+
+    return json.loads(payloads[0]), payloads[1]
+
+
+class _UploadSession:
+    def __init__(self, bucket: str, metadata: dict, query: Dict[str, str]):
+        self.bucket = bucket
+        self.metadata = metadata
+        self.query = query
+        self.data = bytearray()
+
+
+class FakeGCSServer:
+    """An in-memory stand-in for the Cloud Storage JSON API, served on localhost.
+
+    The server implements the subset of the API that gcsutils uses: object
+    listing with prefixes and delimiters, metadata and media downloads
+    (including byte ranges), media, multipart and resumable uploads, deletes,
+    rewrites, copies and composes, and `ifGenerationMatch` preconditions.
+    Buckets spring into existence when first used, and no authentication is
+    required.
+
+    Point the synchronous client at the server by setting the
+    STORAGE_EMULATOR_HOST environment variable to `url`, and the asynchronous
+    client by passing `url` as its endpoint. Use the server as a context
+    manager, or call `start` and `stop`.
+
+    To imitate a remote service, `latency` delays every response, and
+    `bandwidth` limits the rate at which each request and response body is
+    transferred. Both apply per connection and can be changed while the
+    server is running.
+
+    Args:
+      host (str): the interface to listen on (default "127.0.0.1")
+      port (int): the port to listen on (default 0, any free port)
+      latency (float): the delay before each response, in seconds (default 0)
+      bandwidth (float): optional; the transfer rate of each connection, in
+                         bytes per second (default None, unlimited)
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._objects: Dict[str, Dict[str, Tuple[bytes, dict]]] = {}
+        self._sessions: Dict[str, _UploadSession] = {}
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server, eg/ "http://127.0.0.1:8123"."""
+        host, port = self._httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self) -> "FakeGCSServer":
+        """Start serving requests on a background thread."""
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever,
+            kwargs={"poll_interval": _POLL_INTERVAL},
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving requests and release the listening socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def put_object(
+        self,
+        bucket: str,
+        name: str,
+        data: bytes,
+        content_type: str = "application/octet-stream",
+        content_encoding: Optional[str] = None,
+    ) -> dict:
+        """Store an object directly, and return its metadata resource."""
+        metadata = {"contentType": content_type}
+        if content_encoding is not None:
+            metadata["contentEncoding"] = content_encoding
+        with self._lock:
+            return self._store(bucket, name, bytes(data), metadata)
+
+    def get_object(self, bucket: str, name: str) -> bytes:
+        """Return the content of an object; raises KeyError if it is missing."""
+        with self._lock:
+            return self._objects.get(bucket, {})[name][0]
+
+    def list_objects(self, bucket: str) -> List[str]:
+        """Return the sorted names of the objects in a bucket."""
+        with self._lock:
+            return sorted(self._objects.get(bucket, {}))
+
+    def _store(self, bucket: str, name: str, data: bytes, metadata: dict) -> dict:
+        # RFC 3339 in UTC with millisecond precision, as GCS formats it
+        now = (
+            datetime.datetime.now(datetime.timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%S.%f"
+            )[:-3]
+            + "Z"
+        )
+        crc32c = google_crc32c.Checksum(data).digest()
+        resource = {
+            "contentType": "application/octet-stream",
+            **{k: v for k, v in metadata.items() if k not in ("bucket", "name")},
+            "kind": "storage#object",
+            "id": "{}/{}".format(bucket, name),
+            "bucket": bucket,
+            "name": name,
+            "generation": str(next(self._generations)),
+            "metageneration": "1",
+            "size": str(len(data)),
+            "crc32c": base64.b64encode(crc32c).decode("utf-8"),
+            "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode("utf-8"),
+            "timeCreated": now,
+            "updated": now,
+        }
+        self._objects.setdefault(bucket, {})[name] = (data, resource)
+
+        return resource
+
+    def _check_generation(
+        self, bucket: str, name: str, query: Dict[str, str]
+    ) -> Optional[_Response]:
+        if "ifGenerationMatch" not in query:
+            return None
+        stored = self._objects.get(bucket, {}).get(name)
+        generation = stored[1]["generation"] if stored else "0"
+        if generation != query["ifGenerationMatch"]:
+            return _error(
+                412, "At least one of the pre-conditions you specified did not hold."
+            )
+        return None
+
+    def _get_object(self, bucket: str, name: str, query: Dict[str, str]):
+        stored = self._objects.get(bucket, {}).get(name)
+        if stored is None or query.get("generation", stored[1]["generation"]) != (
+            stored[1]["generation"]
+        ):
+            return None
+        return stored
+
+    def handle(self, method: str, url: str, headers, body: bytes) -> _Response:
+        """Dispatch one API request; called by the HTTP request handler."""
+        path, query = _split_url(url)
+        with self._lock:
+            if path == ["batch", "storage", "v1"] and method == "POST":
+                return self._batch(headers, body)
+            return self._dispatch(method, path, query, headers, body)
+
+    def _dispatch(self, method, path, query, headers, body) -> _Response:
+        if path[:1] == ["download"]:
+            path = path[1:]
+        if path[:3] == ["upload", "storage", "v1"] and path[5:] == ["o"]:
+            return self._upload(method, path[4], query, headers, body)
+        if path[:3] != ["storage", "v1", "b"] or path[4:5] != ["o"]:
+            return _error(404, "Not Found")
+        bucket, rest = path[3], path[5:]
+        if not rest and method == "GET":
+            return self._list(bucket, query)
+        if len(rest) == 1 and method == "GET":
+            return self._download(bucket, rest[0], query, headers)
+        if len(rest) == 1 and method == "DELETE":
+            return self._delete(bucket, rest[0], query)
+        if rest[1:2] == ["compose"] and method == "POST":
+            return self._compose(bucket, rest[0], query, body)
+        if len(rest) == 6 and rest[1] in ("rewriteTo", "copyTo"):
+            return self._rewrite(bucket, rest, query, body)
+        return _error(405, "Method not allowed")
+
+    def _batch(self, headers, body) -> _Response:
+        # Each part of a multipart/mixed batch is a complete HTTP request, and
+        # is answered by the matching part of a multipart/mixed response
+        content_type = "Content-Type: {}\r\n\r\n".format(headers["Content-Type"])
+        message = email.parser.BytesParser().parsebytes(content_type.encode() + body)
+        boundary = "batch_" + uuid.uuid4().hex
+        parts = []
+        for index, part in enumerate(message.get_payload(), 1):
+            request_line, _, rest = part.get_payload().partition("\n")
+            method, url, _ = request_line.split(" ", 2)
+            request = email.parser.Parser().parsestr(rest)
+            path, query = _split_url(url)
+            status, response_headers, content = self._dispatch(
+                method, path, query, request, request.get_payload().encode()
+            )
+            head = "".join("{}: {}\r\n".format(*h) for h in response_headers.items())
+            parts.append(
+                "--{}\r\nContent-Type: application/http\r\n"
+                "Content-ID: <response-{}>\r\n\r\n"
+                "HTTP/1.1 {} {}\r\n{}\r\n{}\r\n".format(
+                    boundary,
+                    index,
+                    status,
+                    http.HTTPStatus(status).phrase,
+                    head,
+                    content.decode("utf-8"),
+                )
+            )
+        content = "".join(parts) + "--{}--\r\n".format(boundary)
+        content_type = "multipart/mixed; boundary={}".format(boundary)
+        return 200, {"Content-Type": content_type}, content.encode("utf-8")
+
+    def _list(self, bucket: str, query: Dict[str, str]) -> _Response:
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter")
+        page_size = int(query.get("maxResults", _DEFAULT_PAGE_SIZE))
+        start = ""
+        if query.get("pageToken"):
+            start = base64.urlsafe_b64decode(query["pageToken"]).decode("utf-8")
+
+        items, prefixes, last = [], [], None
+        for name in sorted(self._objects.get(bucket, {})):
+            if not name.startswith(prefix) or name <= start:
+                continue
+            if len(items) + len(prefixes) == page_size:
+                break
+            index = name.find(delimiter, len(prefix)) if delimiter else -1
+            if index < 0:
+                items.append(self._objects[bucket][name][1])
+                last = name
+            else:
+                prefixes.append(name[: index + len(delimiter)])
+                last = prefixes[-1] + _LAST_CHARACTER
+                start = last
+        else:
+            last = None
+
+        body = {"kind": "storage#objects"}
+        if items:
+            body["items"] = items
+        if prefixes:
+            body["prefixes"] = prefixes
+        if last is not None:
+            token = base64.urlsafe_b64encode(last.encode("utf-8"))
+            body["nextPageToken"] = token.decode("utf-8")
+        return _json_response(body)
+
+    def _download(self, bucket, name, query, headers) -> _Response:
+        stored = self._get_object(bucket, name, query)
+        if stored is None:
+            return _error(404, "No such object: {}/{}".format(bucket, name))
+        data, resource = stored
+        if query.get("alt") != "media":
+            return _json_response(resource)
+
+        response_headers = {
+            "Content-Type": resource["contentType"],
+            "x-goog-generation": resource["generation"],
+            "x-goog-hash": "crc32c={},md5={}".format(
+                resource["crc32c"], resource["md5Hash"]
+            ),
+        }
+        encoding = resource.get("contentEncoding")
+        if encoding is not None:
+            response_headers["x-goog-stored-content-encoding"] = encoding
+        if encoding == "gzip" and "gzip" not in (headers.get("Accept-Encoding") or ""):
+            # Decompressive transcoding, for clients that do not accept gzip
+            data = gzip.decompress(data)
+        elif encoding is not None:
+            response_headers["Content-Encoding"] = encoding
+        match = re.match(r"bytes=(\d+)-(\d*)$", headers.get("Range") or "")
+        if not match:
+            return 200, response_headers, data
+        first = int(match.group(1))
+        last = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+        if first >= len(data):
+            return _error(416, "Requested range not satisfiable")
+        response_headers["Content-Range"] = "bytes {}-{}/{}".format(
+            first, last, len(data)
+        )
+        end = last + 1
+        return 206, response_headers, data[first:end]
+
+    def _delete(self, bucket, name, query) -> _Response:
+        if self._get_object(bucket, name, query) is None:
+            return _error(404, "No such object: {}/{}".format(bucket, name))
+        failed = self._check_generation(bucket, name, query)
+        if failed:
+            return failed
+        del self._objects[bucket][name]
+        return 204, {}, b""
+
+    def _upload(self, method, bucket, query, headers, body) -> _Response:
+        upload_type = query.get("uploadType")
+        if method == "PUT" and upload_type == "resumable":
+            return self._resume(query.get("upload_id"), headers, body)
+        if upload_type == "media":
+            metadata = {"name": query.get("name")}
+            if headers.get("Content-Type"):
+                metadata["contentType"] = headers["Content-Type"]
+        elif upload_type == "multipart":
+            metadata, body = _parse_multipart(headers["Content-Type"], body)
+        elif upload_type == "resumable":
+            metadata = json.loads(body or b"{}")
+            metadata.setdefault("name", query.get("name"))
+            session_id = uuid.uuid4().hex
+            self._sessions[session_id] = _UploadSession(bucket, metadata, query)
+            location = "{}/upload/storage/v1/b/{}/o?uploadType=resumable&upload_id={}"
+            return 200, {"Location": location.format(self.url, bucket, session_id)}, b""
+        else:
+            return _error(400, "Unsupported uploadType {!r}".format(upload_type))
+
+        failed = self._check_generation(bucket, metadata["name"], query)
+        if failed:
+            return failed
+        return _json_response(self._store(bucket, metadata["name"], body, metadata))
+
+    def _resume(self, session_id, headers, body) -> _Response:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return _error(404, "No such upload session")
+        match = re.match(
+            r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)$", headers.get("Content-Range", "")
+        )
+        if match is None:
+            return _error(400, "Invalid Content-Range")
+        if match.group(1) is not None:
+            first = int(match.group(1))
+            if first > len(session.data):
+                return _error(400, "Upload chunk does not follow the committed data")
+            overlap = len(session.data) - first
+            session.data += body[overlap:]
+        if match.group(2) == "*" or int(match.group(2)) != len(session.data):
+            response_headers = {}
+            if session.data:
+                response_headers["Range"] = "bytes=0-{}".format(len(session.data) - 1)
+            return 308, response_headers, b""
+
+        name = session.metadata["name"]
+        failed = self._check_generation(session.bucket, name, session.query)
+        if failed:
+            return failed
+        del self._sessions[session_id]
+        resource = self._store(
+            session.bucket, name, bytes(session.data), session.metadata
+        )
+        return _json_response(resource)
+
+    def _compose(self, bucket, name, query, body) -> _Response:
+        request = json.loads(body)
+        data = b""
+        for source in request.get("sourceObjects", []):
+            stored = self._objects.get(bucket, {}).get(source["name"])
+            if stored is None:
+                return _error(
+                    404, "No such object: {}/{}".format(bucket, source["name"])
+                )
+            data += stored[0]
+        failed = self._check_generation(bucket, name, query)
+        if failed:
+            return failed
+        metadata = request.get("destination") or {}
+        return _json_response(self._store(bucket, name, data, metadata))
+
+    def _rewrite(self, bucket, rest, query, body) -> _Response:
+        name, operation, destination_bucket, destination = (
+            rest[0],
+            rest[1],
+            rest[3],
+            rest[5],
+        )
+        source_query = {}
+        if "sourceGeneration" in query:
+            source_query["generation"] = query["sourceGeneration"]
+        stored = self._get_object(bucket, name, source_query)
+        if stored is None:
+            return _error(404, "No such object: {}/{}".format(bucket, name))
+        data, resource = stored
+        failed = self._check_generation(destination_bucket, destination, query)
+        if failed:
+            return failed
+
+        # Honour maxBytesRewrittenPerCall so that callers' token loops are exercised
+        step = int(query.get("maxBytesRewrittenPerCall") or len(data))
+        done = min(int(query.get("rewriteToken") or 0) + step, len(data))
+        metadata = {
+            key: value
+            for key, value in resource.items()
+            if key in ("contentType", "contentEncoding", "metadata")
+        }
+        metadata.update(json.loads(body or b"{}"))
+        if operation == "copyTo":
+            return _json_response(
+                self._store(destination_bucket, destination, data, metadata)
+            )
+        response = {
+            "kind": "storage#rewriteResponse",
+            "totalBytesRewritten": str(done),
+            "objectSize": str(len(data)),
+            "done": done == len(data),
+        }
+        if done < len(data):
+            response["rewriteToken"] = str(done)
+        else:
+            response["resource"] = self._store(
+                destination_bucket, destination, data, metadata
+            )
+        return _json_response(response)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; with Nagle's algorithm, the
+    # body of a small response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def _pace(self, size: int, started: float) -> None:
+        # Sleep until `size` bytes would have been transferred since `started`
+        bandwidth = self.server.fake.bandwidth
+        if bandwidth:
+            delay = started + size / bandwidth - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _handle(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        started = time.monotonic()
+        body = self.rfile.read(length) if length else b""
+        self._pace(len(body), started)
+        if fake.latency:
+            time.sleep(fake.latency)
+        status, headers, content = fake.handle(
+            self.command, self.path, self.headers, body
+        )
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        view = memoryview(content)
+        started = time.monotonic()
+        for offset in range(0, len(view), _PACING_CHUNK_SIZE):
+            end = offset + _PACING_CHUNK_SIZE
+            self._pace(min(end, len(view)), started)
+            self.wfile.write(view[offset:end])
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args):
+        pass
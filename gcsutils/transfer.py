@@ -0,0 +1,189 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import concurrent.futures
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from gcsutils import metrics, scheduler
+
+DEFAULT_MAX_WORKERS = 16
+
+
+@dataclass
+class TransferResult:
+    """The outcome of transferring a single object.
+
+    Attributes:
+      source (str): the local path or object name that was read
+      destination (str): the local path or object name that was written
+      bytes_transferred (int): the number of bytes moved
+      elapsed (float): the wall-clock duration of the transfer, in seconds
+      error (Exception): the error raised by the transfer, or None on success
+    """
+
+    source: str
+    destination: str
+    bytes_transferred: int = 0
+    elapsed: float = 0.0
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        """True if the transfer completed without an error."""
+        return self.error is None
+
+
+@dataclass
+class TransferSummary:
+    """Aggregate statistics for a batch of transfers.
+
+    Only failed transfers are retained individually, so that the summary of a
+    very large batch stays small. Use the `on_result` callback of
+    `run_transfers` to observe every result. `skipped` counts items that did not
+    need to be transferred at all, as decided by the caller.
+    """
+
+    succeeded: int = 0
+    skipped: int = 0
+    failures: List[TransferResult] = field(default_factory=list)
+    bytes_transferred: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def failed(self) -> int:
+        """The number of transfers that raised an error."""
+        return len(self.failures)
+
+    @property
+    def throughput(self) -> float:
+        """The aggregate transfer rate of the batch, in bytes per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.bytes_transferred / self.elapsed
+
+    def add(self, result: TransferResult) -> None:
+        """Fold a single transfer result into the summary."""
+        if result.ok:
+            self.succeeded += 1
+            self.bytes_transferred += result.bytes_transferred
+        else:
+            self.failures.append(result)
+
+
+class TransferError(Exception):
+    """Raised when one or more transfers in a batch failed.
+
+    The complete batch is attempted before this is raised; the `summary`
+    attribute holds the per-file failures.
+    """
+
+    def __init__(self, summary: TransferSummary):
+        self.summary = summary
+        super().__init__(
+            "{} of {} transfers failed; first error: {!r}".format(
+                summary.failed,
+                summary.failed + summary.succeeded,
+                summary.failures[0].error if summary.failures else None,
+            )
+        )
+
+
+def get_file_paths_from_directory(directory: str) -> List[str]:
+    """Return the paths of the files directly inside a local directory."""
+    with os.scandir(directory) as entries:
+        return [entry.path for entry in entries if entry.is_file()]
+
+
+def _describe(location: Any) -> str:
+    return getattr(location, "name", None) or str(location)
+
+
+def _run_transfer(
+    transfer: Callable[[Any, Any], int],
+    source: Any,
+    destination: Any,
+    queued: Optional[float] = None,
+) -> TransferResult:
+    result = TransferResult(_describe(source), _describe(destination))
+    start = time.monotonic()
+    if queued is not None:
+        metrics.record(metrics.QUEUE_WAIT, start - queued)
+    try:
+        with scheduler.priority(scheduler.BULK):
+            result.bytes_transferred = transfer(source, destination) or 0
+    except Exception as e:
+        result.error = e
+    result.elapsed = time.monotonic() - start
+
+    return result
+
+
+def run_transfers(
+    transfer: Callable[[Any, Any], int],
+    items: Iterable[Tuple[Any, Any]],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    on_result: Optional[Callable[[TransferResult], None]] = None,
+) -> TransferSummary:
+    """Run transfers concurrently on a bounded pool of worker threads.
+
+    `items` is consumed lazily: at most twice `max_workers` transfers are queued
+    at any time, so an iterator over a very large listing never has to be
+    materialized. A failing transfer is recorded and does not stop the batch.
+    Transfers run at the BULK priority of `gcsutils.scheduler`.
+
+    Args:
+      transfer (callable): called as transfer(source, destination) on a worker
+                           thread; returns the number of bytes transferred
+      items (iterable): (source, destination) pairs to transfer
+      max_workers (int): the number of concurrent transfers
+      on_result (callable): optional; called on the calling thread with the
+                            TransferResult of every transfer as it completes
+
+    Returns a TransferSummary
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+
+    summary = TransferSummary()
+
+    def collect(futures):
+        for future in futures:
+            result = future.result()
+            summary.add(result)
+            if on_result is not None:
+                on_result(result)
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for source, destination in items:
+            if len(pending) >= max_workers * 2:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                collect(done)
+            pending.add(
+                executor.submit(
+                    _run_transfer, transfer, source, destination, time.monotonic()
+                )
+            )
+        collect(concurrent.futures.wait(pending).done)
+    summary.elapsed = time.monotonic() - start
+
+    return summary
@@ -28,6 +28,10 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     packages=["gcsutils"],
     install_requires=["google-cloud-storage==2.4.0"],
+    extras_require={
+        "aio": ["aiohttp>=3.8"],
+        "metrics": ["prometheus-client>=0.14"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: Apache Software License",
@@ -0,0 +1,59 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+import tempfile
+
+import pytest
+
+from gcsutils import gcs, scheduler
+from gcsutils.scheduler import TransferScheduler
+from gcsutils.testing import FakeGCSServer
+
+
+@pytest.fixture
+def objects():
+    """Objects to seed the fake server's "bucket" with, as {name: data}.
+
+    Override this fixture in a test module to seed every test there.
+    """
+    return {}
+
+
+@pytest.fixture
+def server(monkeypatch, objects):
+    with FakeGCSServer() as server:
+        monkeypatch.setenv("STORAGE_EMULATOR_HOST", server.url)
+        gcs.clear_client_cache()
+        for name, data in objects.items():
+            server.put_object("bucket", name, data)
+        yield server
+    gcs.clear_client_cache()
+
+
+@pytest.fixture
+def directory():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+@pytest.fixture
+def install_scheduler():
+    def install(**kwargs):
+        transfer_scheduler = TransferScheduler(**kwargs)
+        scheduler.set_scheduler(transfer_scheduler)
+        return transfer_scheduler
+
+    yield install
+    scheduler.set_scheduler(None)
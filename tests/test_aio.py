@@ -0,0 +1,344 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+import gzip
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from gcsutils import aio, scheduler  # noqa: E402
+from gcsutils.hedge import HedgePolicy  # noqa: E402
+from gcsutils.retry import NO_RETRY, RetryPolicy  # noqa: E402
+from gcsutils.scheduler import BULK  # noqa: E402
+from gcsutils.transfer import TransferError  # noqa: E402
+
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await aio.close_storage_clients()
+
+    return asyncio.run(main())
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+class TestAsyncStorageClient:
+    def test_shared_per_event_loop(self, server):
+        async def clients():
+            first = aio.get_storage_client("project")
+            second = aio.get_storage_client("project", max_concurrency=32)
+            return first, second
+
+        first, second = run(clients())
+        third, _ = run(clients())
+
+        assert first is second
+        assert first.max_concurrency == 32
+        assert third is not first
+
+    def test_limits_concurrent_requests(self, server):
+        for i in range(6):
+            server.put_object("bucket", "o{}".format(i), b"x")
+        active = []
+        peak = []
+        handle = server.handle
+
+        def counting_handle(*args):
+            active.append(None)
+            peak.append(len(active))
+            try:
+                return handle(*args)
+            finally:
+                active.pop()
+
+        server.handle = counting_handle
+
+        async def download_all():
+            aio.get_storage_client("project", max_concurrency=2)
+            names = ["o{}".format(i) for i in range(6)]
+            return await asyncio.gather(
+                *(aio.download_bytes("project", "bucket", n) for n in names)
+            )
+
+        assert run(download_all()) == [b"x"] * 6
+        assert max(peak) <= 2
+
+    def test_rejects_invalid_concurrency(self):
+        with pytest.raises(ValueError):
+            aio.AsyncStorageClient("project", max_concurrency=0)
+
+
+class TestList:
+    def test_lists_one_level_or_recursively(self, server):
+        for name in ("a/1", "a/2", "a/b/3", "c/4"):
+            server.put_object("bucket", name, b"data")
+
+        top = run(_collect(aio.list_bucket_contents("project", "bucket", "a")))
+        every = run(
+            _collect(aio.list_bucket_contents("project", "bucket", "a/", recurse=True))
+        )
+
+        assert [item["name"] for item in top] == ["a/1", "a/2"]
+        assert [item["name"] for item in every] == ["a/1", "a/2", "a/b/3"]
+        assert top[0]["size"] == "4"
+
+
+class TestDownload:
+    def test_downloads_bytes_and_ranges(self, server):
+        server.put_object("bucket", "dir/tile.bin", b"0123456789")
+
+        assert run(aio.download_bytes("project", "bucket", "dir/tile.bin")) == (
+            b"0123456789"
+        )
+        assert run(aio.download_bytes("project", "bucket", "dir/tile.bin", 2, 4)) == (
+            b"234"
+        )
+
+    def test_hedges_slow_downloads(self, server):
+        server.put_object("bucket", "a", b"data")
+        handle = server.handle
+        release = threading.Event()
+        requests = []
+
+        def first_request_stalls(method, url, headers, body):
+            requests.append(url)
+            if len(requests) == 1:
+                release.wait(5)
+            return handle(method, url, headers, body)
+
+        server.handle = first_request_stalls
+        hedge = HedgePolicy(min_samples=1)
+        hedge.record(0.01)
+        try:
+            data = run(aio.download_bytes("project", "bucket", "a", hedge=hedge))
+        finally:
+            release.set()
+
+        assert data == b"data"
+        assert hedge.hedges == 1
+
+    def test_missing_object(self, server):
+        with pytest.raises(ValueError, match="File not found at missing"):
+            run(aio.download_bytes("project", "bucket", "missing"))
+
+    def test_decompresses_gzip_objects(self, server):
+        data = b"line\n" * 100
+        server.put_object("bucket", "a.txt", gzip.compress(data), "text/plain", "gzip")
+
+        assert run(aio.download_bytes("project", "bucket", "a.txt")) == data
+
+    def test_detects_corruption(self, server, directory):
+        server.put_object("bucket", "a", b"good")
+        resource = server._objects["bucket"]["a"][1]
+        server._objects["bucket"]["a"] = (b"evil", resource)
+        path = os.path.join(directory, "a")
+
+        with pytest.raises(aio.DataCorruption):
+            run(aio.download_file("project", "bucket", "a", path))
+        assert not os.path.exists(path)
+
+    def test_retries_failed_download(self, server, directory):
+        server.put_object("bucket", "a", b"data")
+        handle = server.handle
+        requests = []
+
+        def fail_first(method, url, headers, body):
+            requests.append(url)
+            if len(requests) == 1:
+                return 503, {}, b""
+            return handle(method, url, headers, body)
+
+        server.handle = fail_first
+        local_file_path = os.path.join(directory, "a")
+
+        run(
+            aio.download_file(
+                "project",
+                "bucket",
+                "a",
+                local_file_path,
+                retry=RetryPolicy(initial_delay=0),
+            )
+        )
+
+        assert len(requests) == 2
+        with open(local_file_path, "rb") as f:
+            assert f.read() == b"data"
+
+    def test_download_files(self, server, directory):
+        server.put_object("bucket", "dir/a", b"aaa")
+        server.put_object("bucket", "dir/b", b"bb")
+        server.put_object("bucket", "dir/sub/c", b"c")
+
+        summary = run(aio.download_files("project", "bucket", "dir", directory))
+
+        assert summary.succeeded == 2
+        assert summary.bytes_transferred == 5
+        assert sorted(os.listdir(directory)) == ["a", "b"]
+
+
+class TestUpload:
+    def test_upload_bytes(self, server):
+        resource = run(
+            aio.upload_bytes("project", "bucket", "a/b.json", b"{}", "application/json")
+        )
+
+        assert resource["name"] == "a/b.json"
+        assert server.get_object("bucket", "a/b.json") == b"{}"
+
+    def test_upload_files(self, server, directory):
+        for name in ("one.txt", "two.txt"):
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(name)
+
+        summary = run(aio.upload_files("project", "bucket", "up", directory))
+
+        assert summary.succeeded == 2
+        assert server.list_objects("bucket") == ["up/one.txt", "up/two.txt"]
+        assert server.get_object("bucket", "up/two.txt") == b"two.txt"
+
+    def test_upload_files_reports_failures(self, server, directory):
+        for name in ("one.txt", "two.txt"):
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(name)
+        handle = server.handle
+
+        def failing_handle(method, url, headers, body):
+            if "two.txt" in url:
+                return 503, {}, b""
+            return handle(method, url, headers, body)
+
+        server.handle = failing_handle
+
+        with pytest.raises(TransferError) as e:
+            run(aio.upload_files("project", "bucket", "up", directory, retry=NO_RETRY))
+
+        assert e.value.summary.failed == 1
+        assert e.value.summary.failures[0].source.endswith("two.txt")
+        assert server.list_objects("bucket") == ["up/one.txt"]
+
+
+class TestCopyAndDelete:
+    def test_copy_file(self, server):
+        server.put_object("bucket", "a", b"data", "text/plain")
+
+        run(aio.copy_file("project", "bucket", "a", "b"))
+
+        assert server.get_object("bucket", "b") == b"data"
+
+    def test_delete_file_ignores_missing_objects(self, server):
+        server.put_object("bucket", "a", b"data")
+
+        run(aio.delete_file("project", "bucket", "a"))
+        run(aio.delete_file("project", "bucket", "a"))
+
+        assert server.list_objects("bucket") == []
+
+    def test_delete_files(self, server):
+        for name in ("a", "b", "c"):
+            server.put_object("bucket", name, b"data")
+
+        failures = run(aio.delete_files("project", "bucket", ["a", "c", "missing"]))
+
+        assert failures == {}
+        assert server.list_objects("bucket") == ["b"]
+
+
+@pytest.fixture
+def transfer_scheduler(install_scheduler):
+    return install_scheduler(
+        upload_rate=128 * 1024,
+        download_rate=128 * 1024,
+        max_in_flight_bytes=1,
+        burst=32 * 1024,
+    )
+
+
+class TestScheduling:
+    def _record_admissions(self, transfer_scheduler, monkeypatch):
+        admissions = []
+        acquire = transfer_scheduler.memory.acquire_async
+
+        async def record(nbytes, priority):
+            await acquire(nbytes, priority)
+            admissions.append((priority, transfer_scheduler.memory.in_flight))
+
+        monkeypatch.setattr(transfer_scheduler.memory, "acquire_async", record)
+        return admissions
+
+    def test_download_files_is_scheduled(
+        self, server, directory, transfer_scheduler, monkeypatch
+    ):
+        for name in "ab":
+            server.put_object("bucket", "dir/" + name, os.urandom(48 * 1024))
+        admissions = self._record_admissions(transfer_scheduler, monkeypatch)
+
+        start = time.monotonic()
+        run(aio.download_files("project", "bucket", "dir", directory, max_workers=2))
+
+        assert time.monotonic() - start >= 0.4
+        assert admissions == [(BULK, aio._READ_SIZE)] * 2
+        assert transfer_scheduler.memory.in_flight == 0
+
+    def test_upload_files_is_scheduled(
+        self, server, directory, transfer_scheduler, monkeypatch
+    ):
+        for name in "ab":
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(os.urandom(48 * 1024))
+        admissions = self._record_admissions(transfer_scheduler, monkeypatch)
+
+        start = time.monotonic()
+        run(aio.upload_files("project", "bucket", "up", directory, max_workers=2))
+
+        assert time.monotonic() - start >= 0.4
+        assert admissions == [(BULK, 48 * 1024)] * 2
+        assert server.list_objects("bucket") == ["up/a", "up/b"]
+
+    def test_uploads_are_metered_per_chunk(
+        self, server, directory, transfer_scheduler, monkeypatch
+    ):
+        data = os.urandom(48 * 1024)
+        path = os.path.join(directory, "a")
+        with open(path, "wb") as f:
+            f.write(data)
+        monkeypatch.setattr(aio, "_READ_SIZE", 16 * 1024)
+        charged = []
+        bucket = transfer_scheduler.buckets[scheduler.UPLOAD]
+        consume_async = bucket.consume_async
+
+        async def record(nbytes, priority):
+            charged.append(nbytes)
+            return await consume_async(nbytes, priority)
+
+        monkeypatch.setattr(bucket, "consume_async", record)
+
+        run(aio.upload_file("project", "bucket", "up", path))
+        run(aio.upload_bytes("project", "bucket", "up/b", data))
+
+        assert charged == [16 * 1024] * 6
+        assert server.get_object("bucket", "up/a") == data
+        assert server.get_object("bucket", "up/b") == data
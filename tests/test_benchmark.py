@@ -0,0 +1,73 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+from gcsutils import benchmark
+
+OPERATIONS = [
+    "upload_files",
+    "list_bucket_contents",
+    "list_bucket_folders",
+    "download_files",
+    "copy_prefix",
+    "delete_files",
+]
+
+
+class TestRunBenchmarks:
+    def test_every_operation_is_measured(self):
+        report = benchmark.run_benchmarks([3], [10], [1, 2], latency=0.0)
+
+        results = report["results"]
+        assert [r["operation"] for r in results] == OPERATIONS * 2
+        assert [r["concurrency"] for r in results] == [1] * 6 + [2] * 6
+        assert all(r["seconds"] > 0 for r in results)
+        assert results[0]["bytes_transferred"] == 30
+        assert report["cpu_count"] == os.cpu_count()
+
+    def test_delete_files_deletes_the_uploaded_objects(self):
+        deleted = []
+        with patch(
+            "gcsutils.gcs.delete_files",
+            side_effect=lambda project, bucket, names, workers: deleted.extend(names),
+        ):
+            benchmark.run_benchmarks([3], [10], [1], latency=0.0)
+
+        assert sorted(deleted) == ["data/{:06d}.bin".format(i) for i in range(3)]
+
+    def test_main_writes_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+
+            benchmark.main(
+                [
+                    "--file-counts=2",
+                    "--file-sizes=10",
+                    "--concurrency=2",
+                    "--latency=0",
+                    "--output",
+                    path,
+                ]
+            )
+
+            with open(path) as f:
+                report = json.load(f)
+        assert len(report["results"]) == len(OPERATIONS)
+        assert report["results"][0]["file_count"] == 2
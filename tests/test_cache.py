@@ -0,0 +1,205 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import os
+import time
+from unittest.mock import MagicMock, patch
+
+from google.api_core.exceptions import ServiceUnavailable
+
+from gcsutils.cache import BlobCache
+from gcsutils.retry import RetryBudget, RetryPolicy
+
+
+class FakeBucket:
+    name = "bucket"
+
+    def __init__(self, objects):
+        # name -> (generation, data)
+        self.objects = objects
+        self.downloads = 0
+        self.reloads = 0
+
+    def blob(self, name, generation=None):
+        blob = MagicMock()
+        blob.name = name
+        blob.bucket = self
+        blob.generation = generation
+
+        def reload(retry=None):
+            self.reloads += 1
+            blob.generation = self.objects[name][0]
+
+        def download_to_filename(path, retry=None):
+            assert blob.generation == self.objects[name][0]
+            self.downloads += 1
+            with open(path, "wb") as f:
+                f.write(self.objects[name][1])
+
+        blob.reload.side_effect = reload
+        blob.download_to_filename.side_effect = download_to_filename
+        return blob
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TestBlobCache:
+    def test_downloads_once_then_serves_from_cache(self, directory):
+        bucket = FakeBucket({"a": (1, b"aaa")})
+        cache = BlobCache(os.path.join(directory, "cache"), max_bytes=100)
+        first = os.path.join(directory, "first")
+        second = os.path.join(directory, "second")
+
+        assert cache.fetch(bucket.blob("a"), first) == 3
+        cache.fetch(bucket.blob("a"), second)
+
+        assert _read(first) == _read(second) == b"aaa"
+        assert bucket.downloads == 1
+        assert bucket.reloads == 2
+
+    def test_new_generation_is_downloaded(self, directory):
+        bucket = FakeBucket({"a": (1, b"old")})
+        cache = BlobCache(os.path.join(directory, "cache"), max_bytes=100)
+        local_path = os.path.join(directory, "a")
+
+        cache.fetch(bucket.blob("a"), local_path)
+        bucket.objects["a"] = (2, b"new")
+        cache.fetch(bucket.blob("a"), local_path)
+
+        assert _read(local_path) == b"new"
+        assert bucket.downloads == 2
+
+    def test_ttl_skips_metadata_lookups(self, directory):
+        bucket = FakeBucket({"a": (1, b"aaa")})
+        cache = BlobCache(os.path.join(directory, "cache"), max_bytes=100, ttl=60)
+        local_path = os.path.join(directory, "a")
+
+        cache.fetch(bucket.blob("a"), local_path)
+        cache.fetch(bucket.blob("a"), local_path)
+
+        assert bucket.reloads == 1
+        assert bucket.downloads == 1
+
+    def test_known_generation_skips_metadata_lookup(self, directory):
+        bucket = FakeBucket({"a": (5, b"aaa")})
+        cache = BlobCache(os.path.join(directory, "cache"), max_bytes=100)
+
+        cache.fetch(bucket.blob("a", generation=5), os.path.join(directory, "a"))
+
+        assert bucket.reloads == 0
+
+    def test_evicts_least_recently_used(self, directory):
+        bucket = FakeBucket({name: (1, name.encode() * 40) for name in "abc"})
+        cache = BlobCache(os.path.join(directory, "cache"), max_bytes=100)
+        local_path = os.path.join(directory, "out")
+
+        cache.fetch(bucket.blob("a"), local_path)
+        time.sleep(0.01)
+        cache.fetch(bucket.blob("b"), local_path)
+        time.sleep(0.01)
+        # "a" is used again, so "b" is now the least recently used entry
+        cache.fetch(bucket.blob("a"), local_path)
+        time.sleep(0.01)
+        cache.fetch(bucket.blob("c"), local_path)
+        assert bucket.downloads == 3
+
+        cache.fetch(bucket.blob("a"), local_path)
+        assert bucket.downloads == 3
+        cache.fetch(bucket.blob("b"), local_path)
+        assert bucket.downloads == 4
+
+    def test_lock_files_are_removed_with_their_entries(self, directory):
+        bucket = FakeBucket({name: (1, name.encode() * 60) for name in "abcd"})
+        directory = os.path.join(directory, "cache")
+        cache = BlobCache(directory, max_bytes=100)
+        local_path = os.path.join(directory, "out")
+
+        for name in "abcd":
+            cache.fetch(bucket.blob(name), local_path)
+
+        objects = os.listdir(os.path.join(directory, "objects"))
+        locks = os.listdir(os.path.join(directory, "locks"))
+        assert len(objects) == 1
+        assert sorted(locks) == sorted(objects + ["evict"])
+
+    def test_lookups_are_not_kept_without_a_ttl(self, directory):
+        bucket = FakeBucket({"a": (1, b"aaa")})
+        directory = os.path.join(directory, "cache")
+        cache = BlobCache(directory, max_bytes=100)
+
+        cache.fetch(bucket.blob("a"), os.path.join(directory, "out"))
+
+        assert os.listdir(os.path.join(directory, "index")) == []
+
+    def test_lookups_are_removed_with_their_entries(self, directory):
+        bucket = FakeBucket({name: (1, name.encode() * 60) for name in "abcd"})
+        directory = os.path.join(directory, "cache")
+        cache = BlobCache(directory, max_bytes=100, ttl=60)
+        local_path = os.path.join(directory, "out")
+
+        for name in "abcd":
+            cache.fetch(bucket.blob(name), local_path)
+
+        objects = os.listdir(os.path.join(directory, "objects"))
+        index = os.listdir(os.path.join(directory, "index"))
+        assert index == [name.rsplit("-", 1)[0] for name in objects]
+
+    def test_metadata_lookups_are_retried(self, directory):
+        bucket = FakeBucket({"a": (1, b"aaa")})
+        retry = RetryPolicy(initial_delay=0, budget=RetryBudget())
+        cache = BlobCache(os.path.join(directory, "cache"), max_bytes=100, retry=retry)
+        blob = bucket.blob("a")
+        reload = blob.reload.side_effect
+
+        def fail_once(retry=None):
+            if blob.reload.call_count == 1:
+                raise ServiceUnavailable("a")
+            reload(retry)
+
+        blob.reload.side_effect = fail_once
+
+        cache.fetch(blob, os.path.join(directory, "out"))
+
+        assert blob.reload.call_count == 2
+        assert bucket.downloads == 1
+
+    def test_cached_files_are_not_modified_through_hand_outs(self, directory):
+        bucket = FakeBucket({"a": (1, b"aaa")})
+        cache = BlobCache(os.path.join(directory, "cache"), max_bytes=100)
+        local_path = os.path.join(directory, "a")
+        cache.fetch(bucket.blob("a"), local_path)
+
+        with open(local_path, "wb") as f:
+            f.write(b"changed")
+        cache.fetch(bucket.blob("a"), os.path.join(directory, "again"))
+
+        assert _read(os.path.join(directory, "again")) == b"aaa"
+
+    def test_hands_out_hard_links(self, directory):
+        bucket = FakeBucket({"a": (1, b"aaa")})
+        cache = BlobCache(
+            os.path.join(directory, "cache"), max_bytes=100, hardlink=True
+        )
+        first = os.path.join(directory, "first")
+        second = os.path.join(directory, "second")
+        with patch("gcsutils.cache._reflink", return_value=False):
+            cache.fetch(bucket.blob("a"), first)
+            cache.fetch(bucket.blob("a"), second)
+
+        assert os.path.samefile(first, second)
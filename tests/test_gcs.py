@@ -14,35 +14,59 @@ permissions and limitations under the License.
 """
 
 
+import base64
+import gzip
 import json
 import os
 import random
+import re
 import string
 import tempfile
+import threading
 from unittest.mock import MagicMock, patch
 
+import google_crc32c
 import pytest
-from google.api_core.exceptions import ServiceUnavailable
+import requests
+from google.api_core.exceptions import (
+    Forbidden,
+    PreconditionFailed,
+    ServiceUnavailable,
+)
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+from google.resumable_media import DataCorruption
 
 from gcsutils import gcs
 from gcsutils.gcs import (
     _copy_blob,
     copy_file,
+    copy_prefix,
     delete_file,
+    delete_files,
+    delete_prefix,
     download_file,
     download_files,
     gcs_join,
     list_bucket_contents,
     list_bucket_folders,
+    move_prefix,
     rename_file,
+    sync_from_bucket,
+    sync_to_bucket,
     upload_file,
     upload_files,
 )
+from gcsutils.hedge import HedgePolicy
+from gcsutils.retry import DEFAULT_RETRY, NO_RETRY, RetryPolicy
+from gcsutils.transfer import TransferError
 
 GCP_PROJECT_NAME = "coral-atlas"
 GCS_BUCKET_NAME = "coral-atlas-integration-tests"
 GCS_BUCKET_PATH = "path/to/test/data"
 TOO_DEEP_FOLDER_NAME = "too_deep"
+# Retries without waiting, for tests of failures that go away
+NO_WAIT_RETRY = RetryPolicy(initial_delay=0)
 
 
 class TestGcsJoin:
@@ -83,11 +107,10 @@ class TestGetClient:
             fake_credentials
         )
         with patch.multiple(
-            "gcsutils.gcs",
+            "gcsutils.credentials",
             os=mock_os,
             service_account=mock_service_account,
-            storage=mock_storage,
-        ):
+        ), patch("gcsutils.gcs.storage", mock_storage):
             actual_client = gcs._get_storage_client(GCP_PROJECT_NAME)
 
         assert actual_client == fake_client
@@ -103,7 +126,7 @@ class TestGetClient:
         fake_service_account_key = ""
         mock_os.environ = {"SERVICE_ACCOUNT_KEY": fake_service_account_key}
         with pytest.raises(ValueError) as e:
-            with patch("gcsutils.gcs.os", mock_os):
+            with patch("gcsutils.credentials.os", mock_os):
                 gcs._get_storage_client(GCP_PROJECT_NAME)
 
         expected_message = "SERVICE_ACCOUNT_KEY is empty or contains invalid JSON"
@@ -117,11 +140,10 @@ class TestGetClient:
         mock_os.environ = {}
         mock_service_account = MagicMock()
         with patch.multiple(
-            "gcsutils.gcs",
+            "gcsutils.credentials",
             os=mock_os,
             service_account=mock_service_account,
-            storage=mock_storage,
-        ):
+        ), patch("gcsutils.gcs.storage", mock_storage):
             actual_client = gcs._get_storage_client(GCP_PROJECT_NAME)
 
         assert actual_client == fake_client
@@ -129,6 +151,225 @@ class TestGetClient:
         mock_service_account.Credentials.from_service_account_info.assert_not_called()
 
 
+class TestClientCache:
+    def setup_method(self):
+        gcs.clear_client_cache()
+
+    def teardown_method(self):
+        gcs.clear_client_cache()
+
+    def test_reuses_client_and_bucket(self):
+        with patch("gcsutils.gcs._get_storage_client") as mock_get_client:
+            first = gcs.get_storage_bucket(GCP_PROJECT_NAME, GCS_BUCKET_NAME)
+            second = gcs.get_storage_bucket(GCP_PROJECT_NAME, GCS_BUCKET_NAME)
+
+        assert first is second
+        mock_get_client.assert_called_once_with(GCP_PROJECT_NAME, 16)
+
+    def test_keyed_by_credential_source(self):
+        with patch("gcsutils.gcs._get_storage_client") as mock_get_client:
+            mock_get_client.side_effect = lambda *args: MagicMock()
+            with patch.dict(os.environ, {"SERVICE_ACCOUNT_KEY": "{}"}):
+                first = gcs.get_storage_client(GCP_PROJECT_NAME)
+            with patch.dict(os.environ, {"SERVICE_ACCOUNT_KEY": '{"a": 1}'}):
+                second = gcs.get_storage_client(GCP_PROJECT_NAME)
+
+        assert first is not second
+
+    def test_clear_client_cache(self):
+        with patch("gcsutils.gcs._get_storage_client") as mock_get_client:
+            mock_get_client.side_effect = lambda *args: MagicMock()
+            first = gcs.get_storage_client(GCP_PROJECT_NAME)
+            gcs.clear_client_cache()
+            second = gcs.get_storage_client(GCP_PROJECT_NAME)
+
+        assert first is not second
+
+    def test_grows_connection_pool_for_more_workers(self):
+        with patch.multiple(
+            "gcsutils.gcs",
+            _get_storage_client=MagicMock(),
+            _configure_connection_pool=MagicMock(),
+        ):
+            client = gcs.get_storage_client(GCP_PROJECT_NAME, pool_size=8)
+            gcs.get_storage_client(GCP_PROJECT_NAME, pool_size=4)
+            gcs.get_storage_client(GCP_PROJECT_NAME, pool_size=32)
+
+            gcs._configure_connection_pool.assert_called_once_with(client, 32)
+
+    def test_thread_safe(self):
+        clients = []
+        with patch("gcsutils.gcs._get_storage_client") as mock_get_client:
+            mock_get_client.side_effect = lambda *args: MagicMock()
+            threads = [
+                threading.Thread(
+                    target=lambda: clients.append(
+                        gcs.get_storage_client(GCP_PROJECT_NAME)
+                    )
+                )
+                for _ in range(8)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert mock_get_client.call_count == 1
+        assert all(c is clients[0] for c in clients)
+
+
+class FakeListing:
+    """Stand-in for the HTTPIterator returned by Bucket.list_blobs."""
+
+    def __init__(self, prefixes=(), blobs=()):
+        self.prefixes = set(prefixes)
+        self._blobs = list(blobs)
+
+    @property
+    def pages(self):
+        yield self._blobs
+
+    def __iter__(self):
+        return iter(self._blobs)
+
+
+class TestListBucketFolders:
+    tree = {
+        "root/": ["root/a/", "root/b/"],
+        "root/a/": ["root/a/x/"],
+        "root/b/": [],
+        "root/a/x/": ["root/a/x/deep/"],
+    }
+
+    def _list_blobs(self, prefix, delimiter, fields, retry):
+        assert delimiter == "/"
+        return FakeListing(prefixes=self.tree.get(prefix, []))
+
+    def _list_folders(self, **kwargs):
+        mock_bucket = MagicMock()
+        mock_bucket.list_blobs.side_effect = self._list_blobs
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+            folders = list_bucket_folders(
+                GCP_PROJECT_NAME, GCS_BUCKET_NAME, "root", **kwargs
+            )
+        return folders, mock_bucket
+
+    def test_lists_immediate_folders_from_prefixes(self):
+        folders, mock_bucket = self._list_folders()
+
+        assert folders == ["a", "b"]
+        mock_bucket.list_blobs.assert_called_once_with(
+            prefix="root/",
+            delimiter="/",
+            fields="prefixes,nextPageToken",
+            retry=DEFAULT_RETRY,
+        )
+
+    def test_depth_limited_tree(self):
+        folders, mock_bucket = self._list_folders(max_depth=2)
+
+        assert folders == ["a", "b", "a/x"]
+        assert len(mock_bucket.list_blobs.mock_calls) == 3
+
+    def test_stops_when_tree_is_exhausted(self):
+        folders, mock_bucket = self._list_folders(max_depth=10)
+
+        assert folders == ["a", "b", "a/x", "a/x/deep"]
+        assert len(mock_bucket.list_blobs.mock_calls) == 5
+
+    def test_raises_for_invalid_depth(self):
+        with pytest.raises(ValueError):
+            list_bucket_folders(GCP_PROJECT_NAME, GCS_BUCKET_NAME, "root", 0)
+
+
+class FakeBatchEndpoint:
+    """Answers batch requests, failing deletes of the given object names."""
+
+    def __init__(self, statuses=None):
+        self.statuses = statuses or {}
+        self.batch_sizes = []
+
+    def __call__(self, method, url, data, headers, timeout):
+        parts = []
+        names = re.findall(r"DELETE \S+/o/(\S+?)\?", data)
+        self.batch_sizes.append(len(names))
+        for i, name in enumerate(names):
+            status = self.statuses.get(name, 204)
+            parts.append(
+                "--b\r\nContent-Type: application/http\r\n"
+                "Content-ID: <response-{0}>\r\n\r\n"
+                "HTTP/1.1 {1} Status\r\nContent-Type: application/json\r\n\r\n"
+                '{{"error": {{"message": "{2}"}}}}\r\n'.format(i, status, name)
+            )
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["content-type"] = "multipart/mixed; boundary=b"
+        response._content = ("".join(parts) + "--b--").encode("utf-8")
+        return response
+
+
+class TestDeleteFiles:
+    def _bucket(self, endpoint):
+        client = storage.Client(
+            project=GCP_PROJECT_NAME, credentials=AnonymousCredentials()
+        )
+        client._base_connection._make_request = endpoint
+        return client.bucket(GCS_BUCKET_NAME)
+
+    def test_deletes_in_batches_of_one_hundred(self):
+        endpoint = FakeBatchEndpoint()
+        names = ["obj{}".format(i) for i in range(250)]
+        with patch(
+            "gcsutils.gcs.get_storage_bucket", return_value=self._bucket(endpoint)
+        ):
+            failures = delete_files(GCP_PROJECT_NAME, GCS_BUCKET_NAME, names)
+
+        assert failures == {}
+        assert sorted(endpoint.batch_sizes) == [50, 100, 100]
+
+    def test_ignores_missing_objects_and_reports_failures(self):
+        endpoint = FakeBatchEndpoint({"missing": 404, "forbidden": 403})
+        names = ["ok", "missing", "forbidden"]
+        with patch(
+            "gcsutils.gcs.get_storage_bucket", return_value=self._bucket(endpoint)
+        ):
+            failures = delete_files(GCP_PROJECT_NAME, GCS_BUCKET_NAME, names)
+
+        assert list(failures) == ["forbidden"]
+        assert isinstance(failures["forbidden"], Forbidden)
+
+    def test_delete_prefix_deletes_listed_objects(self):
+        endpoint = FakeBatchEndpoint()
+        bucket = self._bucket(endpoint)
+        blobs = [bucket.blob("root/a"), bucket.blob("root/sub/b")]
+        with patch.object(bucket, "list_blobs", return_value=iter(blobs)) as list_blobs:
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=bucket):
+                failures = delete_prefix(GCP_PROJECT_NAME, GCS_BUCKET_NAME, "root")
+
+        assert failures == {}
+        assert endpoint.batch_sizes == [2]
+        list_blobs.assert_called_once_with(
+            prefix="root/", fields="items(name),nextPageToken", retry=DEFAULT_RETRY
+        )
+
+    def test_retries_only_failed_deletes(self):
+        endpoint = FakeBatchEndpoint({"busy": 503, "forbidden": 403})
+        names = ["ok", "busy", "forbidden"]
+        with patch(
+            "gcsutils.gcs.get_storage_bucket", return_value=self._bucket(endpoint)
+        ):
+            failures = delete_files(
+                GCP_PROJECT_NAME,
+                GCS_BUCKET_NAME,
+                names,
+                retry=RetryPolicy(max_attempts=3, initial_delay=0),
+            )
+
+        assert sorted(failures) == ["busy", "forbidden"]
+        assert isinstance(failures["busy"], ServiceUnavailable)
+        assert endpoint.batch_sizes == [3, 1, 1]
+
+
 class TestCopyBlob:
 
     fake_blob = "my_fake_gcs_blob"
@@ -142,16 +383,703 @@ class TestCopyBlob:
             None,
         ]
 
-        _copy_blob(self.fake_blob, mock_bucket, self.fake_new_gcs_path)
+        _copy_blob(self.fake_blob, mock_bucket, self.fake_new_gcs_path, NO_WAIT_RETRY)
 
         assert len(mock_bucket.copy_blob.mock_calls) == 3
 
-    def test_raises_after_five_retries(self):
+    def test_raises_after_five_attempts(self):
         mock_bucket = MagicMock()
         mock_bucket.copy_blob.side_effect = ServiceUnavailable("foo")
 
         with pytest.raises(ServiceUnavailable):
-            _copy_blob(self.fake_blob, mock_bucket, self.fake_new_gcs_path, retries=6)
+            _copy_blob(
+                self.fake_blob, mock_bucket, self.fake_new_gcs_path, NO_WAIT_RETRY
+            )
+
+        assert len(mock_bucket.copy_blob.mock_calls) == 5
+
+
+class TestUploadFiles:
+    def _write_files(self, directory, names):
+        for name in names:
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(name)
+
+    def test_uploads_every_file(self):
+        mock_bucket = MagicMock()
+        with tempfile.TemporaryDirectory() as directory:
+            self._write_files(directory, ["a.txt", "bb.txt"])
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+                summary = upload_files(
+                    GCP_PROJECT_NAME, GCS_BUCKET_NAME, GCS_BUCKET_PATH, directory
+                )
+
+        assert summary.succeeded == 2
+        assert summary.bytes_transferred == len("a.txt") + len("bb.txt")
+        blob_names = sorted(c.args[0] for c in mock_bucket.blob.call_args_list)
+        assert blob_names == [
+            gcs_join([GCS_BUCKET_PATH, "a.txt"]),
+            gcs_join([GCS_BUCKET_PATH, "bb.txt"]),
+        ]
+
+    def test_reports_failures_after_attempting_every_file(self):
+        mock_bucket = MagicMock()
+        mock_bucket.blob.return_value.upload_from_filename.side_effect = [
+            ServiceUnavailable("foo"),
+            None,
+            None,
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            self._write_files(directory, ["a", "b", "c"])
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+                with pytest.raises(TransferError) as e:
+                    upload_files(
+                        GCP_PROJECT_NAME,
+                        GCS_BUCKET_NAME,
+                        GCS_BUCKET_PATH,
+                        directory,
+                        max_workers=1,
+                        retry=NO_RETRY,
+                    )
+
+        assert e.value.summary.succeeded == 2
+        assert e.value.summary.failed == 1
+
+    def test_returns_failures_without_raising(self):
+        mock_bucket = MagicMock()
+        mock_bucket.blob.return_value.upload_from_filename.side_effect = IOError
+        with tempfile.TemporaryDirectory() as directory:
+            self._write_files(directory, ["a"])
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+                summary = upload_files(
+                    GCP_PROJECT_NAME,
+                    GCS_BUCKET_NAME,
+                    GCS_BUCKET_PATH,
+                    directory,
+                    raise_on_error=False,
+                )
+
+        assert summary.failed == 1
+
+    def _uploaded_names(self, directory, **kwargs):
+        mock_bucket = MagicMock()
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+            upload_files(
+                GCP_PROJECT_NAME, GCS_BUCKET_NAME, GCS_BUCKET_PATH, directory, **kwargs
+            )
+
+        prefix = GCS_BUCKET_PATH + "/"
+        return sorted(
+            c.args[0].replace(prefix, "", 1) for c in mock_bucket.blob.call_args_list
+        )
+
+    def test_skips_subdirectories_by_default(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "sub"))
+            self._write_files(directory, ["a", os.path.join("sub", "b")])
+
+            assert self._uploaded_names(directory) == ["a"]
+
+    def test_recursive_upload_preserves_structure(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "sub", "deeper"))
+            self._write_files(
+                directory,
+                ["a", os.path.join("sub", "b"), os.path.join("sub", "deeper", "c")],
+            )
+
+            names = self._uploaded_names(directory, recursive=True)
+
+        assert names == ["a", "sub/b", "sub/deeper/c"]
+
+    def test_include_and_exclude_patterns(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "sub"))
+            os.makedirs(os.path.join(directory, "tmp"))
+            self._write_files(
+                directory,
+                [
+                    "a.tif",
+                    "a.json",
+                    os.path.join("sub", "b.tif"),
+                    os.path.join("sub", "skip.tif"),
+                    os.path.join("tmp", "c.tif"),
+                ],
+            )
+
+            names = self._uploaded_names(
+                directory,
+                recursive=True,
+                include=["*.tif"],
+                exclude=["tmp", "*/skip.tif"],
+            )
+
+        assert names == ["a.tif", "sub/b.tif"]
+
+    def test_excluded_directories_are_not_walked(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "tmp"))
+            self._write_files(directory, ["a", os.path.join("tmp", "b")])
+            real_scandir = os.scandir
+            walked = []
+
+            def scandir(path):
+                walked.append(path)
+                return real_scandir(path)
+
+            with patch("gcsutils.gcs.os.scandir", side_effect=scandir):
+                names = self._uploaded_names(directory, recursive=True, exclude=["tmp"])
+
+        assert names == ["a"]
+        assert walked == [directory]
+
+
+class FakeBucket:
+    """Records the contents and compositions of the blobs it hands out."""
+
+    def __init__(self):
+        self.contents = {}
+        self.blobs = {}
+
+    def blob(self, name):
+        if name not in self.blobs:
+            blob = MagicMock()
+            blob.name = name
+            blob.upload_from_file.side_effect = self._uploader(name)
+            blob.compose.side_effect = self._composer(name)
+            self.blobs[name] = blob
+        return self.blobs[name]
+
+    def _uploader(self, name):
+        def upload_from_file(file_obj, size, retry):
+            self.contents[name] = file_obj.read(size)
+
+        return upload_from_file
+
+    def _composer(self, name):
+        def compose(sources, retry):
+            assert len(sources) <= 32
+            self.contents[name] = b"".join(self.contents[s.name] for s in sources)
+
+        return compose
+
+
+class TestCompositeUpload:
+    def _upload(self, data, parts, threshold=1):
+        bucket = FakeBucket()
+        deleted = []
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "mosaic.tif")
+            with open(file_path, "wb") as f:
+                f.write(data)
+            with patch.multiple(
+                "gcsutils.gcs",
+                get_storage_bucket=MagicMock(return_value=bucket),
+                _delete_blobs=lambda b, names, retry: deleted.extend(names) or {},
+            ):
+                upload_file(
+                    GCP_PROJECT_NAME,
+                    GCS_BUCKET_NAME,
+                    GCS_BUCKET_PATH,
+                    file_path,
+                    composite_threshold=threshold,
+                    composite_parts=parts,
+                )
+        return bucket, deleted
+
+    def test_uploads_parts_and_composes_them(self):
+        data = os.urandom(1000)
+        bucket, deleted = self._upload(data, parts=4)
+
+        destination = gcs_join([GCS_BUCKET_PATH, "mosaic.tif"])
+        assert bucket.contents[destination] == data
+        assert bucket.blobs[destination].content_type == "image/tiff"
+        assert len(deleted) == 4
+        assert set(deleted) == set(bucket.contents) - {destination}
+
+    def test_composes_recursively_beyond_32_parts(self):
+        data = os.urandom(1000)
+        bucket, deleted = self._upload(data, parts=100)
+
+        destination = gcs_join([GCS_BUCKET_PATH, "mosaic.tif"])
+        assert bucket.contents[destination] == data
+        # 100 parts, then 4 intermediate compositions
+        assert len(deleted) == 104
+
+    def test_cleans_up_parts_on_failure(self):
+        bucket = FakeBucket()
+        deleted = []
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "mosaic.tif")
+            with open(file_path, "wb") as f:
+                f.write(b"x" * 10)
+            with patch.multiple(
+                "gcsutils.gcs",
+                get_storage_bucket=MagicMock(return_value=bucket),
+                _delete_blobs=lambda b, names, retry: deleted.extend(names) or {},
+                _compose_parts=MagicMock(side_effect=ServiceUnavailable("foo")),
+            ):
+                with pytest.raises(ServiceUnavailable):
+                    upload_file(
+                        GCP_PROJECT_NAME,
+                        GCS_BUCKET_NAME,
+                        GCS_BUCKET_PATH,
+                        file_path,
+                        composite_threshold=1,
+                        composite_parts=2,
+                    )
+
+        assert len(deleted) == 2
+
+    def test_small_files_are_uploaded_directly(self):
+        bucket, deleted = self._upload(b"small", parts=4, threshold=1024)
+
+        destination = gcs_join([GCS_BUCKET_PATH, "mosaic.tif"])
+        bucket.blobs[destination].upload_from_filename.assert_called_once()
+        assert deleted == []
+
+
+class TestFileSlice:
+    def test_reads_only_its_range(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b"0123456789")
+            f.flush()
+            file_slice = gcs._FileSlice(f.fileno(), 3, 4)
+
+            assert file_slice.read() == b"3456"
+            file_slice.seek(-2, os.SEEK_END)
+            assert file_slice.read(10) == b"56"
+            assert file_slice.read(10) == b""
+
+
+class FakeRemoteObject:
+    """A bucket holding one object that serves byte-range downloads."""
+
+    def __init__(self, name, data, crc32c=None):
+        self.name = name
+        self.data = data
+        self.crc32c = crc32c or _crc32c(data)
+        self.requested_ranges = []
+
+    def blob(self, name, generation=None):
+        blob = MagicMock()
+        blob.name = name
+        blob.bucket = self
+        blob.size = len(self.data)
+        blob.generation = 7
+        blob.crc32c = self.crc32c
+        blob.content_encoding = None
+        blob.download_to_file.side_effect = self._download_range(generation)
+        return blob
+
+    def _download_range(self, generation):
+        def download_to_file(file_obj, start, end, raw_download, checksum, retry):
+            assert generation == 7
+            self.requested_ranges.append((start, end))
+            stop = end + 1
+            file_obj.write(self.data[start:stop])
+
+        return download_to_file
+
+
+class TestSlicedDownload:
+    def _download(self, remote, **kwargs):
+        with tempfile.TemporaryDirectory() as directory:
+            local_file_path = os.path.join(directory, "mosaic.tif")
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=remote):
+                download_file(
+                    GCP_PROJECT_NAME,
+                    GCS_BUCKET_NAME,
+                    remote.name,
+                    local_file_path,
+                    **kwargs,
+                )
+            with open(local_file_path, "rb") as f:
+                return f.read()
+
+    def test_downloads_ranges_into_place(self):
+        remote = FakeRemoteObject("mosaic.tif", os.urandom(1000))
+
+        data = self._download(remote, sliced_threshold=100, sliced_parts=3)
+
+        assert data == remote.data
+        assert sorted(remote.requested_ranges) == [(0, 333), (334, 667), (668, 999)]
+
+    def test_raises_and_removes_file_on_checksum_mismatch(self):
+        remote = FakeRemoteObject("mosaic.tif", b"x" * 100, crc32c="AAAAAA==")
+
+        with tempfile.TemporaryDirectory() as directory:
+            local_file_path = os.path.join(directory, "mosaic.tif")
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=remote):
+                with pytest.raises(DataCorruption):
+                    download_file(
+                        GCP_PROJECT_NAME,
+                        GCS_BUCKET_NAME,
+                        remote.name,
+                        local_file_path,
+                        sliced_threshold=1,
+                    )
+
+            assert not os.path.exists(local_file_path)
+
+    def test_small_objects_are_downloaded_in_one_stream(self):
+        remote = FakeRemoteObject("tile.png", b"x" * 10)
+        blob = remote.blob("tile.png")
+        remote.blob = MagicMock(return_value=blob)
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=remote):
+            download_file(
+                GCP_PROJECT_NAME,
+                GCS_BUCKET_NAME,
+                "tile.png",
+                "/dev/null",
+                sliced_threshold=100,
+            )
+
+        blob.download_to_filename.assert_called_once_with("/dev/null", retry=None)
+        blob.download_to_file.assert_not_called()
+
+
+class TestDownloadFileThroughCache:
+    def test_reads_through_cache(self):
+        mock_bucket = MagicMock()
+        mock_cache = MagicMock()
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+            download_file(
+                GCP_PROJECT_NAME,
+                GCS_BUCKET_NAME,
+                "path/to/tile.png",
+                "/tmp/tile.png",
+                cache=mock_cache,
+            )
+
+        blob, local_file_path, download = mock_cache.fetch.call_args.args
+        assert blob is mock_bucket.blob.return_value
+        assert local_file_path == "/tmp/tile.png"
+        mock_bucket.blob.return_value.download_to_filename.assert_not_called()
+
+
+class TestDownloadFiles:
+    def _fake_blob(self, name, contents=b"data"):
+        blob = MagicMock()
+        blob.name = name
+
+        def download_to_filename(path, retry):
+            with open(path, "wb") as f:
+                f.write(contents)
+
+        blob.download_to_filename.side_effect = download_to_filename
+        return blob
+
+    def test_downloads_start_before_listing_finishes(self):
+        first_download_done = threading.Event()
+        first = self._fake_blob(gcs_join([GCS_BUCKET_PATH, "first"]))
+        write_first = first.download_to_filename.side_effect
+
+        def download_first(path, retry):
+            write_first(path, retry)
+            first_download_done.set()
+
+        first.download_to_filename.side_effect = download_first
+
+        def listing():
+            yield first
+            # The next page is only "returned" once a download has completed
+            assert first_download_done.wait(timeout=5)
+            yield self._fake_blob(gcs_join([GCS_BUCKET_PATH, "second"]))
+
+        with tempfile.TemporaryDirectory() as directory:
+            mock_bucket = MagicMock()
+            mock_bucket.list_blobs.return_value = listing()
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+                summary = download_files(
+                    GCP_PROJECT_NAME, GCS_BUCKET_NAME, GCS_BUCKET_PATH, directory
+                )
+
+            assert sorted(os.listdir(directory)) == ["first", "second"]
+        assert summary.succeeded == 2
+
+    def test_skips_folder_placeholders_and_reports_failures(self):
+        broken = self._fake_blob(gcs_join([GCS_BUCKET_PATH, "broken"]))
+        broken.download_to_filename.side_effect = ServiceUnavailable("foo")
+        placeholder = self._fake_blob(GCS_BUCKET_PATH + "/")
+        blobs = [self._fake_blob(gcs_join([GCS_BUCKET_PATH, "ok"])), broken]
+
+        mock_bucket = MagicMock()
+        mock_bucket.list_blobs.return_value = iter([placeholder] + blobs)
+        with tempfile.TemporaryDirectory() as directory:
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+                summary = download_files(
+                    GCP_PROJECT_NAME,
+                    GCS_BUCKET_NAME,
+                    GCS_BUCKET_PATH,
+                    directory,
+                    raise_on_error=False,
+                    retry=NO_RETRY,
+                )
+
+        placeholder.download_to_filename.assert_not_called()
+        assert summary.succeeded == 1
+        assert summary.bytes_transferred == len(b"data")
+        assert summary.failures[0].source == gcs_join([GCS_BUCKET_PATH, "broken"])
+
+    def test_recursive_download_preserves_structure(self):
+        names = ["a", "sub/a", "sub/deeper/b", "sub/", "../escape"]
+        blobs = [self._fake_blob(GCS_BUCKET_PATH + "/" + n, n.encode()) for n in names]
+        mock_bucket = MagicMock()
+        mock_bucket.list_blobs.return_value = iter(blobs)
+        with tempfile.TemporaryDirectory() as directory:
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+                with patch("gcsutils.gcs.os.makedirs", wraps=os.makedirs) as makedirs:
+                    summary = download_files(
+                        GCP_PROJECT_NAME,
+                        GCS_BUCKET_NAME,
+                        GCS_BUCKET_PATH,
+                        directory,
+                        recursive=True,
+                    )
+
+            downloaded = {}
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    with open(path, "rb") as f:
+                        downloaded[os.path.relpath(path, directory)] = f.read()
+
+        assert summary.succeeded == 3
+        assert downloaded == {
+            "a": b"a",
+            os.path.join("sub", "a"): b"sub/a",
+            os.path.join("sub", "deeper", "b"): b"sub/deeper/b",
+        }
+        # Once per directory, not once per file
+        assert makedirs.call_count == 2
+        assert "delimiter" not in mock_bucket.list_blobs.call_args.kwargs
+
+    def test_failed_download_leaves_existing_file(self):
+        blob = self._fake_blob(gcs_join([GCS_BUCKET_PATH, "a"]))
+
+        def fail_midway(path, retry):
+            with open(path, "wb") as f:
+                f.write(b"part")
+            raise ServiceUnavailable("foo")
+
+        blob.download_to_filename.side_effect = fail_midway
+        mock_bucket = MagicMock()
+        mock_bucket.list_blobs.return_value = iter([blob])
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "a"), "wb") as f:
+                f.write(b"old")
+            with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+                summary = download_files(
+                    GCP_PROJECT_NAME,
+                    GCS_BUCKET_NAME,
+                    GCS_BUCKET_PATH,
+                    directory,
+                    raise_on_error=False,
+                    retry=NO_RETRY,
+                )
+
+            assert os.listdir(directory) == ["a"]
+            with open(os.path.join(directory, "a"), "rb") as f:
+                assert f.read() == b"old"
+        assert summary.failed == 1
+
+
+def _crc32c(data):
+    return base64.b64encode(google_crc32c.Checksum(data).digest()).decode("utf-8")
+
+
+class InMemoryBucket:
+    """A bucket whose objects live in a dict of name -> (data, generation)."""
+
+    def __init__(self, objects=None):
+        self.objects = {}
+        self.uploads = []
+        self.downloads = []
+        self._generation = 0
+        for name, data in (objects or {}).items():
+            self._store(name, data)
+
+    def _store(self, name, data):
+        self._generation += 1
+        self.objects[name] = (data, self._generation)
+
+    def _blob(self, name):
+        blob = MagicMock()
+        blob.name = name
+        if name in self.objects:
+            data, blob.generation = self.objects[name]
+            blob.size = len(data)
+            blob.crc32c = _crc32c(data)
+        return blob
+
+    def blob(self, name):
+        blob = self._blob(name)
+
+        def upload_from_filename(file_path, if_generation_match, retry):
+            generation = self.objects.get(name, (None, 0))[1]
+            if if_generation_match is not None and if_generation_match != generation:
+                raise PreconditionFailed(name)
+            with open(file_path, "rb") as f:
+                self._store(name, f.read())
+            self.uploads.append(name)
+            uploaded = self._blob(name)
+            blob.crc32c, blob.generation = uploaded.crc32c, uploaded.generation
+
+        blob.upload_from_filename.side_effect = upload_from_filename
+        return blob
+
+    def list_blobs(self, prefix, fields=None, delimiter=None, retry=None):
+        for name in sorted(self.objects):
+            if name.startswith(prefix):
+                blob = self._blob(name)
+                blob.download_to_filename.side_effect = self._downloader(name)
+                yield blob
+
+    def _downloader(self, name):
+        def download_to_filename(file_path, retry):
+            with open(file_path, "wb") as f:
+                f.write(self.objects[name][0])
+            self.downloads.append(name)
+
+        return download_to_filename
+
+
+class TestSync:
+    def _write(self, directory, relative_path, data):
+        file_path = os.path.join(directory, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(data)
+
+    def _sync(self, function, bucket, directory, **kwargs):
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=bucket):
+            return function(
+                GCP_PROJECT_NAME, GCS_BUCKET_NAME, "root", directory, **kwargs
+            )
+
+    def test_sync_to_bucket_uploads_only_changed_files(self):
+        bucket = InMemoryBucket({"root/same": b"same", "root/sub/old": b"old"})
+        with tempfile.TemporaryDirectory() as directory:
+            self._write(directory, "same", b"same")
+            self._write(directory, "sub/old", b"new")
+            self._write(directory, "sub/added", b"added")
+
+            summary = self._sync(sync_to_bucket, bucket, directory)
+
+        assert sorted(bucket.uploads) == ["root/sub/added", "root/sub/old"]
+        assert summary.succeeded == 2
+        assert summary.skipped == 1
+        assert bucket.objects["root/sub/old"][0] == b"new"
+
+    def test_manifest_avoids_rehashing_unchanged_files(self):
+        bucket = InMemoryBucket()
+        with tempfile.TemporaryDirectory() as directory:
+            self._write(directory, "a", b"a")
+            self._sync(sync_to_bucket, bucket, directory)
+            with patch("gcsutils.manifest.crc32c_of_file") as mock_crc32c:
+                summary = self._sync(sync_to_bucket, bucket, directory)
+
+        mock_crc32c.assert_not_called()
+        assert summary.skipped == 1
+        assert bucket.uploads == ["root/a"]
+
+    def test_sync_to_bucket_keeps_objects_changed_during_sync(self):
+        bucket = InMemoryBucket({"root/a": b"old"})
+        listed = bucket.list_blobs
+
+        def list_then_change(*args, **kwargs):
+            blobs = list(listed(*args, **kwargs))
+            bucket._store("root/a", b"theirs")
+            return blobs
+
+        bucket.list_blobs = list_then_change
+        with tempfile.TemporaryDirectory() as directory:
+            self._write(directory, "a", b"mine")
+
+            summary = self._sync(
+                sync_to_bucket, bucket, directory, raise_on_error=False
+            )
+
+        assert isinstance(summary.failures[0].error, PreconditionFailed)
+        assert bucket.objects["root/a"][0] == b"theirs"
+
+    def test_sync_to_bucket_deletes_extraneous_objects(self):
+        bucket = InMemoryBucket({"root/gone": b"gone"})
+        deleted = []
+        with tempfile.TemporaryDirectory() as directory:
+            self._write(directory, "kept", b"kept")
+            with patch(
+                "gcsutils.gcs._delete_blobs",
+                side_effect=lambda b, names, w, r: deleted.extend(names) or {},
+            ):
+                self._sync(sync_to_bucket, bucket, directory, delete_extraneous=True)
+
+        assert deleted == ["root/gone"]
+
+    def test_sync_from_bucket_downloads_only_changed_objects(self):
+        bucket = InMemoryBucket(
+            {"root/same": b"same", "root/sub/changed": b"new", "root/sub/new": b"n"}
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            self._write(directory, "same", b"same")
+            self._write(directory, "sub/changed", b"old")
+            self._write(directory, "extra", b"extra")
+
+            summary = self._sync(
+                sync_from_bucket, bucket, directory, delete_extraneous=True
+            )
+
+            with open(os.path.join(directory, "sub", "changed"), "rb") as f:
+                assert f.read() == b"new"
+            assert not os.path.exists(os.path.join(directory, "extra"))
+            assert os.path.exists(os.path.join(directory, gcs.MANIFEST_FILE_NAME))
+
+            # A second run compares generations and does not re-hash or download
+            bucket.downloads.clear()
+            with patch("gcsutils.manifest.crc32c_of_file") as mock_crc32c:
+                second = self._sync(sync_from_bucket, bucket, directory)
+
+        assert bucket.downloads == []
+        mock_crc32c.assert_not_called()
+        assert summary.succeeded == 2
+        assert summary.skipped == 1
+        assert second.skipped == 3
+
+    def test_sync_from_bucket_skips_names_outside_the_directory(self):
+        bucket = InMemoryBucket({"root/../../escaped": b"x", "root/a//b": b"y"})
+        with tempfile.TemporaryDirectory() as root:
+            directory = os.path.join(root, "a", "b")
+            os.makedirs(directory)
+
+            summary = self._sync(sync_from_bucket, bucket, directory)
+
+            assert not os.path.exists(os.path.join(root, "escaped"))
+            assert os.listdir(directory) == [gcs.MANIFEST_FILE_NAME]
+        assert bucket.downloads == []
+        assert summary.succeeded == 0
+
+    def test_failed_sync_from_bucket_keeps_the_local_copy(self):
+        bucket = InMemoryBucket({"root/a": b"new"})
+
+        def fail(blob, file_path, retry):
+            with open(file_path, "wb") as f:
+                f.write(b"ne")
+            raise ConnectionError()
+
+        with tempfile.TemporaryDirectory() as directory:
+            self._write(directory, "a", b"old")
+            with patch("gcsutils.gcs._download_blob", side_effect=fail):
+                summary = self._sync(
+                    sync_from_bucket, bucket, directory, raise_on_error=False
+                )
+
+            with open(os.path.join(directory, "a"), "rb") as f:
+                assert f.read() == b"old"
+            assert sorted(os.listdir(directory)) == sorted(
+                ["a", gcs.MANIFEST_FILE_NAME]
+            )
+        assert summary.failed == 1
 
 
 @pytest.mark.integration
@@ -354,3 +1282,250 @@ def test_gcs_bucket_upload_download():
             )
             for blob in blobs:
                 blob.delete()
+
+
+class TestRetry:
+    def test_upload_that_landed_is_not_repeated(self, server):
+        handle = server.handle
+        uploads = []
+
+        def store_then_fail(method, url, headers, body):
+            status, response_headers, response_body = handle(method, url, headers, body)
+            if "/upload/" in url:
+                uploads.append(url)
+                if len(uploads) == 1:
+                    return 503, {}, b""
+            return status, response_headers, response_body
+
+        server.handle = store_then_fail
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "a.txt")
+            with open(file_path, "wb") as f:
+                f.write(b"data")
+
+            upload_file("project", "bucket", "run", file_path, retry=NO_WAIT_RETRY)
+
+        assert len(uploads) == 1
+        assert server.get_object("bucket", "run/a.txt") == b"data"
+
+    def test_retry_does_not_overwrite_a_newer_object(self, server):
+        handle = server.handle
+        uploads = []
+
+        def fail_twice(method, url, headers, body):
+            if "/upload/" in url:
+                uploads.append(url)
+                if len(uploads) == 2:
+                    # Someone else creates the object between our retries
+                    server.put_object("bucket", "run/a.txt", b"theirs")
+                if len(uploads) <= 2:
+                    return 503, {}, b""
+            return handle(method, url, headers, body)
+
+        server.handle = fail_twice
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "a.txt")
+            with open(file_path, "wb") as f:
+                f.write(b"mine")
+
+            with pytest.raises(PreconditionFailed):
+                upload_file("project", "bucket", "run", file_path, retry=NO_WAIT_RETRY)
+
+        assert "ifGenerationMatch=0" in uploads[2]
+        assert server.get_object("bucket", "run/a.txt") == b"theirs"
+
+
+class TestHedgedDownload:
+    def test_slow_download_is_hedged(self, server):
+        server.put_object("bucket", "tiles/0.png", b"tile")
+        handle = server.handle
+        release = threading.Event()
+        media_requests = []
+
+        def first_download_stalls(method, url, headers, body):
+            if "alt=media" in url:
+                media_requests.append(url)
+                if len(media_requests) == 1:
+                    release.wait(5)
+            return handle(method, url, headers, body)
+
+        server.handle = first_download_stalls
+        hedge = HedgePolicy(min_samples=1)
+        hedge.record(0.01)
+        with tempfile.TemporaryDirectory() as directory:
+            local_file_path = os.path.join(directory, "0.png")
+            try:
+                download_file(
+                    "project", "bucket", "tiles/0.png", local_file_path, hedge=hedge
+                )
+            finally:
+                release.set()
+
+            with open(local_file_path, "rb") as f:
+                assert f.read() == b"tile"
+        assert len(media_requests) == 2
+        assert hedge.hedges == 1
+
+    def test_large_object_is_not_hedged(self, server):
+        server.put_object("bucket", "big", b"0123456789")
+        hedge = HedgePolicy(min_samples=1, max_size=4)
+        hedge.record(0.0)
+        with tempfile.TemporaryDirectory() as directory:
+            local_file_path = os.path.join(directory, "big")
+            with patch("gcsutils.gcs._download_hedged") as hedged:
+                download_file("project", "bucket", "big", local_file_path, hedge=hedge)
+
+            hedged.assert_not_called()
+            with open(local_file_path, "rb") as f:
+                assert f.read() == b"0123456789"
+            assert os.listdir(directory) == ["big"]
+
+
+class TestCopyPrefix:
+    def test_copies_tree_within_bucket(self, server):
+        for name in ("run/a", "run/sub/b", "other/c"):
+            server.put_object("bucket", name, name.encode())
+        results = []
+
+        summary = copy_prefix(
+            "project", "bucket", "run", "published/run", on_result=results.append
+        )
+
+        assert summary.succeeded == 2
+        assert sorted(r.destination for r in results) == [
+            "published/run/a",
+            "published/run/sub/b",
+        ]
+        assert server.get_object("bucket", "published/run/sub/b") == b"run/sub/b"
+        assert server.get_object("bucket", "run/a") == b"run/a"
+
+    def test_follows_rewrite_tokens_across_buckets(self, server, monkeypatch):
+        data = os.urandom(10000)
+        server.put_object("source", "run/big", data)
+        rewrites = []
+        rewrite = storage.Blob.rewrite
+
+        def small_rewrite(self, source, token=None, **kwargs):
+            rewrites.append(token)
+            return rewrite(self, source, token=token, **kwargs)
+
+        monkeypatch.setattr(storage.Blob, "rewrite", small_rewrite)
+        handle = server.handle
+
+        def limit_rewrite(method, url, headers, body):
+            if "rewriteTo" in url:
+                url += "&maxBytesRewrittenPerCall=4096"
+            return handle(method, url, headers, body)
+
+        server.handle = limit_rewrite
+
+        copy_prefix("project", "source", "run/", "", destination_bucket_name="dest")
+
+        assert rewrites == [None, "4096", "8192"]
+        assert server.get_object("dest", "big") == data
+
+    def test_rejects_destination_inside_source(self, server):
+        with pytest.raises(ValueError):
+            copy_prefix("project", "bucket", "run", "run/copy")
+
+
+class TestMovePrefix:
+    def test_moves_objects_across_buckets(self, server):
+        for name in ("run/a", "run/b"):
+            server.put_object("source", name, b"data")
+
+        summary = move_prefix(
+            "project", "source", "run", "final", destination_bucket_name="dest"
+        )
+
+        assert summary.succeeded == 2
+        assert summary.bytes_transferred == 8
+        assert server.list_objects("source") == []
+        assert server.list_objects("dest") == ["final/a", "final/b"]
+
+    def test_keeps_source_when_copy_fails(self, server):
+        for name in ("run/a", "run/b"):
+            server.put_object("bucket", name, b"data")
+        handle = server.handle
+
+        def failing_handle(method, url, headers, body):
+            if "rewriteTo" in url and "run%2Fb" in url:
+                return 503, {}, b""
+            return handle(method, url, headers, body)
+
+        server.handle = failing_handle
+
+        with pytest.raises(TransferError) as e:
+            move_prefix("project", "bucket", "run", "done", retry=NO_RETRY)
+
+        assert [f.source for f in e.value.summary.failures] == ["run/b"]
+        assert server.list_objects("bucket") == ["done/a", "run/b"]
+
+    def test_keeps_source_overwritten_during_move(self, server):
+        server.put_object("bucket", "run/a", b"old")
+        rewrite = storage.Blob.rewrite
+
+        def rewrite_then_overwrite(self, source, token=None, **kwargs):
+            result = rewrite(self, source, token=token, **kwargs)
+            server.put_object("bucket", "run/a", b"new")
+            return result
+
+        with patch.object(storage.Blob, "rewrite", rewrite_then_overwrite):
+            summary = move_prefix(
+                "project", "bucket", "run", "done", raise_on_error=False
+            )
+
+        assert summary.failed == 1
+        assert server.get_object("bucket", "run/a") == b"new"
+        assert server.get_object("bucket", "done/a") == b"old"
+
+
+class TestCompression:
+    def _write(self, directory, name, data):
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_compressible_files_are_gzipped(self, server):
+        text = b'{"type": "Feature"}\n' * 1000
+        noise = os.urandom(100000)
+        with tempfile.TemporaryDirectory() as directory:
+            self._write(directory, "a.geojson", text)
+            self._write(directory, "b.bin", text)
+            self._write(directory, "c.bin", noise)
+
+            upload_files("project", "bucket", "up", directory, compress=True)
+
+        bucket = gcs.get_storage_bucket("project", "bucket")
+        for name in ("a.geojson", "b.bin"):
+            blob = bucket.get_blob("up/" + name)
+            assert blob.content_encoding == "gzip"
+            assert gzip.decompress(server.get_object("bucket", "up/" + name)) == text
+        assert bucket.get_blob("up/c.bin").content_encoding is None
+        assert server.get_object("bucket", "up/c.bin") == noise
+
+    def test_compressed_files_download_as_the_original(self, server):
+        text = b"x,y\n1,2\n" * 1000
+        with tempfile.TemporaryDirectory() as directory:
+            path = self._write(directory, "a.csv", text)
+            upload_file("project", "bucket", "up", path, compress=True)
+            os.remove(path)
+            blob = gcs.get_storage_bucket("project", "bucket").get_blob("up/a.csv")
+            assert (blob.content_type, blob.content_encoding) == ("text/csv", "gzip")
+
+            download_file("project", "bucket", "up/a.csv", path)
+            with open(path, "rb") as f:
+                assert f.read() == text
+
+            download_files("project", "bucket", "up", directory)
+            with open(path, "rb") as f:
+                assert f.read() == text
+
+    def test_not_compressed_by_default(self, server):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self._write(directory, "a.csv", b"x,y\n" * 100)
+            upload_file("project", "bucket", "up", path)
+
+        blob = gcs.get_storage_bucket("project", "bucket").get_blob("up/a.csv")
+        assert blob.content_encoding is None
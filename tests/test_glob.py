@@ -0,0 +1,134 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import os
+import tempfile
+
+import pytest
+
+from gcsutils import gcs
+from gcsutils.glob import GlobPattern
+
+NAMES = [
+    "surveys/2019-12/a.tif",
+    "surveys/2020-01/a.tif",
+    "surveys/2020-01/a.json",
+    "surveys/2020-01/x/y/b.tif",
+    "surveys/2020-02/c.tif",
+    "surveys/2021-01/d.tif",
+    "other/2020-01/e.tif",
+]
+
+
+@pytest.fixture
+def objects():
+    return {name: name.encode() for name in NAMES}
+
+
+class TestGlobPattern:
+    @pytest.mark.parametrize(
+        "pattern,name,expected",
+        [
+            ("a/*.tif", "a/b.tif", True),
+            ("a/*.tif", "a/b/c.tif", False),
+            ("a/**/*.tif", "a/b.tif", True),
+            ("a/**/*.tif", "a/b/c/d.tif", True),
+            ("a/**", "a/b/c", True),
+            ("a/?.tif", "a/bb.tif", False),
+            ("a/[bc].tif", "a/c.tif", True),
+            ("a/[!bc].tif", "a/c.tif", False),
+            ("a[!x]b", "ayb", True),
+            ("a[!x]b", "a/b", False),
+            ("a/[!x]/c", "a///c", False),
+            ("a[+-0]b", "a/b", False),
+            ("a[!]]b", "a]b", False),
+            ("a/[.tif", "a/[.tif", True),
+            ("a+b/(c).tif", "a+b/(c).tif", True),
+        ],
+    )
+    def test_match(self, pattern, name, expected):
+        assert GlobPattern(pattern).match(name) is expected
+
+    def test_literal_prefix(self):
+        pattern = GlobPattern("surveys/2020-*/**/*.tif")
+
+        assert pattern.literal_prefix == "surveys/2020-"
+        assert pattern.segment_prefix(1) == "2020-"
+        assert pattern.is_literal(0)
+        assert not pattern.is_literal(1)
+
+
+class TestMatching:
+    def test_list_matching(self, server):
+        blobs = gcs.list_matching("project", "bucket", "surveys/2020-*/**/*.tif")
+
+        assert sorted(b.name for b in blobs) == [
+            "surveys/2020-01/a.tif",
+            "surveys/2020-01/x/y/b.tif",
+            "surveys/2020-02/c.tif",
+        ]
+
+    def test_prefixes_and_delimiters_are_pushed_down(self, server, monkeypatch):
+        bucket = gcs.get_storage_bucket("project", "bucket")
+        listings = []
+        list_blobs = type(bucket).list_blobs
+
+        def record(self, **kwargs):
+            listings.append((kwargs["prefix"], kwargs.get("delimiter")))
+            return list_blobs(self, **kwargs)
+
+        monkeypatch.setattr(type(bucket), "list_blobs", record)
+        blobs = gcs.list_matching("project", "bucket", "surveys/2020-*/*.tif")
+
+        assert sorted(b.name for b in blobs) == [
+            "surveys/2020-01/a.tif",
+            "surveys/2020-02/c.tif",
+        ]
+        # "other/" and "surveys/2019-12/" and "surveys/2021-01/" are never listed
+        assert listings == [
+            ("surveys/2020-", "/"),
+            ("surveys/2020-01/", "/"),
+            ("surveys/2020-02/", "/"),
+        ]
+
+    def test_download_matching(self, server):
+        with tempfile.TemporaryDirectory() as directory:
+            summary = gcs.download_matching(
+                "project", "bucket", "surveys/2020-0[1]/**", directory
+            )
+
+            downloaded = sorted(
+                os.path.relpath(os.path.join(root, f), directory)
+                for root, _, files in os.walk(directory)
+                for f in files
+            )
+        assert summary.succeeded == 3
+        assert downloaded == [
+            os.path.join("2020-01", "a.json"),
+            os.path.join("2020-01", "a.tif"),
+            os.path.join("2020-01", "x", "y", "b.tif"),
+        ]
+
+    def test_delete_matching(self, server):
+        failures = gcs.delete_matching("project", "bucket", "*/2020-*/*.tif")
+
+        assert failures == {}
+        assert server.list_objects("bucket") == [
+            "surveys/2019-12/a.tif",
+            "surveys/2020-01/a.json",
+            "surveys/2020-01/x/y/b.tif",
+            "surveys/2021-01/d.tif",
+        ]
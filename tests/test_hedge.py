@@ -0,0 +1,139 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+import threading
+
+import pytest
+
+from gcsutils.hedge import HedgePolicy
+
+
+def _trained(latency=0.01, **kwargs):
+    policy = HedgePolicy(min_samples=10, **kwargs)
+    for _ in range(10):
+        policy.record(latency)
+    return policy
+
+
+class TestHedgePolicy:
+    def test_delay_is_a_percentile_of_recent_latencies(self):
+        policy = HedgePolicy(percentile=90, min_samples=5, window=10)
+        assert policy.delay() is None
+
+        for latency in range(1, 21):
+            policy.record(latency / 100)
+
+        assert policy.delay() == 0.19
+
+    def test_fast_operations_are_not_hedged(self):
+        policy = _trained(latency=5)
+
+        assert policy.run(lambda cancel: "done") == "done"
+        assert policy.hedges == 0
+
+    def test_slow_operation_is_hedged_and_cancelled(self):
+        policy = _trained()
+        first = threading.Event()
+        released = threading.Event()
+        cancelled = []
+
+        def operation(cancel):
+            if not first.is_set():
+                first.set()
+                released.wait(5)
+                cancelled.append(cancel.is_set())
+                return "slow"
+            return "fast"
+
+        assert policy.run(operation) == "fast"
+        released.set()
+
+        assert policy.hedges == 1
+        policy._executor.shutdown(wait=True)
+        assert cancelled == [True]
+
+    def test_records_latency_from_the_first_attempt(self):
+        policy = _trained(latency=0.05)
+        released = threading.Event()
+        attempts = []
+
+        def operation(cancel):
+            attempts.append(None)
+            if len(attempts) == 1:
+                released.wait(5)
+            return "done"
+
+        assert policy.run(operation) == "done"
+        released.set()
+
+        assert policy.hedges == 1
+        assert policy._latencies[-1] >= 0.05
+
+    def test_uses_the_other_attempt_when_one_fails(self):
+        policy = _trained()
+        attempts = []
+
+        def operation(cancel):
+            attempts.append(None)
+            if len(attempts) == 1:
+                cancel.wait(0.2)
+                raise IOError("slow and broken")
+            return "ok"
+
+        assert policy.run(operation) == "ok"
+
+    def test_raises_when_every_attempt_fails(self):
+        policy = HedgePolicy()
+
+        def operation(cancel):
+            raise IOError("broken")
+
+        with pytest.raises(IOError):
+            policy.run(operation)
+
+    def test_hedge_rate_is_capped(self):
+        policy = _trained(latency=0, max_hedge_rate=0.1, max_burst=1)
+        release = threading.Event()
+
+        def operation(cancel):
+            release.wait(0.05)
+            return "done"
+
+        for _ in range(10):
+            policy.run(operation)
+
+        assert policy.requests == 10
+        assert 1 <= policy.hedges <= 2
+
+    def test_hedges_coroutines(self):
+        policy = _trained()
+        attempts = []
+        cancelled = []
+
+        async def operation():
+            attempts.append(None)
+            if len(attempts) == 1:
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+            return len(attempts)
+
+        assert asyncio.run(policy.run_async(operation)) == 2
+        assert cancelled == [True]
+        assert policy.hedges == 1
@@ -0,0 +1,131 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import os
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from gcsutils import gcs
+from gcsutils import index as index_module
+from gcsutils.index import ListingIndex
+from gcsutils.retry import RetryPolicy
+
+
+def _names(objects):
+    return [o.name for o in objects]
+
+
+@pytest.fixture
+def objects():
+    names = ["top.txt", "a/1.tif", "a/2.json", "a/b/3.tif", "c/4.tif"]
+    objects = {"root/" + name: name.encode() for name in names}
+    objects["rootless"] = b""
+    return objects
+
+
+@pytest.fixture
+def index_path(directory):
+    return os.path.join(directory, "index.sqlite")
+
+
+class TestListingIndex:
+    def test_queries(self, server, index_path):
+        with ListingIndex(index_path, "project", "bucket") as index:
+            assert index.refresh("root") == 5
+
+            assert _names(index.contents("root")) == ["root/top.txt"]
+            assert _names(index.contents("root/a", recurse=True)) == [
+                "root/a/1.tif",
+                "root/a/2.json",
+                "root/a/b/3.tif",
+            ]
+            assert index.folders("root") == ["a", "c"]
+            assert index.folders("root/a") == ["b"]
+            assert _names(index.glob("root/*/*.tif")) == [
+                "root/a/1.tif",
+                "root/c/4.tif",
+            ]
+            assert _names(index.glob("root/**/*.tif")) == [
+                "root/a/1.tif",
+                "root/a/b/3.tif",
+                "root/c/4.tif",
+            ]
+            top = index.contents("root")[0]
+            assert top.size == len("top.txt")
+            assert top.crc32c and top.generation and top.updated
+
+    def test_only_new_and_expired_folders_are_relisted(self, server, index_path):
+        with ListingIndex(index_path, "project", "bucket") as index:
+            index.refresh("root")
+            server.put_object("bucket", "root/a/5.tif", b"")
+            server.put_object("bucket", "root/d/6.tif", b"")
+            gcs.delete_file("project", "bucket", "root/c/4.tif")
+
+            # The top level and the new folder "d" are listed; "a" is fresh
+            assert index.refresh("root") == 2
+            assert index.folders("root") == ["a", "d"]
+            assert "root/a/5.tif" not in _names(index.glob("root/a/*"))
+
+            index.ttl = 0
+            assert index.refresh("root") == 6
+            assert "root/a/5.tif" in _names(index.glob("root/a/*"))
+
+    def test_force_relists_every_folder(self, server, index_path):
+        with ListingIndex(index_path, "project", "bucket") as index:
+            index.refresh("root")
+            server.put_object("bucket", "root/a/5.tif", b"")
+
+            assert index.refresh("root", force=True) == 6
+
+    def test_index_persists(self, server, index_path):
+        with ListingIndex(index_path, "project", "bucket") as index:
+            index.refresh("root")
+
+        with ListingIndex(index_path, "project", "bucket") as index:
+            assert len(index.contents("root", recurse=True)) == 5
+            assert index.contents("root", recurse=True) == index.glob("root/**")
+
+    def test_listing_does_not_lock_the_index(self, server, index_path):
+        list_sharded = index_module.list_sharded
+        writable = []
+
+        def check_while_listing(*args, **kwargs):
+            for info in list_sharded(*args, **kwargs):
+                # Another process can still write to the index file
+                other = sqlite3.connect(index_path, timeout=0)
+                other.execute("BEGIN IMMEDIATE")
+                other.rollback()
+                other.close()
+                writable.append(info.name)
+                yield info
+
+        with ListingIndex(index_path, "project", "bucket") as index:
+            with patch("gcsutils.index.list_sharded", check_while_listing):
+                index.refresh("root")
+
+        assert len(writable) == 4
+
+    def test_folders_are_listed_with_the_retry_policy(self, server, index_path):
+        retry = RetryPolicy(max_attempts=2)
+        with ListingIndex(index_path, "project", "bucket", retry=retry) as index:
+            with patch(
+                "gcsutils.index.list_sharded", wraps=index_module.list_sharded
+            ) as listed:
+                index.refresh("root")
+
+        assert {c.kwargs["retry"] for c in listed.call_args_list} == {retry}
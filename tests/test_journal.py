@@ -0,0 +1,147 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import os
+from unittest.mock import patch
+
+import pytest
+from google.api_core.exceptions import ServiceUnavailable
+
+from gcsutils import gcs
+from gcsutils.journal import TransferJournal
+from gcsutils.manifest import crc32c_of_file
+from gcsutils.retry import NO_RETRY
+from gcsutils.transfer import TransferError
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class TestTransferJournal:
+    def test_completed_items_survive_a_restart(self, directory):
+        path = os.path.join(directory, "journal")
+        file_path = os.path.join(directory, "a")
+        _write(file_path, b"abc")
+        with TransferJournal(path) as journal:
+            assert not journal.is_complete(file_path, "dir/a")
+            journal.record(file_path, "dir/a", 3, "crc")
+
+        with TransferJournal(path) as journal:
+            assert len(journal) == 1
+            assert journal.is_complete(file_path, "dir/a")
+            assert not journal.is_complete(file_path, "dir/b")
+
+            _write(file_path, b"abcd")
+            assert not journal.is_complete(file_path, "dir/a")
+
+    def test_same_size_edits_are_detected(self, directory):
+        path = os.path.join(directory, "journal")
+        file_path = os.path.join(directory, "a")
+        _write(file_path, b"abc")
+        with TransferJournal(path) as journal:
+            journal.record(file_path, "a", 3, crc32c_of_file(file_path))
+
+            _write(file_path, b"xyz")
+            os.utime(file_path, ns=(0, 1))
+            assert not journal.is_complete(file_path, "a")
+
+            # A file that was only touched still matches its checksum
+            _write(file_path, b"abc")
+            os.utime(file_path, ns=(0, 2))
+            assert journal.is_complete(file_path, "a")
+
+    def test_torn_lines_are_ignored(self, directory):
+        path = os.path.join(directory, "journal")
+        file_path = os.path.join(directory, "a")
+        _write(file_path, b"abc")
+        with TransferJournal(path) as journal:
+            journal.record(file_path, "a", 3, "crc")
+        with open(path, "a") as f:
+            f.write('["{}","b",3'.format(file_path))
+
+        with TransferJournal(path) as journal:
+            journal.record(file_path, "c", 3, "crc")
+        with TransferJournal(path) as journal:
+            assert len(journal) == 2
+            assert journal.is_complete(file_path, "c")
+
+
+class TestResumableTransfers:
+    def test_upload_resumes_after_a_failure(self, server, directory):
+        source = os.path.join(directory, "source")
+        os.makedirs(source)
+        for name in ["a", "b", "c"]:
+            _write(os.path.join(source, name), name.encode())
+        journal_path = os.path.join(directory, "journal")
+        upload = gcs._upload_with_retry
+
+        def fail_on_b(blob, file_path, retry, if_generation_match=None):
+            if blob.name.endswith("/b"):
+                raise ServiceUnavailable("preempted")
+            return upload(blob, file_path, retry, if_generation_match)
+
+        with patch("gcsutils.gcs._upload_with_retry", side_effect=fail_on_b):
+            with pytest.raises(TransferError):
+                gcs.upload_files(
+                    "project",
+                    "bucket",
+                    "up",
+                    source,
+                    retry=NO_RETRY,
+                    journal_path=journal_path,
+                )
+
+        with patch("gcsutils.gcs._upload_with_retry", side_effect=upload) as uploads:
+            summary = gcs.upload_files(
+                "project", "bucket", "up", source, journal_path=journal_path
+            )
+
+        assert [c.args[0].name for c in uploads.call_args_list] == ["up/b"]
+        assert (summary.succeeded, summary.skipped) == (1, 2)
+        assert server.list_objects("bucket") == ["up/a", "up/b", "up/c"]
+
+        # A file edited without changing its size is uploaded again
+        _write(os.path.join(source, "a"), b"A")
+        os.utime(os.path.join(source, "a"), ns=(0, 1))
+        summary = gcs.upload_files(
+            "project", "bucket", "up", source, journal_path=journal_path
+        )
+        assert (summary.succeeded, summary.skipped) == (1, 2)
+        assert server.get_object("bucket", "up/a") == b"A"
+
+    def test_download_skips_completed_files(self, server, directory):
+        for name in ["a", "b"]:
+            server.put_object("bucket", "down/" + name, name.encode())
+        journal_path = os.path.join(directory, "journal")
+        target = os.path.join(directory, "target")
+        os.makedirs(target)
+
+        summary = gcs.download_files(
+            "project", "bucket", "down", target, journal_path=journal_path
+        )
+        assert (summary.succeeded, summary.skipped) == (2, 0)
+
+        # A truncated file is downloaded again
+        _write(os.path.join(target, "b"), b"")
+        summary = gcs.download_files(
+            "project", "bucket", "down", target, journal_path=journal_path
+        )
+
+        assert (summary.succeeded, summary.skipped) == (1, 1)
+        with open(os.path.join(target, "b"), "rb") as f:
+            assert f.read() == b"b"
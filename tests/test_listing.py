@@ -0,0 +1,101 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+from unittest.mock import patch
+
+import pytest
+from google.api_core.exceptions import Forbidden
+
+from gcsutils import gcs, listing
+from gcsutils.listing import ObjectInfo, list_sharded
+from gcsutils.retry import NO_RETRY
+
+NAMES = ["top"] + [
+    "{}/{}/{}".format(a, b, c) for a in "abc" for b in "xyz" for c in range(5)
+]
+
+
+@pytest.fixture
+def objects():
+    objects = {"root/" + name: name.encode() for name in NAMES}
+    objects["other"] = b""
+    return objects
+
+
+@pytest.fixture
+def bucket(server):
+    return gcs.get_storage_bucket("project", "bucket")
+
+
+class TestListSharded:
+    @pytest.mark.parametrize("max_workers", [1, 16])
+    def test_lists_every_object_once(self, bucket, max_workers):
+        objects = list(list_sharded(bucket, "root/", max_workers=max_workers))
+
+        assert sorted(o.name for o in objects) == sorted("root/" + n for n in NAMES)
+        top = next(o for o in objects if o.name == "root/top")
+        assert top.size == 3
+        assert isinstance(top.generation, int)
+        assert top.crc32c
+
+    def test_splits_folders_into_shards(self, bucket):
+        listed = []
+        list_pages = listing.list_pages
+
+        def record(bucket, prefix, delimiter, fields, retry):
+            listed.append((prefix, delimiter))
+            return list_pages(bucket, prefix, delimiter, fields, retry)
+
+        with patch("gcsutils.listing.list_pages", side_effect=record):
+            list(list_sharded(bucket, "root/", max_workers=1))
+
+        # Four shards per worker are split by folder; the rest are listed whole
+        assert len([d for _, d in listed if d == "/"]) == 4
+        assert ("root/", "/") in listed
+        assert len(listed) == 1 + 3 + 9
+
+    def test_requests_only_the_named_fields(self):
+        assert listing._fields_parameter(["size"]) == (
+            "items(name,size),prefixes,nextPageToken"
+        )
+        with pytest.raises(ValueError):
+            listing._fields_parameter(["metadata"])
+
+    def test_stopping_early_cancels_the_listing(self, bucket):
+        objects = list_sharded(bucket, "root/", max_workers=2)
+
+        assert isinstance(next(objects), ObjectInfo)
+        objects.close()
+
+    def test_errors_are_raised(self, bucket):
+        list_pages = listing.list_pages
+
+        def fail_in_b(bucket, prefix, delimiter, fields, retry):
+            if prefix.startswith("root/b/"):
+                raise Forbidden("denied")
+            return list_pages(bucket, prefix, delimiter, fields, retry)
+
+        with patch("gcsutils.listing.list_pages", side_effect=fail_in_b):
+            with pytest.raises(Forbidden):
+                list(list_sharded(bucket, "root/", retry=NO_RETRY))
+
+
+class TestListObjects:
+    def test_lists_below_the_bucket_path(self, bucket):
+        objects = gcs.list_objects("project", "bucket", "root", fields=["name"])
+
+        names = sorted(o.name for o in objects)
+        assert names == sorted("root/" + n for n in NAMES)
@@ -0,0 +1,72 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import os
+import tempfile
+from unittest.mock import patch
+
+from gcsutils.manifest import HashManifest, crc32c_of_file
+
+
+def test_crc32c_of_file():
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(b"hello world")
+        f.flush()
+
+        # gsutil hash -c reports yZRlqg== for "hello world"
+        assert crc32c_of_file(f.name) == "yZRlqg=="
+
+
+class TestHashManifest:
+    def test_hashes_each_unchanged_file_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "a")
+            with open(file_path, "wb") as f:
+                f.write(b"hello world")
+            manifest_path = os.path.join(directory, "manifest.json")
+
+            with HashManifest(manifest_path) as manifest:
+                assert manifest.crc32c("a", file_path) == "yZRlqg=="
+
+            with patch("gcsutils.manifest.crc32c_of_file") as mock_crc32c:
+                reloaded = HashManifest(manifest_path)
+                assert reloaded.crc32c("a", file_path) == "yZRlqg=="
+            mock_crc32c.assert_not_called()
+
+    def test_rehashes_changed_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "a")
+            with open(file_path, "wb") as f:
+                f.write(b"hello world")
+            manifest = HashManifest(os.path.join(directory, "manifest.json"))
+            manifest.record("a", file_path, "yZRlqg==", generation=3)
+
+            with open(file_path, "wb") as f:
+                f.write(b"hello there!")
+
+            assert manifest.generation("a", file_path) is None
+            assert manifest.crc32c("a", file_path) != "yZRlqg=="
+
+    def test_generation_of_unchanged_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "a")
+            open(file_path, "wb").close()
+            manifest = HashManifest(os.path.join(directory, "manifest.json"))
+            manifest.record("a", file_path, "AAAAAA==", generation=3)
+
+            assert manifest.generation("a", file_path) == 3
+            manifest.discard("a")
+            assert manifest.generation("a", file_path) is None
@@ -0,0 +1,138 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import os
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+from google.api_core.exceptions import ServiceUnavailable
+
+from gcsutils import gcs, metrics
+from gcsutils.retry import RetryBudget, RetryPolicy
+from gcsutils.testing import FakeGCSServer
+from gcsutils.transfer import run_transfers
+
+
+@pytest.fixture
+def measurements():
+    recorded = []
+    metrics.add_listener(recorded.append)
+    yield recorded
+    metrics.remove_listener(recorded.append)
+
+
+class TestMeasure:
+    def test_reports_duration_bytes_and_errors(self, measurements):
+        with metrics.measure("upload") as measurement:
+            measurement.bytes_transferred = 10
+        with pytest.raises(IOError):
+            with metrics.measure("download"):
+                raise IOError("broken")
+
+        upload, download = measurements
+        assert (upload.kind, upload.operation) == (metrics.OPERATION, "upload")
+        assert upload.bytes_transferred == 10
+        assert upload.seconds >= 0
+        assert isinstance(download.error, IOError)
+
+    def test_counts_retries(self, measurements):
+        policy = RetryPolicy(initial_delay=0, budget=RetryBudget())
+        operation = MagicMock(side_effect=[ServiceUnavailable("a")] * 2 + [None])
+
+        with metrics.measure("copy"):
+            policy.run(operation)
+
+        assert measurements[0].retries == 2
+
+    def test_measured_functions_report_returned_byte_counts(self, measurements):
+        @metrics.measured("download")
+        def download():
+            return 42
+
+        assert download() == 42
+        assert measurements[0].bytes_transferred == 42
+        assert measurements[0].throughput > 0
+
+    def test_listener_errors_are_ignored(self, measurements):
+        def broken(measurement):
+            raise RuntimeError
+
+        metrics.add_listener(broken)
+        try:
+            with metrics.measure("list"):
+                pass
+        finally:
+            metrics.remove_listener(broken)
+
+        assert len(measurements) == 1
+
+
+class TestInstrumentation:
+    def test_transfers_report_queue_wait(self, measurements):
+        run_transfers(lambda source, destination: 0, [(1, 1), (2, 2)], 1)
+
+        waits = [m for m in measurements if m.kind == metrics.QUEUE_WAIT]
+        assert len(waits) == 2
+
+    def test_client_creation_is_measured(self, measurements):
+        gcs.clear_client_cache()
+        with patch("gcsutils.gcs._get_storage_client"):
+            gcs.get_storage_client("project")
+            gcs.get_storage_client("project")
+        gcs.clear_client_cache()
+
+        assert [m.kind for m in measurements] == [metrics.CLIENT_CREATION]
+
+    def test_uploads_and_downloads_are_measured(self, measurements, monkeypatch):
+        with FakeGCSServer() as server, tempfile.TemporaryDirectory() as directory:
+            monkeypatch.setenv("STORAGE_EMULATOR_HOST", server.url)
+            gcs.clear_client_cache()
+            file_path = os.path.join(directory, "a.txt")
+            with open(file_path, "wb") as f:
+                f.write(b"data")
+
+            gcs.upload_file("project", "bucket", "run", file_path)
+            gcs.download_file("project", "bucket", "run/a.txt", file_path)
+        gcs.clear_client_cache()
+
+        operations = [m for m in measurements if m.kind == metrics.OPERATION]
+        assert [(m.operation, m.bytes_transferred) for m in operations] == [
+            ("upload", 4),
+            ("download", 4),
+        ]
+
+
+class TestPrometheusExporter:
+    def test_exports_histograms_and_counters(self):
+        prometheus_client = pytest.importorskip("prometheus_client")
+        registry = prometheus_client.CollectorRegistry()
+        exporter = metrics.PrometheusExporter(registry=registry)
+
+        exporter(metrics.Measurement(metrics.OPERATION, 0.5, "upload", 100, 2))
+        exporter(metrics.Measurement(metrics.QUEUE_WAIT, 0.1))
+        exporter(metrics.Measurement(metrics.CLIENT_CREATION, 0.2))
+
+        def value(name, **labels):
+            return registry.get_sample_value(name, labels)
+
+        labels = {"operation": "upload", "outcome": "ok"}
+        assert value("gcsutils_operation_seconds_count", **labels) == 1
+        assert value("gcsutils_operation_seconds_sum", **labels) == 0.5
+        assert value("gcsutils_transferred_bytes_total", operation="upload") == 100
+        assert value("gcsutils_retries_total", operation="upload") == 2
+        assert value("gcsutils_queue_wait_seconds_count") == 1
+        assert value("gcsutils_client_creation_seconds_sum") == 0.2
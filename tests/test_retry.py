@@ -0,0 +1,156 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from google.api_core.exceptions import (
+    BadRequest,
+    InternalServerError,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+
+from gcsutils.retry import RetryBudget, RetryPolicy, is_retryable
+
+
+def _policy(**kwargs):
+    kwargs.setdefault("initial_delay", 0)
+    kwargs.setdefault("budget", RetryBudget())
+    return RetryPolicy(**kwargs)
+
+
+def _longest_backoff():
+    # Every backoff is as long as its cap, rather than a random fraction of it
+    return patch("gcsutils.retry.random.uniform", side_effect=lambda a, b: b)
+
+
+class TestIsRetryable:
+    def test_throttling_server_errors_and_dropped_connections(self):
+        assert is_retryable(TooManyRequests("slow down"))
+        assert is_retryable(InternalServerError("oops"))
+        assert is_retryable(requests.exceptions.ConnectionError())
+        assert is_retryable(ConnectionResetError())
+
+    def test_client_errors(self):
+        assert not is_retryable(BadRequest("no"))
+        assert not is_retryable(ValueError())
+
+
+class TestRetryPolicy:
+    def test_backoff_is_jittered_below_capped_exponential(self):
+        policy = RetryPolicy(initial_delay=1, max_delay=5, multiplier=2)
+        with patch("gcsutils.retry.random.uniform", side_effect=lambda a, b: b):
+            caps = [policy.backoff(n) for n in range(1, 6)]
+
+        assert caps == [1, 2, 4, 5, 5]
+        assert 0 <= policy.backoff(3) <= 4
+
+    def test_retries_until_success(self):
+        operation = MagicMock(side_effect=[ServiceUnavailable("a"), "done"])
+
+        assert _policy().run(operation) == "done"
+        assert operation.call_count == 2
+
+    def test_gives_up_after_max_attempts(self):
+        operation = MagicMock(side_effect=ServiceUnavailable("a"))
+
+        with pytest.raises(ServiceUnavailable):
+            _policy(max_attempts=3).run(operation)
+
+        assert operation.call_count == 3
+
+    def test_does_not_retry_other_errors(self):
+        operation = MagicMock(side_effect=BadRequest("no"))
+
+        with pytest.raises(BadRequest):
+            _policy().run(operation)
+
+        assert operation.call_count == 1
+
+    def test_does_not_retry_non_idempotent_operations(self):
+        operation = MagicMock(side_effect=[ServiceUnavailable("a"), "done"])
+
+        with pytest.raises(ServiceUnavailable):
+            _policy().run(operation, idempotent=False)
+        assert _policy(retry_non_idempotent=True).run(operation) == "done"
+
+    def test_stops_at_deadline(self):
+        operation = MagicMock(side_effect=ServiceUnavailable("a"))
+        policy = _policy(initial_delay=10, deadline=1)
+
+        with _longest_backoff():
+            with pytest.raises(ServiceUnavailable):
+                policy.run(operation)
+
+        assert operation.call_count == 1
+
+    def test_transfers_are_limited_by_the_transfer_deadline(self):
+        operation = MagicMock(side_effect=[ServiceUnavailable("a"), "done"])
+        policy = _policy(initial_delay=10, deadline=1)
+
+        with _longest_backoff(), patch("gcsutils.retry.time.sleep"):
+            assert policy.run(operation, transfer=True) == "done"
+
+        operation = MagicMock(side_effect=ServiceUnavailable("a"))
+        policy = _policy(initial_delay=10, deadline=None, transfer_deadline=1)
+        with _longest_backoff():
+            with pytest.raises(ServiceUnavailable):
+                asyncio.run(policy.run_async(operation, transfer=True))
+        assert operation.call_count == 1
+
+    def test_stops_when_budget_is_exhausted(self):
+        budget = RetryBudget(ratio=0, min_retries_per_second=0, max_tokens=2)
+        operation = MagicMock(side_effect=ServiceUnavailable("a"))
+
+        with pytest.raises(ServiceUnavailable):
+            _policy(max_attempts=10, budget=budget).run(operation)
+
+        assert operation.call_count == 3
+        assert not budget.withdraw()
+
+    def test_runs_coroutines(self):
+        attempts = []
+
+        async def operation():
+            attempts.append(None)
+            if len(attempts) < 3:
+                raise ServiceUnavailable("a")
+            return "done"
+
+        assert asyncio.run(_policy().run_async(operation)) == "done"
+        assert len(attempts) == 3
+
+    def test_wraps_functions(self):
+        function = MagicMock(side_effect=[ServiceUnavailable("a"), "done"])
+
+        assert _policy()(function)("x", key="y") == "done"
+        function.assert_called_with("x", key="y")
+
+
+class TestRetryBudget:
+    def test_operations_earn_retries(self):
+        budget = RetryBudget(ratio=0.5, min_retries_per_second=0, max_tokens=1)
+        assert budget.withdraw()
+        assert not budget.withdraw()
+
+        budget.deposit()
+        budget.deposit()
+
+        assert budget.withdraw()
+        assert not budget.withdraw()
@@ -0,0 +1,211 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from gcsutils import gcs, scheduler
+from gcsutils.hedge import HedgePolicy
+from gcsutils.scheduler import (
+    BULK,
+    DOWNLOAD,
+    INTERACTIVE,
+    UPLOAD,
+    MemoryBudget,
+    TokenBucket,
+)
+from gcsutils.transfer import run_transfers
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestTokenBucket:
+    @pytest.fixture(autouse=True)
+    def clock(self):
+        # The clock stands still, so no tokens accrue between calls
+        with patch("gcsutils.scheduler.time.monotonic", return_value=0.0):
+            with patch("gcsutils.scheduler.time.sleep") as sleep:
+                yield sleep
+
+    def test_bursts_then_limits_the_rate(self, clock):
+        bucket = TokenBucket(1000, burst=1000)
+        assert bucket.consume(1000) == 0
+        assert bucket.consume(2000) == pytest.approx(2.0)
+        clock.assert_called_once()
+
+    def test_interactive_transfers_skip_the_bulk_debt(self):
+        bucket = TokenBucket(1000, burst=1000)
+        bucket.consume(3000, BULK)
+        # Only its own bytes are waited for, but they are still charged
+        assert bucket.consume(100, INTERACTIVE) == pytest.approx(0.1)
+        assert bucket.consume(100, BULK) == pytest.approx(2.2)
+
+    def test_rejects_a_non_positive_rate(self):
+        with pytest.raises(ValueError):
+            TokenBucket(0)
+
+
+class TestMemoryBudget:
+    def test_waiting_interactive_transfers_are_admitted_first(self):
+        budget = MemoryBudget(100)
+        budget.acquire(60)
+        admitted = []
+
+        def acquire(priority):
+            budget.acquire(60, priority)
+            admitted.append(priority)
+            budget.release(60)
+
+        with ThreadPoolExecutor(2) as executor:
+            executor.submit(acquire, BULK)
+            _wait_until(lambda: budget._waiting[BULK])
+            executor.submit(acquire, INTERACTIVE)
+            _wait_until(lambda: budget._waiting[INTERACTIVE])
+            assert admitted == []
+            budget.release(60)
+
+        assert admitted == [INTERACTIVE, BULK]
+        assert budget.in_flight == 0
+
+    def test_async_waiters_are_admitted_on_release(self):
+        budget = MemoryBudget(100)
+        budget.acquire(60)
+
+        async def main():
+            waiter = asyncio.ensure_future(budget.acquire_async(60, INTERACTIVE))
+            await asyncio.sleep(0.05)
+            assert not waiter.done()
+            threading.Timer(0.05, budget.release, [60]).start()
+            await asyncio.wait_for(waiter, 5)
+
+        asyncio.run(main())
+        assert budget.in_flight == 60
+
+    def test_admits_an_oversized_transfer_when_idle(self):
+        budget = MemoryBudget(10)
+        budget.acquire(50)
+        assert budget.in_flight == 50
+        budget.release(50)
+
+
+class TestTransferScheduler:
+    def test_unlimited_directions_are_not_metered(self, install_scheduler):
+        install_scheduler(download_rate=1000)
+        with scheduler.transfer(UPLOAD, 10) as meter:
+            assert meter is None
+        with scheduler.transfer(DOWNLOAD, 10) as meter:
+            assert meter is not None
+
+    def test_no_scheduler_by_default(self):
+        assert scheduler.get_scheduler() is None
+        with scheduler.transfer(DOWNLOAD, 10) as meter:
+            assert meter is None
+
+    def test_batch_transfers_are_bulk_and_pools_inherit_priority(self):
+        priorities = []
+
+        def transfer(source, destination):
+            priorities.append(scheduler.get_priority())
+            with ThreadPoolExecutor(1) as executor:
+                priorities.append(
+                    executor.submit(scheduler.inherit(scheduler.get_priority)).result()
+                )
+            return 0
+
+        assert scheduler.get_priority() == INTERACTIVE
+        run_transfers(transfer, [("a", "b")])
+        assert priorities == [BULK, BULK]
+
+    def test_download_is_limited_to_the_rate(
+        self, server, install_scheduler, directory
+    ):
+        server.put_object("bucket", "a", os.urandom(96 * 1024))
+        install_scheduler(download_rate=128 * 1024, burst=32 * 1024)
+        path = os.path.join(directory, "a")
+
+        start = time.monotonic()
+        gcs.download_file("project", "bucket", "a", path)
+
+        assert time.monotonic() - start >= 0.4
+        with open(path, "rb") as f:
+            assert f.read() == server.get_object("bucket", "a")
+
+    def test_upload_is_limited_to_the_rate(self, server, install_scheduler, directory):
+        path = os.path.join(directory, "a.json")
+        with open(path, "wb") as f:
+            f.write(os.urandom(96 * 1024))
+        install_scheduler(upload_rate=128 * 1024, burst=32 * 1024)
+
+        start = time.monotonic()
+        gcs.upload_file("project", "bucket", "", path)
+
+        assert time.monotonic() - start >= 0.4
+        with open(path, "rb") as f:
+            assert f.read() == server.get_object("bucket", "a.json")
+
+    def test_uploads_are_charged_for_the_bytes_read(self):
+        charged = []
+        reader = gcs._MeteredReader(io.BytesIO(b"abc"), charged.append)
+
+        assert reader.read(8) == b"abc"
+        assert reader.read(8) == b""
+        assert charged == [3]
+
+    def test_hedged_download_is_scheduled(self, server, install_scheduler, directory):
+        server.put_object("bucket", "a", os.urandom(96 * 1024))
+        install_scheduler(download_rate=128 * 1024, burst=32 * 1024)
+        path = os.path.join(directory, "a")
+
+        start = time.monotonic()
+        gcs.download_file("project", "bucket", "a", path, hedge=HedgePolicy())
+
+        assert time.monotonic() - start >= 0.4
+        with open(path, "rb") as f:
+            assert f.read() == server.get_object("bucket", "a")
+
+    def test_memory_cap_serializes_transfers(
+        self, server, install_scheduler, directory
+    ):
+        for name in "abcd":
+            server.put_object("bucket", "dir/" + name, name.encode() * 1024)
+        transfer_scheduler = install_scheduler(max_in_flight_bytes=1024)
+        peak = 0
+        lock = threading.Lock()
+        acquire = transfer_scheduler.memory.acquire
+
+        def record(nbytes, priority):
+            nonlocal peak
+            acquire(nbytes, priority)
+            with lock:
+                peak = max(peak, transfer_scheduler.memory.in_flight)
+
+        with patch.object(transfer_scheduler.memory, "acquire", record):
+            gcs.download_files("project", "bucket", "dir", directory, max_workers=4)
+
+        assert sorted(os.listdir(directory)) == list("abcd")
+        assert peak == 1024
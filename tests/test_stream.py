@@ -0,0 +1,333 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from google.api_core.exceptions import ServiceUnavailable
+from google.cloud import storage
+
+from gcsutils.gcs import open_blob, upload_stream
+from gcsutils.retry import NO_RETRY, RetryPolicy
+from gcsutils.stream import (
+    UPLOAD_CHUNK_GRANULARITY,
+    BlobReader,
+    BlobWriter,
+    iter_chunks,
+    iter_lines,
+    open_reader,
+    stream_to_blob,
+)
+
+
+class FakeObject:
+    """Serves byte ranges of one object generation and records the requests."""
+
+    def __init__(self, data, content_encoding=None):
+        self.data = data
+        self.content_encoding = content_encoding
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def blob(self, name="obj", generation=None):
+        blob = MagicMock()
+        blob.name = name
+        blob.bucket = self
+        blob.size = len(self.data)
+        blob.generation = 3
+        blob.content_encoding = self.content_encoding
+        blob.download_as_bytes.side_effect = self._download(generation)
+        return blob
+
+    def _download(self, generation):
+        def download_as_bytes(start, end, raw_download, checksum, retry):
+            assert generation == 3
+            with self.lock:
+                self.ranges.append((start, end))
+            stop = end + 1
+            return self.data[start:stop]
+
+        return download_as_bytes
+
+
+class TestBlobReader:
+    def test_reads_whole_object_in_chunks(self):
+        remote = FakeObject(bytes(range(256)) * 4)
+        with BlobReader(remote.blob(), chunk_size=100, read_ahead=0) as reader:
+            assert reader.read() == remote.data
+
+        assert sorted(remote.ranges)[:2] == [(0, 99), (100, 199)]
+        assert len(remote.ranges) == 11
+
+    def test_reads_ahead(self):
+        remote = FakeObject(b"x" * 1000)
+        with BlobReader(remote.blob(), chunk_size=100, read_ahead=3) as reader:
+            reader.read(10)
+            deadline = time.monotonic() + 5
+            while len(remote.ranges) < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # The first chunk, plus the three that follow it
+            assert sorted(remote.ranges) == [
+                (0, 99),
+                (100, 199),
+                (200, 299),
+                (300, 399),
+            ]
+
+    def test_read_ahead_is_held_in_the_memory_budget(self, install_scheduler):
+        memory = install_scheduler(max_in_flight_bytes=250).memory
+        remote = FakeObject(b"x" * 1000)
+        with BlobReader(remote.blob(), chunk_size=100, read_ahead=3) as reader:
+            reader.read(10)
+            # The first chunk and one more fit; both stay reserved once fetched
+            assert memory.in_flight == 200
+            assert reader.read() == remote.data[10:]
+        deadline = time.monotonic() + 5
+        while memory.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert memory.in_flight == 0
+
+    def test_seeks_back_within_a_full_memory_budget(self, install_scheduler):
+        install_scheduler(max_in_flight_bytes=100)
+        remote = FakeObject(bytes(range(200)))
+        with BlobReader(remote.blob(), chunk_size=64, read_ahead=2) as reader:
+            reader.seek(150)
+            assert reader.read(1) == bytes([150])
+            reader.seek(70)
+            assert reader.read(1) == bytes([70])
+
+    def test_seeks(self):
+        remote = FakeObject(bytes(range(200)))
+        with BlobReader(remote.blob(), chunk_size=64) as reader:
+            reader.seek(150)
+            assert reader.read(3) == bytes([150, 151, 152])
+            reader.seek(-2, io.SEEK_END)
+            assert reader.read() == bytes([198, 199])
+            reader.seek(10)
+            assert reader.read(1) == bytes([10])
+            with pytest.raises(ValueError):
+                reader.seek(-1)
+
+    def test_retries_from_committed_offset(self):
+        session = FakeUploadSession(commit_limit=CHUNK // 2)
+        put = session.put
+
+        def put_then_drop_connection(url, data, headers):
+            response = put(url, data, headers)
+            if len(session.requests) == 1:
+                raise requests.exceptions.ConnectionError
+            return response
+
+        session.put = put_then_drop_connection
+        data = os.urandom(CHUNK * 2)
+        retry = RetryPolicy(initial_delay=0)
+
+        with BlobWriter(_blob_for(session), chunk_size=CHUNK, retry=retry) as writer:
+            writer.write(data)
+
+        assert bytes(session.data) == data
+        assert session.requests[1] == ("bytes */*", 0)
+
+    def test_empty_object(self):
+        with BlobReader(FakeObject(b"").blob()) as reader:
+            assert reader.read() == b""
+
+
+class TestOpenReader:
+    def test_decompresses_gzip_encoded_objects(self):
+        remote = FakeObject(gzip.compress(b"a,b\n1,2\n"), content_encoding="gzip")
+        with open_reader(remote.blob(), chunk_size=4) as f:
+            assert list(iter_lines(f)) == ["a,b", "1,2"]
+
+    def test_iter_chunks(self):
+        with open_reader(FakeObject(b"abcdefg").blob(), chunk_size=2) as f:
+            assert list(iter_chunks(f, 3)) == [b"abc", b"def", b"g"]
+
+
+class TestOpenBlob:
+    def test_text_mode(self):
+        remote = FakeObject("line one\nline two\n".encode("utf-8"))
+        mock_bucket = MagicMock()
+        mock_bucket.blob.return_value = remote.blob("manifest.csv")
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+            with open_blob("project", "bucket", "manifest.csv", mode="r") as f:
+                assert f.readlines() == ["line one\n", "line two\n"]
+
+    def test_rejects_unsupported_modes(self):
+        with pytest.raises(ValueError):
+            open_blob("project", "bucket", "manifest.csv", mode="a")
+
+
+CHUNK = UPLOAD_CHUNK_GRANULARITY
+
+
+class FakeUploadSession:
+    """Implements the resumable upload protocol for a single session."""
+
+    def __init__(self, commit_limit=None, fail_after=None):
+        self.data = bytearray()
+        self.complete = False
+        self.requests = []
+        # Commit at most this many bytes of each request, like a slow server
+        self.commit_limit = commit_limit
+        # Fail with a 503 once this many requests have been made
+        self.fail_after = fail_after
+
+    def _response(self, status, headers=None, body=b""):
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers or {})
+        response._content = body
+        response.request = requests.Request("PUT", "https://upload").prepare()
+        return response
+
+    def put(self, url, data, headers):
+        self.requests.append((headers["Content-Range"], len(data)))
+        if self.fail_after is not None and len(self.requests) > self.fail_after:
+            return self._response(503, body=b'{"error": {"message": "down"}}')
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", headers["Content-Range"])
+        if match:
+            start = int(match.group(1))
+            assert start == len(self.data)
+            accepted = data[: self.commit_limit] if self.commit_limit else data
+            self.data += accepted
+        total = headers["Content-Range"].rsplit("/", 1)[1]
+        if total != "*" and int(total) == len(self.data):
+            self.complete = True
+            body = json.dumps({"size": str(len(self.data)), "generation": "1"})
+            return self._response(200, body=body.encode("utf-8"))
+        if not self.data:
+            return self._response(308)
+        return self._response(308, {"Range": "bytes=0-{}".format(len(self.data) - 1)})
+
+
+def _blob_for(session):
+    blob = storage.Blob("out.bin", storage.Bucket(MagicMock(), "bucket"))
+    blob.create_resumable_upload_session = MagicMock(return_value="https://upload")
+    blob.bucket.client._http = session
+    return blob
+
+
+class TestBlobWriter:
+    def test_uploads_in_chunks(self):
+        session = FakeUploadSession()
+        data = os.urandom(CHUNK * 2 + 100)
+        blob = _blob_for(session)
+
+        with BlobWriter(blob, chunk_size=CHUNK) as writer:
+            for piece in iter_chunks(io.BytesIO(data), 1000):
+                writer.write(piece)
+
+        assert bytes(session.data) == data
+        assert session.complete
+        assert [r[1] for r in session.requests] == [CHUNK, CHUNK, 100]
+        assert blob.size == len(data)
+
+    def test_resends_uncommitted_data(self):
+        session = FakeUploadSession(commit_limit=CHUNK - 10)
+        data = os.urandom(CHUNK * 2)
+
+        with BlobWriter(_blob_for(session), chunk_size=CHUNK) as writer:
+            writer.write(data)
+
+        assert bytes(session.data) == data
+        assert session.complete
+
+    def test_empty_object(self):
+        session = FakeUploadSession()
+
+        BlobWriter(_blob_for(session), chunk_size=CHUNK).close()
+
+        assert session.complete
+        assert session.requests == [("bytes */0", 0)]
+
+    def test_abandons_upload_on_exception(self):
+        session = FakeUploadSession()
+
+        with pytest.raises(RuntimeError):
+            with BlobWriter(_blob_for(session), chunk_size=CHUNK) as writer:
+                writer.write(b"partial")
+                raise RuntimeError
+
+        assert not session.complete
+        assert session.requests == []
+
+    def test_rejects_invalid_chunk_size(self):
+        with pytest.raises(ValueError):
+            BlobWriter(_blob_for(FakeUploadSession()), chunk_size=1000)
+
+
+class TestUploadStream:
+    def test_resumes_interrupted_upload(self):
+        session = FakeUploadSession(fail_after=1)
+        data = os.urandom(CHUNK * 3 + 5)
+
+        with pytest.raises(ServiceUnavailable):
+            stream_to_blob(_blob_for(session), io.BytesIO(data), CHUNK, retry=NO_RETRY)
+        assert len(session.data) == CHUNK
+
+        session.fail_after = None
+        source = io.BytesIO(data)
+        stream_to_blob(_blob_for(session), source, CHUNK, "https://upload")
+
+        assert bytes(session.data) == data
+        assert session.complete
+
+    def test_resumes_from_iterator(self):
+        session = FakeUploadSession()
+        data = os.urandom(CHUNK + 50)
+        session.data += data[:CHUNK]
+        pieces = iter_chunks(io.BytesIO(data), 999)
+
+        stream_to_blob(_blob_for(session), pieces, CHUNK, "https://upload")
+
+        assert bytes(session.data) == data
+
+    def test_upload_stream_from_generator(self):
+        session = FakeUploadSession()
+        mock_bucket = MagicMock()
+        mock_bucket.blob.return_value = _blob_for(session)
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+            blob = upload_stream(
+                "project",
+                "bucket",
+                "out.bin",
+                (b"row %d\n" % i for i in range(10)),
+                chunk_size=CHUNK,
+            )
+
+        assert blob.size == len(session.data)
+        assert bytes(session.data).startswith(b"row 0\nrow 1\n")
+
+    def test_open_blob_text_write(self):
+        session = FakeUploadSession()
+        mock_bucket = MagicMock()
+        mock_bucket.blob.return_value = _blob_for(session)
+        with patch("gcsutils.gcs.get_storage_bucket", return_value=mock_bucket):
+            with open_blob("project", "bucket", "out.csv", mode="w") as f:
+                f.write("a,b\n")
+
+        assert bytes(session.data) == b"a,b\n"
+        assert session.complete
@@ -0,0 +1,122 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import gzip
+import os
+import time
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+from gcsutils import gcs
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TestFakeGCSServer:
+    def test_upload_and_download(self, server, directory):
+        path = os.path.join(directory, "a.txt")
+        _write(path, b"hello")
+
+        gcs.upload_file("project", "bucket", "dir", path)
+        gcs.download_file("project", "bucket", "dir/a.txt", path + ".out")
+
+        assert server.get_object("bucket", "dir/a.txt") == b"hello"
+        assert _read(path + ".out") == b"hello"
+
+    def test_composite_upload_and_sliced_download(self, server, directory):
+        path = os.path.join(directory, "big")
+        data = os.urandom(100000)
+        _write(path, data)
+
+        gcs.upload_file("project", "bucket", "", path, composite_threshold=1)
+        gcs.download_file("project", "bucket", "big", path + ".out", sliced_threshold=1)
+
+        assert server.list_objects("bucket") == ["big"]
+        assert _read(path + ".out") == data
+
+    def test_resumable_upload(self, server):
+        data = os.urandom(600 * 1024)
+
+        gcs.upload_stream("project", "bucket", "s", iter([data]), chunk_size=256 * 1024)
+
+        assert server.get_object("bucket", "s") == data
+
+    def test_listing_pages_and_prefixes(self, server, monkeypatch):
+        monkeypatch.setattr("gcsutils.testing._DEFAULT_PAGE_SIZE", 2)
+        for name in ("a/1", "a/2", "a/3", "a/b/4", "a/c/5", "a/c/6"):
+            server.put_object("bucket", name, b"x")
+
+        blobs = gcs.list_bucket_contents("project", "bucket", "a")
+        names = [blob.name for blob in blobs]
+
+        assert names == ["a/1", "a/2", "a/3"]
+        assert blobs.prefixes == {"a/b/", "a/c/"}
+        assert gcs.list_bucket_folders("project", "bucket", "a") == ["b", "c"]
+
+    def test_copy_and_batch_delete(self, server):
+        for name in ("a/1", "a/2", "b"):
+            server.put_object("bucket", name, b"x")
+
+        gcs.copy_file("project", "bucket", "b", "a/3")
+        failures = gcs.delete_prefix("project", "bucket", "a")
+
+        assert failures == {}
+        assert server.list_objects("bucket") == ["b"]
+
+    def test_gzip_objects(self, server, directory):
+        data = b"line\n" * 100
+        server.put_object("bucket", "a.txt", gzip.compress(data), "text/plain", "gzip")
+        path = os.path.join(directory, "a.txt")
+
+        gcs.download_file("project", "bucket", "a.txt", path)
+
+        assert _read(path) == data
+
+    def test_generation_preconditions(self, server):
+        bucket = gcs.get_storage_bucket("project", "bucket")
+        bucket.blob("a").upload_from_string(b"1", if_generation_match=0)
+
+        with pytest.raises(PreconditionFailed):
+            bucket.blob("a").upload_from_string(b"2", if_generation_match=0)
+        assert server.get_object("bucket", "a") == b"1"
+
+    def test_latency_and_bandwidth(self, server):
+        server.put_object("bucket", "a", b"x" * 20000)
+        bucket = gcs.get_storage_bucket("project", "bucket")
+        server.latency, server.bandwidth = 0.1, 100000
+
+        start = time.monotonic()
+        data = bucket.blob("a").download_as_bytes()
+        elapsed = time.monotonic() - start
+
+        assert data == b"x" * 20000
+        # At least the injected latency plus 20 KB at 100 KB/s
+        assert elapsed >= 0.3
+
+    def test_updated_timestamps_are_rfc3339(self, server):
+        server.put_object("bucket", "a", b"1")
+        blob = gcs.get_storage_bucket("project", "bucket").get_blob("a")
+
+        assert blob.updated is not None
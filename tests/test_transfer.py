@@ -0,0 +1,95 @@
+"""
+Copyright Vulcan Inc. 2018-2020.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the "license" file accompanying this file. This file is distributed
+on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+express or implied. See the License for the specific language governing
+permissions and limitations under the License.
+"""
+
+
+import threading
+
+import pytest
+
+from gcsutils.transfer import TransferError, TransferSummary, run_transfers
+
+
+class TestRunTransfers:
+    def test_runs_transfers_concurrently(self):
+        barrier = threading.Barrier(4, timeout=5)
+
+        def transfer(source, destination):
+            barrier.wait()
+            return len(source)
+
+        items = [("abc", "x"), ("de", "y"), ("f", "z"), ("ghij", "w")]
+        summary = run_transfers(transfer, items, max_workers=4)
+
+        assert summary.succeeded == 4
+        assert summary.bytes_transferred == 10
+        assert summary.failures == []
+
+    def test_failures_do_not_abort_the_batch(self):
+        def transfer(source, destination):
+            if source == "bad":
+                raise IOError("boom")
+            return 1
+
+        results = []
+        items = iter([("good", "a"), ("bad", "b"), ("good", "c")])
+        summary = run_transfers(
+            transfer, items, max_workers=1, on_result=results.append
+        )
+
+        assert summary.succeeded == 2
+        assert summary.failed == 1
+        assert summary.failures[0].source == "bad"
+        assert isinstance(summary.failures[0].error, IOError)
+        assert len(results) == 3
+
+    def test_consumes_items_lazily(self):
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield (str(i), str(i))
+
+        def transfer(source, destination):
+            return len(consumed) - int(source)
+
+        lags = []
+        run_transfers(
+            transfer,
+            items(),
+            max_workers=2,
+            on_result=lambda r: lags.append(r.bytes_transferred),
+        )
+
+        # Never more than 2 * max_workers items are queued ahead of the pool
+        assert max(lags) <= 5
+
+    def test_raises_for_invalid_worker_count(self):
+        with pytest.raises(ValueError):
+            run_transfers(lambda s, d: 0, [], max_workers=0)
+
+
+class TestTransferError:
+    def test_message_summarizes_failures(self):
+        summary = run_transfers(
+            lambda s, d: 1 / 0, [("a", "b"), ("c", "d")], max_workers=1
+        )
+        error = TransferError(summary)
+
+        assert error.summary is summary
+        assert "2 of 2 transfers failed" in str(error)
+
+    def test_throughput_of_empty_summary(self):
+        assert TransferSummary().throughput == 0.0